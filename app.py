@@ -1,43 +1,57 @@
 import os
 import gradio as gr
 
-from paper2cmap import Paper2CMap
+from paper2cmap.service import CMapService, QueueFullError
 
+# one pool of workers for all users, so a burst of clicks queues up instead of starting a pipeline each
+service = CMapService(
+    num_workers=int(os.environ.get("PAPER2CMAP_WORKERS", 4)),
+    max_queue_size=int(os.environ.get("PAPER2CMAP_QUEUE_SIZE", 16)),
+)
 
-def set_key(openai_api_key, model_name):
-    os.environ["OPENAI_API_TYPE"] = "openai"
-    os.environ["OPENAI_API_KEY"] = openai_api_key
-    os.environ["OPENAI_MODEL_NAME"] = model_name
-    return openai_api_key, model_name
-
-    
-def load_text(state, paper_path, temperature, max_num_sections):
-    paper2cmap = Paper2CMap(temperature=temperature)
-    paper2cmap.load(paper_path.name)
-    if max_num_sections == -1:
-        text = paper2cmap.paper_reader.full_text
-    else:
-        text = "\n\n".join(paper2cmap.paper_reader.sections[:max_num_sections])
-
-    state["paper2cmap"] = paper2cmap
-    return state, text
-
-
-def generate_cmap(state, max_num_concepts, max_num_links, max_num_sections):
-    paper2cmap = state["paper2cmap"]
-    cmap = paper2cmap.generate_cmap(
-        max_num_concepts=max_num_concepts,
-        max_num_relationships=max_num_links,
-        max_num_iterations=max_num_sections,
-    )
 
-    del state["paper2cmap"]
-    return state, cmap
+def set_key(openai_api_key, model_name):
+    # the credentials stay in the session of the user, not in the environment shared by all users
+    return {"api_type": "openai", "api_key": openai_api_key, "model_name": model_name}
+
+
+def generate_cmap(credentials, paper_path, temperature, max_num_concepts, max_num_links, max_num_sections):
+    if not credentials:
+        raise gr.Error("Please set your OpenAI API key first.")
+    if paper_path is None:
+        raise gr.Error("Please upload a PDF file first.")
+    try:
+        job = service.submit(
+            paper_path.name,
+            credentials=credentials,
+            model_kwargs={"temperature": temperature},
+            max_num_concepts=max_num_concepts,
+            max_num_relationships=max_num_links,
+            max_num_iterations=max_num_sections,
+            max_workers=4,
+        )
+    except QueueFullError:
+        raise gr.Error("The server is busy, please retry in a minute.")
+
+    # stream the queue position, then the running merge of finished sections until the final concept map is ready
+    text = ""
+    for event in service.stream(job):
+        if event["type"] == "queued":
+            yield f"Waiting in queue, position {event['position']}...", None
+        elif event["type"] == "loaded":
+            text = event["text"]
+            yield text, None
+        elif event["type"] == "section":
+            yield text, event["partial_cmap"]
+        elif event["type"] == "final":
+            yield text, event["cmap"]
+        else:
+            raise gr.Error(f"Failed to generate the concept map: {event['error']}")
 
 
 css = ".json {height: 657px; overflow: scroll;} .json-holder {height: 657px; overflow: scroll;}"
 with gr.Blocks(css=css) as demo:
-    state = gr.State(value={})
+    credentials = gr.State(value=None)
     gr.Markdown("<h1><center><a href='https://github.com/whiskyboy/paper2cmap'>Paper2CMap</a></center></h1>")
     gr.Markdown("<p align='center' style='font-size: 20px;'>A library to generate concept map from a research paper. Powered by LLM.</p>")
 
@@ -105,17 +119,13 @@ with gr.Blocks(css=css) as demo:
             concept_map = gr.JSON(label="Concept Map")
 
     # Event Handlers
-    openai_api_key.submit(set_key, [openai_api_key, model_name], [openai_api_key, model_name])
-    set_key_btn.click(set_key, [openai_api_key, model_name], [openai_api_key, model_name])
+    openai_api_key.submit(set_key, [openai_api_key, model_name], [credentials])
+    set_key_btn.click(set_key, [openai_api_key, model_name], [credentials])
 
     generate_btn.click(
-        fn=load_text,
-        inputs=[state, paper_path, temperature, max_num_sections],
-        outputs=[state, text],
-    ).then(
         fn=generate_cmap,
-        inputs=[state, max_num_concepts, max_num_links, max_num_sections],
-        outputs=[state, concept_map],
+        inputs=[credentials, paper_path, temperature, max_num_concepts, max_num_links, max_num_sections],
+        outputs=[text, concept_map],
     )
 
     # Examples
@@ -129,4 +139,5 @@ with gr.Blocks(css=css) as demo:
     )
         
 
-demo.launch()
\ No newline at end of file
+# the handlers mostly wait on the service, so many of them can run at once
+demo.queue(concurrency_count=64).launch()
\ No newline at end of file
@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import asyncio
+import ast
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.chat_models.base import BaseChatModel
+from langchain.pydantic_v1 import PrivateAttr
+from langchain.schema import AIMessage, BaseMessage, ChatGeneration, ChatResult
+
+from paper2cmap.utils import estimate_messages_tokens, estimate_tokens
+
+_WORDS = re.compile(r"[A-Za-z][A-Za-z-]{4,}")
+_LIMITS = re.compile(r"no more than (\d+) concepts and (\d+) relationships")
+_NUMBERED = re.compile(r"^\d+(\.\d+)*\.?\s+[A-Z]")
+_STOPWORDS = {
+    "about", "above", "after", "again", "among", "based", "being", "below", "between", "could", "during",
+    "every", "first", "other", "their", "there", "these", "those", "three", "through", "under", "using",
+    "where", "which", "while", "would", "section", "input", "output", "concepts", "relationships",
+}
+_RELATIONSHIPS = ["is part of", "is used in", "improves", "relies on", "is applied to", "consists of"]
+
+
+class ServiceUnavailableError(Exception):
+    # named like the openai error, so the retry logic of the pool and the policy treats it as transient
+    pass
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    A deterministic chat model for benchmarks and offline runs. It recognizes the prompts of Paper2CMap and answers
+    with canned, schema-valid JSON derived from the words of the input, so the whole pipeline runs without a key.
+
+    The latency and the injected errors of a call only depend on its messages and on how many times they were sent
+    before, so a run is reproducible whatever the concurrency.
+    """
+    model_name: str = "fake-chat-model"
+    temperature: float = 0.0
+    max_tokens: Optional[int] = None
+    latency: float = 0.0
+    """The mean latency of a call in seconds."""
+    latency_jitter: float = 0.0
+    """The relative spread of the latency, e.g. 0.5 for latencies within ±50% of the mean."""
+    latency_per_token: float = 0.0
+    """The additional latency per completion token in seconds."""
+    error_rate: float = 0.0
+    """The probability of a call failing with ServiceUnavailableError."""
+    garbage_pattern: Optional[str] = None
+    """A regular expression: the calls whose messages match it get a reply holding no JSON, like a confused model."""
+
+    _attempts: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    num_calls: int = 0
+    num_errors: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    @staticmethod
+    def _concepts(text: str, max_num_concepts: int) -> List[str]:
+        counts = Counter(word.lower() for word in _WORDS.findall(text) if word.lower() not in _STOPWORDS)
+        return [word for word, _ in counts.most_common(max_num_concepts)]
+
+    @staticmethod
+    def _link(concepts: List[str], max_num_relationships: int) -> List[List[str]]:
+        # a chain through the concepts, plus a star around the most frequent one
+        triples = []
+        for i in range(1, len(concepts)):
+            triples.append([concepts[i], _RELATIONSHIPS[i % len(_RELATIONSHIPS)], concepts[i - 1]])
+            if i >= 2:
+                triples.append([concepts[i], _RELATIONSHIPS[(i + 1) % len(_RELATIONSHIPS)], concepts[0]])
+        return triples[:max_num_relationships]
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
+        if self.garbage_pattern is not None and any(re.search(self.garbage_pattern, message.content) for message in messages):
+            return "I am sorry, but I cannot produce a concept map for this text."
+        system, last = messages[0].content, messages[-1].content
+        limits = _LIMITS.search(last)
+        max_num_concepts, max_num_relationships = (int(limits.group(1)), int(limits.group(2))) if limits else (10, 30)
+        # the input without the instructions around it: the original prompts wrap it in a literal "{\n ... \n}",
+        # the compact prompts put the instructions on the lines after it
+        if "{\\n" in last:
+            data = last[last.index("{\\n") + 3:last.rindex("\\n}")]
+        elif limits and "\n" in last[:limits.start()]:
+            data = last[:last.rfind("\n", 0, limits.start())]
+        else:
+            data = last
+
+        if "section titles" in system:
+            try:
+                candidates = ast.literal_eval(last[last.index("["):])
+            except (ValueError, SyntaxError):
+                candidates = []
+            return json.dumps({"titles": [title for title in candidates if _NUMBERED.match(str(title))]})
+
+        if "answering questions" in system:
+            passages = re.findall(r"^\[(\d+)\] (.*)$", last, re.MULTILINE)
+            if not passages:
+                return "I don't know."
+            sentences = re.split(r"(?<=[.!?])\s+", passages[0][1])
+            return f"{sentences[0]} [{passages[0][0]}]"
+
+        if "summarize" in system and "concept map" not in system:
+            sentences = re.split(r"(?<=[.!?])\s+", " ".join(last.split()))
+            return " ".join(sentences[:3])
+
+        if "merges similar concepts" in system + last:
+            # only the concept labels of the input concept map, either a compact table or JSON triples
+            if "Concepts:" in data:
+                labels = [line.split(" ", 1)[-1] for line in data.split("Relationships:")[0].splitlines()[1:]]
+            else:
+                triples = json.loads(data[data.index("["):data.rindex("]") + 1])
+                labels = [str(label) for triple in triples for label in (triple[0], triple[-1])]
+            concepts = self._concepts(" ".join(labels), max_num_concepts)
+        else:
+            concepts = self._concepts(data, max_num_concepts)
+        cmap = self._link(concepts, max_num_relationships)
+
+        if '"summary"' in system:
+            return json.dumps({"summary": " ".join(concepts[:5]), "cmap": cmap})
+        return json.dumps(cmap)
+
+    def _plan(self, messages: List[BaseMessage]) -> Tuple[str, float, bool]:
+        digest = hashlib.sha1("\x00".join(message.content for message in messages).encode("utf-8")).hexdigest()
+        with self._lock:
+            attempt = self._attempts.get(digest, 0)
+            self._attempts[digest] = attempt + 1
+            self.num_calls += 1
+        draw = hashlib.sha1(f"{digest}:{attempt}".encode("utf-8")).digest()
+        jitter, failure = draw[0] / 255, draw[1] / 256
+
+        content = self._respond(messages)
+        latency = self.latency * (1 + self.latency_jitter * (2 * jitter - 1)) + self.latency_per_token * estimate_tokens(content)
+        if failure < self.error_rate:
+            with self._lock:
+                self.num_errors += 1
+            return "", latency, True
+        return content, latency, False
+
+    def _result(self, messages: List[BaseMessage], content: str) -> ChatResult:
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=content))],
+            llm_output={"token_usage": {
+                "prompt_tokens": estimate_messages_tokens(messages),
+                "completion_tokens": estimate_tokens(content),
+                "total_tokens": estimate_messages_tokens(messages) + estimate_tokens(content),
+            }},
+        )
+
+    def _combine_llm_outputs(self, llm_outputs: List[Dict | None]) -> Dict:
+        token_usage: Dict[str, int] = {}
+        for llm_output in llm_outputs:
+            for key, value in ((llm_output or {}).get("token_usage") or {}).items():
+                token_usage[key] = token_usage.get(key, 0) + value
+        return {"token_usage": token_usage, "model_name": self.model_name}
+
+    def _generate(self, messages: List[BaseMessage], stop: List[str] | None = None, run_manager: Any = None,
+                  **kwargs: Any) -> ChatResult:
+        content, latency, failed = self._plan(messages)
+        time.sleep(latency)
+        if failed:
+            raise ServiceUnavailableError("Injected failure")
+        return self._result(messages, content)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: List[str] | None = None, run_manager: Any = None,
+                         **kwargs: Any) -> ChatResult:
+        content, latency, failed = self._plan(messages)
+        await asyncio.sleep(latency)
+        if failed:
+            raise ServiceUnavailableError("Injected failure")
+        return self._result(messages, content)
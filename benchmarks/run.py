@@ -0,0 +1,234 @@
+"""
+Offline benchmarks of the whole pipeline against the deterministic FakeChatModel, no key or network needed.
+
+    python benchmarks/run.py                      # compare with benchmarks/baseline.json
+    python benchmarks/run.py --save-baseline      # record a new baseline
+    python benchmarks/run.py --latency 0.5 --error-rate 0.1 --concurrency 1 4 16
+
+Per paper, it reports the parse time, the LLM calls, retries and tokens, and the end-to-end latency of a
+generation; per concurrency level, the throughput of generating all the papers at once. Calls and tokens do not
+depend on the machine and are compared exactly; timings are compared within a relative tolerance.
+"""
+import os
+import sys
+sys.path.insert(0, './')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import asyncio
+import glob
+import json
+import platform
+import time
+from typing import Dict, List
+
+from fake_chat_model import FakeChatModel
+
+from paper2cmap import ChatClient, EndpointPool, Paper2CMap, logger, metrics
+from paper2cmap.cmapgpt import load_prompts
+from paper2cmap.pdf_parser import parse_pdf
+
+# metrics whose value only depends on the code and the inputs, not on the machine
+EXACT_METRICS = ("sections", "calls", "prompt_tokens", "completion_tokens", "relationships")
+TIMED_METRICS = ("parse_seconds", "latency_seconds")
+
+
+def make_client(args: argparse.Namespace) -> ChatClient:
+    fake = FakeChatModel(
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        latency_per_token=args.latency_per_token,
+        error_rate=args.error_rate,
+    )
+    # injected errors are retried by the pool, like the 5xx errors of a real endpoint
+    return ChatClient(EndpointPool([fake], max_retries=args.max_retries, cooldown=0.0))
+
+
+def make_paper2cmap(args: argparse.Namespace, chat_client: ChatClient) -> Paper2CMap:
+    return Paper2CMap(chatbot=chat_client, compact_prompts=args.compact_prompts, catelogue_mode=args.catelogue_mode)
+
+
+def generate_kwargs(args: argparse.Namespace) -> Dict:
+    return {
+        "max_num_concepts": args.max_num_concepts,
+        "max_num_relationships": args.max_num_relationships,
+        "section_mode": args.section_mode,
+    }
+
+
+def bench_papers(args: argparse.Namespace, parsed: Dict[str, tuple]) -> Dict[str, Dict]:
+    """
+    Generate the concept map of every paper on its own, with {args.max_workers} sections in flight.
+    """
+    results = {}
+    for pdf_path in args.pdfs:
+        name = os.path.basename(pdf_path)
+
+        start = time.perf_counter()
+        parsed[pdf_path] = parse_pdf(pdf_path)
+        parse_seconds = time.perf_counter() - start
+
+        metrics.reset()
+        chat_client = make_client(args)
+        paper2cmap = make_paper2cmap(args, chat_client)
+        start = time.perf_counter()
+        paper2cmap.load(pdf_path, parsed=parsed[pdf_path])
+        cmap = paper2cmap.generate_cmap(max_workers=args.max_workers, **generate_kwargs(args))
+        latency_seconds = time.perf_counter() - start
+
+        usage = chat_client.usage()
+        results[name] = {
+            "sections": len(paper2cmap.paper_reader.sections),
+            "calls": usage["calls"],
+            "retries": int(metrics.counter("llm_retries")),
+            "prompt_tokens": usage["prompt_tokens"],
+            "completion_tokens": usage["completion_tokens"],
+            "relationships": len(cmap),
+            "parse_seconds": round(parse_seconds, 4),
+            "latency_seconds": round(latency_seconds, 4),
+        }
+    return results
+
+
+async def _generate_all(args: argparse.Namespace, parsed: Dict[str, tuple], concurrency: int) -> int:
+    # all the papers share one client, like the jobs of a batch or a server
+    chat_client = make_client(args)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _generate(pdf_path: str) -> None:
+        async with semaphore:
+            paper2cmap = make_paper2cmap(args, chat_client)
+            await paper2cmap.aload(pdf_path, parsed=parsed[pdf_path])
+            await paper2cmap.agenerate_cmap(max_workers=args.max_workers, **generate_kwargs(args))
+
+    try:
+        await asyncio.gather(*(_generate(pdf_path) for pdf_path in args.pdfs * args.repeat))
+    finally:
+        await chat_client.chatbot.aclose()
+    return chat_client.usage()["calls"]
+
+
+def bench_throughput(args: argparse.Namespace, parsed: Dict[str, tuple]) -> Dict[str, Dict]:
+    """
+    Generate {args.repeat} copies of every paper with at most {concurrency} papers, and {args.max_workers} sections
+    per paper, in flight, for every level.
+    """
+    results = {}
+    for concurrency in args.concurrency:
+        metrics.reset()
+        start = time.perf_counter()
+        calls = asyncio.run(_generate_all(args, parsed, concurrency))
+        seconds = time.perf_counter() - start
+        results[str(concurrency)] = {
+            "papers": len(args.pdfs) * args.repeat,
+            "calls": calls,
+            "seconds": round(seconds, 4),
+            "papers_per_second": round(len(args.pdfs) * args.repeat / seconds, 3),
+            "calls_per_second": round(calls / seconds, 2),
+        }
+    return results
+
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    :return: The regressions of the report against the baseline.
+    """
+    if baseline.get("config") != report["config"]:
+        return [f"the baseline was recorded with another config: {baseline.get('config')}"]
+
+    regressions = []
+    for name, result in report["papers"].items():
+        expected = baseline["papers"].get(name)
+        if expected is None:
+            continue
+        for key in EXACT_METRICS:
+            if result[key] != expected[key]:
+                regressions.append(f"{name}: {key} changed from {expected[key]} to {result[key]}")
+        for key in TIMED_METRICS:
+            if result[key] > expected[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} rose from {expected[key]} to {result[key]}")
+    for concurrency, result in report["throughput"].items():
+        expected = baseline["throughput"].get(concurrency)
+        if expected is not None and result["papers_per_second"] < expected["papers_per_second"] * (1 - tolerance):
+            regressions.append(
+                f"concurrency {concurrency}: papers/s fell from {expected['papers_per_second']} to {result['papers_per_second']}"
+            )
+    return regressions
+
+
+def print_report(report: Dict) -> None:
+    print(f"{'paper':<36}{'sections':>9}{'calls':>7}{'retries':>8}{'prompt tok':>11}{'compl tok':>10}{'parse s':>9}{'e2e s':>8}")
+    for name, result in report["papers"].items():
+        print(
+            f"{name:<36}{result['sections']:>9}{result['calls']:>7}{result['retries']:>8}{result['prompt_tokens']:>11}"
+            f"{result['completion_tokens']:>10}{result['parse_seconds']:>9.3f}{result['latency_seconds']:>8.3f}"
+        )
+    print()
+    print(f"{'concurrency':<12}{'papers':>7}{'calls':>7}{'seconds':>9}{'papers/s':>10}{'calls/s':>9}")
+    for concurrency, result in report["throughput"].items():
+        print(
+            f"{concurrency:<12}{result['papers']:>7}{result['calls']:>7}{result['seconds']:>9.3f}"
+            f"{result['papers_per_second']:>10.3f}{result['calls_per_second']:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks of paper2cmap with a fake chat model")
+    parser.add_argument("--pdfs", nargs="+", default=sorted(glob.glob("tests/examples/*.pdf")), help="The PDF files.")
+    parser.add_argument("--latency", type=float, default=0.05, help="The mean latency of an LLM call in seconds.")
+    parser.add_argument("--latency-jitter", type=float, default=0.5, help="The relative spread of the latency.")
+    parser.add_argument("--latency-per-token", type=float, default=0.0, help="The additional latency per completion token.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="The probability of an LLM call failing.")
+    parser.add_argument("--max-retries", type=int, default=6, help="The maximum number of attempts of an LLM call.")
+    parser.add_argument("--max-workers", type=int, default=4, help="The number of sections in flight per paper.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8], help="The numbers of papers in flight.")
+    parser.add_argument("--repeat", type=int, default=2, help="The number of copies of every paper in the throughput runs.")
+    parser.add_argument("--max-num-concepts", type=int, default=10)
+    parser.add_argument("--max-num-relationships", type=int, default=30)
+    parser.add_argument("--section-mode", choices=["two_pass", "fused"], default="two_pass")
+    parser.add_argument("--compact-prompts", action="store_true")
+    parser.add_argument("--catelogue-mode", choices=["auto", "local", "llm"], default="auto")
+    parser.add_argument("--baseline", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="Write the report as the new baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="The relative slowdown tolerated against the baseline.")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 on a regression.")
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this file.")
+    args = parser.parse_args()
+
+    logger.setLevel("WARNING")
+
+    # the prompts are compiled once per process, a long-running worker does not pay it per paper
+    start = time.perf_counter()
+    load_prompts(args.compact_prompts)
+    print(f"Prompts compiled in {time.perf_counter() - start:.3f}s")
+
+    parsed: Dict[str, tuple] = {}
+    report = {
+        "config": {
+            key: getattr(args, key) for key in (
+                "latency", "latency_jitter", "latency_per_token", "error_rate", "max_retries", "max_workers", "repeat",
+                "max_num_concepts", "max_num_relationships", "section_mode", "compact_prompts", "catelogue_mode",
+            )
+        },
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+    }
+    report["papers"] = bench_papers(args, parsed)
+    report["throughput"] = bench_throughput(args, parsed)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        print(f"\nCompared with {args.baseline}: {len(regressions)} regression(s)")
+        for regression in regressions:
+            print(f"  {regression}")
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
@@ -1,7 +1,37 @@
+import importlib
+
 from .logger import logger
-from .llm import LLMManager
-from .cmapgpt import CMapGPT
-from .paper_reader import PaperReader
-from .paper2cmap import Paper2CMap
+from .metrics import Metrics, metrics
+
+# the public classes and their modules, imported on first access so that `import paper2cmap` does not pull in
+# langchain, openai or pdfminer until they are needed
+_LAZY_ATTRIBUTES = {
+    "RateLimiter": "rate_limiter",
+    "LLMCache": "cache",
+    "LatencyPolicy": "policy",
+    "CircuitOpenError": "policy",
+    "LLMManager": "llm",
+    "EndpointPool": "llm",
+    "ChatClient": "llm",
+    "ConceptMap": "concept_map",
+    "ConceptIndex": "concept_index",
+    "CMapGPT": "cmapgpt",
+    "PaperReader": "paper_reader",
+    "SectionPlanner": "planner",
+    "Paper2CMap": "paper2cmap",
+}
+
+def __getattr__(name: str):
+    module = _LAZY_ATTRIBUTES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted([*globals(), *_LAZY_ATTRIBUTES])
+
 
 __version__ = "0.1.3"
\ No newline at end of file
@@ -0,0 +1,5 @@
+from paper2cmap.cli import main
+
+
+if __name__ == "__main__":
+    main()
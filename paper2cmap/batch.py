@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List, Tuple
+
+from paper2cmap import ConceptIndex, Paper2CMap, logger, metrics
+from paper2cmap.pdf_parser import parse_pdf
+
+
+def list_pdfs(source: str) -> List[str]:
+    """
+    List the PDF files of a batch.
+
+    :param source: Either a directory, searched recursively for *.pdf files, or a manifest file
+                   with one PDF path per line (relative paths are resolved against the manifest's directory).
+    :return: The paths of the PDF files, sorted for directories and in manifest order otherwise.
+    """
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(source)
+            for name in names
+            if name.lower().endswith(".pdf")
+        )
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, "r", encoding="utf-8") as f:
+        lines = [line.strip() for line in f]
+    return [
+        line if os.path.isabs(line) else os.path.join(base_dir, line)
+        for line in lines
+        if line and not line.startswith("#")
+    ]
+
+
+class BatchRunner():
+    def __init__(self,
+                 paper2cmap_kwargs: Dict | None = None,
+                 generate_kwargs: Dict | None = None,
+                 parse_workers: int | None = None,
+                 max_concurrent_papers: int = 4,
+                 index_path: str | None = None,
+                 ) -> None:
+        """
+        Generate concept maps for many PDF files. PDF files are parsed in a process pool, and the parsed papers
+        feed a thread pool of LLM jobs sharing one ChatClient, so its rate limiter and cache apply to the whole batch.
+
+        :param paper2cmap_kwargs: The keyword arguments of Paper2CMap, e.g. model_name, requests_per_minute, tokens_per_minute, cache_dir, checkpoint_dir, catelogue_mode, compact_prompts or low_memory. Default: None.
+        :param generate_kwargs: The keyword arguments of Paper2CMap.generate_cmap, e.g. max_num_concepts or max_workers. Default: None.
+        :param parse_workers: The number of processes parsing PDF files. If None, the number of CPUs. Default: None.
+        :param max_concurrent_papers: The maximum number of papers waiting on the LLM at a time. Default: 4.
+        :param index_path: If given, the concept map of every paper is also persisted in the ConceptIndex database at this path, for QA over the corpus. Default: None.
+        """
+        self.paper2cmap_kwargs = dict(paper2cmap_kwargs or {})
+        self.generate_kwargs = dict(generate_kwargs or {})
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.max_concurrent_papers = max_concurrent_papers
+        self.index = ConceptIndex(index_path) if index_path is not None else None
+
+        # the chat client (and with it the rate limiter and the cache) is shared by every paper
+        self.chat_client = Paper2CMap(**self.paper2cmap_kwargs).chat_client
+        self._paper_kwargs = {
+            key: self.paper2cmap_kwargs[key]
+            for key in ("checkpoint_dir", "catelogue_mode", "compact_prompts", "low_memory", "spill_dir")
+            if key in self.paper2cmap_kwargs
+        }
+
+    def _process(self, pdf_path: str, parsed: Tuple[List[str], List[Tuple[str, float, bool]]]) -> Dict:
+        start = time.time()
+        try:
+            with metrics.span("paper", path=pdf_path):
+                paper2cmap = Paper2CMap(chatbot=self.chat_client, **self._paper_kwargs)
+                paper2cmap.load(pdf_path, parsed=parsed)
+                cmap = paper2cmap.generate_cmap(**self.generate_kwargs)
+                if self.index is not None:
+                    paper2cmap.index_cmap(self.index, cmap)
+            return {
+                "path": pdf_path,
+                "status": "ok",
+                "num_sections": len(paper2cmap.paper_reader.sections),
+                "cmap": cmap,
+                "elapsed": round(time.time() - start, 3),
+            }
+        except Exception as e:
+            logger.error("[BatchRunner] Failed to process %s: %r", pdf_path, e)
+            return {"path": pdf_path, "status": "error", "error": repr(e), "elapsed": round(time.time() - start, 3)}
+
+    @staticmethod
+    def _finished_paths(output_path: str) -> set:
+        finished = set()
+        if not os.path.exists(output_path):
+            return finished
+        with open(output_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line may be truncated by a crash
+                    continue
+                if record.get("status") == "ok":
+                    finished.add(record["path"])
+        return finished
+
+    def run(self, pdf_paths: Iterable[str], output_path: str, resume: bool = True) -> Dict[str, int]:
+        """
+        Process the PDF files and append one JSON line per paper to {output_path} as soon as it is done.
+        Each line has the path, a "status" of "ok" or "error", and either the concept map or the error.
+
+        :param pdf_paths: The paths of the PDF files.
+        :param output_path: The path of the JSONL output file.
+        :param resume: Whether to skip the papers already recorded as "ok" in {output_path}. Default: True.
+        :return: The number of papers per status, including "skipped".
+        """
+        pdf_paths = list(pdf_paths)
+        finished = self._finished_paths(output_path) if resume else set()
+        pending = [path for path in pdf_paths if path not in finished]
+        todo = iter(pending)
+        summary = {"ok": 0, "error": 0, "skipped": len(pdf_paths) - len(pending)}
+        logger.info("[BatchRunner] Processing %s papers, skipping %s", len(pdf_paths) - summary['skipped'], summary['skipped'])
+
+        # bound the parsed papers held in memory while they wait for the LLM
+        max_in_flight = self.parse_workers + self.max_concurrent_papers * 2
+        write_lock = threading.Lock()
+
+        with ProcessPoolExecutor(max_workers=self.parse_workers) as parse_pool, \
+                ThreadPoolExecutor(max_workers=self.max_concurrent_papers) as llm_pool, \
+                open(output_path, "a", encoding="utf-8") as output:
+
+            def _write(record: Dict) -> None:
+                with write_lock:
+                    output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    output.flush()
+                summary[record["status"]] += 1
+                logger.info("[BatchRunner] %s: %s (%s/%s)", record['status'], record['path'], sum(summary.values()), len(pdf_paths))
+
+            parsing: Dict[Future, str] = {}
+            generating: Dict[Future, str] = {}
+
+            def _fill() -> None:
+                while len(parsing) + len(generating) < max_in_flight:
+                    pdf_path = next(todo, None)
+                    if pdf_path is None:
+                        return
+                    parsing[parse_pool.submit(parse_pdf, pdf_path)] = pdf_path
+
+            _fill()
+            while parsing or generating:
+                done, _ = wait([*parsing, *generating], return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in parsing:
+                        pdf_path = parsing.pop(future)
+                        try:
+                            parsed = future.result()
+                        except Exception as e:
+                            logger.error("[BatchRunner] Failed to parse %s: %r", pdf_path, e)
+                            _write({"path": pdf_path, "status": "error", "error": repr(e)})
+                            continue
+                        generating[llm_pool.submit(self._process, pdf_path, parsed)] = pdf_path
+                    else:
+                        generating.pop(future)
+                        _write(future.result())
+                _fill()
+
+        return summary
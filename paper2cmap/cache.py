@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List
+
+from paper2cmap import logger
+
+if TYPE_CHECKING:
+    from langchain.schema import BaseMessage
+
+
+class LLMCache():
+    def __init__(self, cache_dir: str, max_size: int | None = None, ttl: float | None = None) -> None:
+        """
+        A persistent, content-addressed cache of chat completions backed by SQLite.
+        Several processes may share one cache directory.
+
+        :param cache_dir: The directory holding the cache database.
+        :param max_size: The maximum total size of the cached responses in bytes. Least recently used entries are evicted beyond it. If None, the size is not limited.
+        :param ttl: The time to live of an entry in seconds. If None, entries never expire.
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(cache_dir, "llm_cache.sqlite3")
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        # sqlite connections must not be shared across threads
+        self._local = threading.local()
+
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # a generous busy timeout lets concurrent writers from other processes wait for the lock
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(messages: List[BaseMessage], model_name: str = "", deployment_name: str = "",
+                 temperature: float | None = None, max_tokens: int | None = None) -> str:
+        """
+        Compute the cache key of a chat completion request.
+
+        :param messages: The rendered chat messages.
+        :param model_name: The model name.
+        :param deployment_name: The Azure deployment name.
+        :param temperature: The sampling temperature.
+        :param max_tokens: The maximum number of completion tokens, a lower limit may cut the response short.
+        :return: The hex digest identifying the request.
+        """
+        payload = json.dumps({
+            "messages": [[message.type, message.content] for message in messages],
+            "model_name": model_name,
+            "deployment_name": deployment_name,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        """
+        Look up a cached response.
+
+        :param key: The cache key.
+        :return: The cached response, or None if it is missing or expired.
+        """
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute("SELECT response, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            row = None
+
+        with self._stats_lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if row is None:
+            return None
+        conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key: str, response: str) -> None:
+        """
+        Store a response and evict expired and least recently used entries.
+
+        :param key: The cache key.
+        :param response: The response to cache.
+        """
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), now, now)
+            )
+            self._evict(conn, now)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        if self.ttl is not None:
+            conn.execute("DELETE FROM entries WHERE created_at < ?", (now - self.ttl,))
+
+        if self.max_size is not None:
+            total_size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total_size <= self.max_size:
+                return
+            evicted = 0
+            for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall():
+                if total_size <= self.max_size:
+                    break
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                total_size -= size
+                evicted += 1
+            logger.debug("[LLMCache] Evicted %s entries", evicted)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Report the hit/miss counters of this process and the current size of the cache.
+
+        :return: A dict with hits, misses, entries and size.
+        """
+        entries, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "size": size}
+
+    def clear(self) -> None:
+        """
+        Remove every entry from the cache.
+        """
+        self._connect().execute("DELETE FROM entries")
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import re
+from collections import Counter
+from typing import List, Tuple
+
+from paper2cmap.text_store import TextStore
+from paper2cmap.title_matcher import TitleMatcher
+
+# e.g. "3.2 Attention", "3.2. Attention", "IV. Experiments" or "A. Proofs"
+_NUMBERED = re.compile(r"^(?:(\d+)(?:\.\d+)*\.?|[IVX]+\.|[A-H]\.?)\s+[A-Z]")
+_HEADINGS = {
+    "abstract", "introduction", "background", "related work", "related works", "preliminaries",
+    "method", "methods", "methodology", "approach", "model", "experiments", "experimental setup",
+    "evaluation", "results", "discussion", "analysis", "limitations", "future work", "conclusion",
+    "conclusions", "acknowledgments", "acknowledgements", "references", "bibliography", "appendix",
+}
+_SPACES = re.compile(r"\s+")
+
+
+def _clean(text: str) -> str:
+    return _SPACES.sub(" ", text).strip()
+
+
+def catelogue_from_outline(outline: List[Tuple[int, str]], full_text: str | TextStore, min_titles: int = 3) -> List[str] | None:
+    """
+    Build the catelogue from the outline embedded in the PDF file.
+
+    :param outline: The (level, title) pairs of the outline, see `pdf_parser.extract_outline`.
+    :param full_text: The text of the paper, or a TextStore holding it.
+    :param min_titles: The minimum number of outline titles found in the text to trust the outline. Default: 3.
+    :return: The titles found in the text, or None if the outline cannot be trusted.
+    """
+    titles = list(dict.fromkeys(_clean(title) for _, title in outline))
+    found = {title_index for _, title_index in TitleMatcher(titles).find_all(full_text)}
+    # outlines whose titles are mostly missing from the text (e.g. rewritten bookmarks) are not trusted
+    if len(found) < min_titles or len(found) * 2 < len(titles):
+        return None
+    return [title for title_index, title in enumerate(titles) if title_index in found]
+
+
+def score_candidate(text: str, relative_size: float, bold: bool) -> int:
+    """
+    Score how likely a text box is a section title from its layout and wording.
+
+    :param text: The text of the box.
+    :param relative_size: The font size of the box relative to the body text of its page.
+    :param bold: Whether the box is set in bold.
+    :return: 0 if the box is unlikely a title, 1 if it is a weak candidate, and 3 if it is almost certainly a title.
+    """
+    text = _clean(text)
+    if not re.search(r"[A-Za-z]{2}", text) or text[-1] in ",;:" or (text[-1] == "." and len(text.split()) > 3):
+        return 0
+
+    emphasized = bold or relative_size >= 1.05
+    titled = bool(_NUMBERED.match(text)) or text.lower() in _HEADINGS
+    return 3 if emphasized and titled else int(emphasized or titled)
+
+
+def detect_catelogue(cand_cate: List[Tuple[str, float, bool]], min_titles: int = 3,
+                     max_candidates: int = 100) -> Tuple[List[str], bool, List[str]]:
+    """
+    Detect the section titles from the layout features of the candidates, without calling the LLM.
+
+    :param cand_cate: The (text, relative font size, bold) title candidates, see `pdf_parser.parse_pdf`.
+    :param min_titles: The minimum number of titles of a confident detection. Default: 3.
+    :param max_candidates: The maximum number of candidates kept for the LLM. Default: 100.
+    :return: The detected titles, whether the detection is confident, and the deduplicated candidates worth sending to the LLM.
+    """
+    # text repeated across many pages is a running header or footer
+    counts = Counter(_clean(text) for text, _, _ in cand_cate)
+
+    titles, candidates = [], []
+    for text, relative_size, bold in cand_cate:
+        text = _clean(text)
+        if counts[text] >= 3:
+            continue
+        score = score_candidate(text, relative_size, bold)
+        if score >= 3:
+            titles.append(text)
+        if score >= 1:
+            candidates.append(text)
+    titles = list(dict.fromkeys(titles))
+    candidates = list(dict.fromkeys(candidates))[:max_candidates]
+
+    # numbered sections must come in order, otherwise the numbers are likely from tables or lists
+    numbers = [int(match.group(1)) for match in map(_NUMBERED.match, titles) if match and match.group(1)]
+    ordered = len(numbers) >= 2 and all(a <= b for a, b in zip(numbers, numbers[1:]))
+    return titles, len(titles) >= min_titles and ordered, candidates
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Dict
+
+from paper2cmap import logger
+
+
+def hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Compute the SHA-256 digest of a file's content.
+
+    :param path: The path of the file.
+    :param chunk_size: The number of bytes read at a time. Default: 1 MiB.
+    :return: The hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_json(data: Any) -> str:
+    """
+    Compute the SHA-256 digest of a JSON-serializable value.
+
+    :param data: The value.
+    :return: The hex digest.
+    """
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class JobCheckpoint():
+    def __init__(self, checkpoint_dir: str, paper_path: str, model_params: Dict | None = None) -> None:
+        """
+        Persist the result of every stage of a job, so that a re-run resumes from the first missing stage.
+        The job directory is keyed by the content hash of the PDF and the model parameters, and every result
+        inside it by the hash of the inputs of its stage (e.g. the section text and the generation parameters).
+
+        :param checkpoint_dir: The root directory of all jobs.
+        :param paper_path: The path of the PDF file.
+        :param model_params: The parameters of the model producing the results. Default: None.
+        """
+        self.paper_hash = hash_file(paper_path)
+        self.job_dir = os.path.join(checkpoint_dir, self.paper_hash, hash_json(model_params or {})[:16])
+        os.makedirs(self.job_dir, exist_ok=True)
+
+        params_path = os.path.join(self.job_dir, "model_params.json")
+        if not os.path.exists(params_path):
+            self._write(params_path, model_params or {})
+
+    def _path(self, stage: str, inputs: Any) -> str:
+        return os.path.join(self.job_dir, stage, f"{hash_json(inputs)}.json")
+
+    @staticmethod
+    def _write(path: str, value: Any) -> None:
+        # write to a temporary file and rename it, so a crash never leaves a truncated checkpoint behind
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def load(self, stage: str, inputs: Any) -> Any | None:
+        """
+        Load the result of a stage.
+
+        :param stage: The name of the stage, e.g. "catelogue", "preprocess", "generate" or "merge".
+        :param inputs: The JSON-serializable inputs of the stage.
+        :return: The stored result, or None if the stage has not finished yet.
+        """
+        path = self._path(stage, inputs)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            logger.debug("[JobCheckpoint] Resumed %s from %s", stage, path)
+            return json.load(f)
+
+    def save(self, stage: str, inputs: Any, result: Any) -> None:
+        """
+        Store the result of a stage.
+
+        :param stage: The name of the stage, e.g. "catelogue", "preprocess", "generate" or "merge".
+        :param inputs: The JSON-serializable inputs of the stage.
+        :param result: The JSON-serializable result of the stage.
+        """
+        path = self._path(stage, inputs)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._write(path, result)
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+from typing import Iterable, Iterator, List
+
+from paper2cmap.utils import estimate_tokens
+
+
+# tried in order: paragraphs first, then lines, sentences and words
+_SEPARATORS = ["\n\n", "\n", ". ", " "]
+
+
+def _split_text(text: str, max_tokens: int, separators: List[str] = _SEPARATORS) -> List[str]:
+    """
+    Recursively split a text at the coarsest separator until every piece fits into {max_tokens} tokens,
+    then pack consecutive pieces back together as long as they fit.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+    if not separators:
+        # no separator left, cut at the character budget
+        max_chars = max_tokens * 4
+        return [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+
+    separator, separators = separators[0], separators[1:]
+    pieces = []
+    for piece in text.split(separator):
+        pieces.extend(_split_text(piece, max_tokens, separators))
+
+    chunks = []
+    chunk, chunk_tokens = [], 0
+    for piece in pieces:
+        tokens = estimate_tokens(separator + piece)
+        if chunk and chunk_tokens + tokens > max_tokens:
+            chunks.append(separator.join(chunk))
+            chunk, chunk_tokens = [], 0
+        chunk.append(piece)
+        chunk_tokens += tokens
+    if chunk:
+        chunks.append(separator.join(chunk))
+    return chunks
+
+
+def iter_chunks(sections: Iterable[str], target_tokens: int = 1500, max_tokens: int | None = None) -> Iterator[str]:
+    """
+    Streaming version of `chunk_sections`: sections are read one at a time, and every chunk is yielded as soon as
+    it is full, so only the chunk being packed is held in memory.
+
+    :param sections: The sections in document order.
+    :param target_tokens: The number of tokens a chunk is packed up to. Default: 1500.
+    :param max_tokens: The maximum number of tokens of a chunk. If None, twice {target_tokens}. Default: None.
+    :return: An iterator of the chunks in document order.
+    """
+    if max_tokens is None:
+        max_tokens = target_tokens * 2
+    if max_tokens < target_tokens:
+        raise ValueError(f"max_tokens must not be smaller than target_tokens, but got {max_tokens} < {target_tokens}")
+
+    chunk, chunk_tokens = [], 0
+    for section in sections:
+        # oversized sections are cut into pieces of about the target size, not just under the maximum
+        pieces = _split_text(section, target_tokens) if estimate_tokens(section) > max_tokens else [section]
+        for piece in pieces:
+            tokens = estimate_tokens(piece)
+            if chunk and chunk_tokens + tokens > target_tokens:
+                yield "\n\n".join(chunk)
+                chunk, chunk_tokens = [], 0
+            chunk.append(piece)
+            chunk_tokens += tokens
+    if chunk:
+        yield "\n\n".join(chunk)
+
+
+def chunk_sections(sections: List[str], target_tokens: int = 1500, max_tokens: int | None = None) -> List[str]:
+    """
+    Even out the sizes of the sections sent to the LLM. Sections larger than {max_tokens} are split into
+    pieces of at most {target_tokens} at paragraph (then line, sentence and word) boundaries, and adjacent
+    sections are packed together as long as the chunk stays within {target_tokens}.
+
+    :param sections: The sections in document order.
+    :param target_tokens: The number of tokens a chunk is packed up to. Default: 1500.
+    :param max_tokens: The maximum number of tokens of a chunk. If None, twice {target_tokens}. Default: None.
+    :return: The chunks in document order.
+    """
+    return list(iter_chunks(sections, target_tokens, max_tokens))
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import argparse
+import json
+from typing import Dict, List
+
+from paper2cmap import SectionPlanner, logger, metrics
+from paper2cmap.batch import BatchRunner, list_pdfs
+
+
+def _parse_args(argv: List[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="paper2cmap",
+        description="Generate concept maps for a directory or a manifest of PDF files, writing one JSON line per paper.",
+    )
+    parser.add_argument("input", help="A directory searched recursively for PDF files, or a manifest file with one PDF path per line.")
+    parser.add_argument("-o", "--output", default="cmaps.jsonl", help="The JSONL output file. Default: cmaps.jsonl.")
+    parser.add_argument("--no-resume", action="store_true", help="Process again the papers already in the output file.")
+
+    parser.add_argument("--parse-workers", type=int, default=None, help="The number of processes parsing PDF files. Default: the number of CPUs.")
+    parser.add_argument("--max-papers", type=int, default=4, help="The maximum number of papers waiting on the LLM at a time. Default: 4.")
+    parser.add_argument("--max-workers", type=int, default=1, help="The number of concurrent LLM requests per paper. Default: 1.")
+
+    parser.add_argument("--model-name", default="", help="The OpenAI model name. Default: the environment variable OPENAI_MODEL_NAME.")
+    parser.add_argument("--deployment-name", default="", help="The Azure deployment name. Default: the environment variable OPENAI_MODEL_NAME.")
+    parser.add_argument("--deployment-version", default="", help="The Azure deployment version. Default: the environment variable OPENAI_MODEL_VERSION.")
+    parser.add_argument("--endpoints", default=None, help="A JSON file listing several endpoints of the model to balance the requests across, see LLMManager.")
+    parser.add_argument("--temperature", type=float, default=0.7, help="The temperature of the model. Default: 0.7.")
+    parser.add_argument("--rpm", type=int, default=None, help="The maximum number of LLM requests per minute, shared by all papers.")
+    parser.add_argument("--tpm", type=int, default=None, help="The maximum number of LLM tokens per minute, shared by all papers.")
+    parser.add_argument("--cache-dir", default=None, help="The directory of the persistent LLM response cache.")
+    parser.add_argument("--checkpoint-dir", default=None, help="The directory where the stages of every paper are checkpointed.")
+    parser.add_argument("--compact-prompts", action="store_true", help="Use the token-lean prompts, see CMapGPT.")
+    parser.add_argument("--low-memory", action="store_true", help="Spill the text of every paper to disk and only read back the sections sent to the LLM.")
+    parser.add_argument("--catelogue-mode", default="auto", choices=["auto", "local", "llm"], help="How the section titles are found. Default: auto.")
+
+    parser.add_argument("--max-num-concepts", type=int, default=10, help="The maximum number of concepts. Default: 10.")
+    parser.add_argument("--max-num-relationships", type=int, default=30, help="The maximum number of relationships. Default: 30.")
+    parser.add_argument("--max-num-iterations", type=int, default=-1, help="The maximum number of sections to process, -1 for all. Default: -1.")
+    parser.add_argument("--section-mode", default="two_pass", choices=["two_pass", "fused"], help="Whether every section is summarized before its concept map is generated, or both are done in one call. Default: two_pass.")
+    parser.add_argument("--merge-mode", default="flat", choices=["flat", "tree", "local"], help="How section concept maps are merged. Default: flat.")
+    parser.add_argument("--chunk-target-tokens", type=int, default=None, help="Pack and split sections to about this many tokens.")
+    parser.add_argument("--token-budget", type=int, default=None, help="Only process the most informative sections fitting this estimated number of tokens per paper, see SectionPlanner.")
+    parser.add_argument("--cost-budget", type=float, default=None, help="Only process the most informative sections fitting this estimated cost per paper, see SectionPlanner.")
+    parser.add_argument("--time-budget", type=float, default=None, help="Only process the most informative sections fitting this estimated LLM time in seconds per paper, see SectionPlanner.")
+
+    parser.add_argument("--index-db", default=None, help="Also persist every concept map in this ConceptIndex database, for QA over the corpus.")
+    parser.add_argument("--metrics-output", default=None, help="Write the timings, token usage and retries to this file, in the Prometheus text format if it ends with .prom and in JSON otherwise.")
+
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print debug logs.")
+    return parser.parse_args(argv)
+
+
+def _load_endpoints(path: str | None) -> List[Dict] | None:
+    if path is None:
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _make_planner(args: argparse.Namespace) -> SectionPlanner | None:
+    if args.token_budget is None and args.cost_budget is None and args.time_budget is None:
+        return None
+    return SectionPlanner(max_tokens=args.token_budget, max_cost=args.cost_budget, max_seconds=args.time_budget)
+
+
+def main(argv: List[str] | None = None) -> None:
+    args = _parse_args(argv)
+
+    runner = BatchRunner(
+        paper2cmap_kwargs={
+            "model_name": args.model_name,
+            "deployment_name": args.deployment_name,
+            "deployment_version": args.deployment_version,
+            "endpoints": _load_endpoints(args.endpoints),
+            "temperature": args.temperature,
+            "requests_per_minute": args.rpm,
+            "tokens_per_minute": args.tpm,
+            "cache_dir": args.cache_dir,
+            "checkpoint_dir": args.checkpoint_dir,
+            "catelogue_mode": args.catelogue_mode,
+            "compact_prompts": args.compact_prompts,
+            "low_memory": args.low_memory,
+            "verbose": args.verbose,
+        },
+        generate_kwargs={
+            "max_num_concepts": args.max_num_concepts,
+            "max_num_relationships": args.max_num_relationships,
+            "max_num_iterations": args.max_num_iterations,
+            "max_workers": args.max_workers,
+            "section_mode": args.section_mode,
+            "merge_mode": args.merge_mode,
+            "chunk_target_tokens": args.chunk_target_tokens,
+            "planner": _make_planner(args),
+        },
+        parse_workers=args.parse_workers,
+        max_concurrent_papers=args.max_papers,
+        index_path=args.index_db,
+    )
+    summary = runner.run(list_pdfs(args.input), args.output, resume=not args.no_resume)
+    logger.info("[paper2cmap] Done: %s ok, %s failed, %s skipped", summary['ok'], summary['error'], summary['skipped'])
+    logger.info("[paper2cmap] Token usage: %s", runner.chat_client.usage())
+    if args.metrics_output is not None:
+        metrics.export(args.metrics_output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import re
+import zlib
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# the maximum number of cells of the similarity matrix computed at once
+_MAX_BLOCK_SIZE = 1 << 22
+
+
+def _char_ngrams(label: str, ngram_range: Tuple[int, int]) -> List[str]:
+    # "self-attention" and "self attention" should share all their n-grams
+    padded = " " + re.sub(r"[\s_-]+", " ", label.lower()).strip() + " "
+    return [
+        padded[i:i + n]
+        for n in range(ngram_range[0], ngram_range[1] + 1)
+        for i in range(len(padded) - n + 1)
+    ]
+
+
+def _sparse_vectors(labels: List[str], ngram_range: Tuple[int, int],
+                    n_features: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    :return: The L2-normalized n-gram TF-IDF vectors of the labels as a CSR matrix (indptr, indices, data),
+             with the features of every row in increasing order.
+    """
+    buckets: Dict[str, int] = {}
+    rows, cols = [], []
+    for row, label in enumerate(labels):
+        for ngram in _char_ngrams(label, ngram_range):
+            col = buckets.get(ngram)
+            if col is None:
+                col = buckets[ngram] = zlib.crc32(ngram.encode("utf-8")) % n_features
+            rows.append(row)
+            cols.append(col)
+
+    keys, tf = np.unique(np.asarray(rows, dtype=np.int64) * n_features + np.asarray(cols, dtype=np.int64),
+                         return_counts=True)
+    rows, indices = keys // n_features, keys % n_features
+
+    df = np.bincount(indices, minlength=n_features)
+    idf = np.log((1 + len(labels)) / (1 + df)).astype(np.float32) + 1
+    data = tf.astype(np.float32) * idf[indices]
+
+    norms = np.sqrt(np.bincount(rows, weights=data * data, minlength=len(labels))).astype(np.float32)
+    norms[norms == 0] = 1
+    data /= norms[rows]
+
+    indptr = np.zeros(len(labels) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(labels)), out=indptr[1:])
+    return indptr, indices, data
+
+
+def vectorize_labels(labels: List[str], ngram_range: Tuple[int, int] = (3, 3), n_features: int = 512) -> np.ndarray:
+    """
+    Embed labels as L2-normalized character n-gram TF-IDF vectors.
+    N-grams are hashed into {n_features} buckets with CRC32, so the result is deterministic across processes.
+
+    :param labels: The labels to embed.
+    :param ngram_range: The minimum and maximum n-gram length. Default: (3, 3).
+    :param n_features: The dimension of the vectors. Default: 512.
+    :return: A float32 matrix with one row per label.
+    """
+    indptr, indices, data = _sparse_vectors(labels, ngram_range, n_features)
+    vectors = np.zeros((len(labels), n_features), dtype=np.float32)
+    vectors[np.repeat(np.arange(len(labels)), np.diff(indptr)), indices] = data
+    return vectors
+
+
+def _expand(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    # the concatenation of range(start, start + length) for every start and length
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(offsets.size)
+
+
+def similar_pairs(indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, threshold: float,
+                  batch_size: int = 256) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Find all the pairs of rows of a sparse matrix of L2-normalized vectors whose cosine similarity reaches {threshold}.
+    The product of the matrix with its transpose is computed through an inverted index, a batch of rows at a time and
+    only against the following rows, so the cost grows with the number of shared features, not with the square of
+    the number of rows.
+
+    :param indptr: The row pointers of the CSR matrix.
+    :param indices: The features of the CSR matrix.
+    :param data: The values of the CSR matrix.
+    :param threshold: The minimum cosine similarity.
+    :param batch_size: The maximum number of rows compared at once, bounding the memory use. Default: 256.
+    :return: The first rows, the second rows and the similarities of the pairs, each pair in both directions.
+    """
+    num_rows = len(indptr) - 1
+    rows = np.repeat(np.arange(num_rows), np.diff(indptr))
+
+    # the inverted index: feature -> rows in increasing order, and their values
+    by_feature = np.argsort(indices, kind="stable")
+    postings = indices[by_feature] * num_rows + rows[by_feature]
+    posting_values = data[by_feature]
+    # every feature of a row only meets the rows after it
+    starts = np.searchsorted(postings, indices * num_rows + rows + 1)
+    counts = np.searchsorted(postings, (indices + 1) * num_rows) - starts
+
+    firsts, seconds, similarities = [], [], []
+    step = max(1, min(batch_size, _MAX_BLOCK_SIZE // max(num_rows, 1)))
+    for start in range(0, num_rows, step):
+        stop = min(start + step, num_rows)
+        entries = slice(indptr[start], indptr[stop])
+        matches = _expand(starts[entries], counts[entries])
+        cells = np.repeat(rows[entries] - start, counts[entries]) * num_rows + postings[matches] % num_rows
+        products = np.repeat(data[entries], counts[entries]) * posting_values[matches]
+        block = np.bincount(cells, weights=products, minlength=(stop - start) * num_rows)
+
+        similar = np.flatnonzero(block >= threshold)
+        firsts.append(similar // num_rows + start)
+        seconds.append(similar % num_rows)
+        similarities.append(block[similar])
+
+    first = np.concatenate(firsts) if firsts else np.zeros(0, dtype=np.int64)
+    second = np.concatenate(seconds) if seconds else np.zeros(0, dtype=np.int64)
+    similarity = np.concatenate(similarities) if similarities else np.zeros(0)
+    return np.concatenate((first, second)), np.concatenate((second, first)), np.concatenate((similarity, similarity))
+
+
+def cluster_labels(labels: List[str], threshold: float = 0.65, ngram_range: Tuple[int, int] = (3, 3),
+                   n_features: int = 1 << 16, batch_size: int = 256, weights: List[float] | None = None,
+                   top_k: int = 15) -> List[int]:
+    """
+    Cluster near-duplicate labels by n-gram TF-IDF cosine similarity, with complete linkage: labels are taken from
+    the highest to the lowest weight, the first label of a cluster is its canonical label, and a label only joins a
+    cluster if it is similar to every label already in it. Unlike linking similar labels transitively, this never
+    chains "encoder", "encoder layer", "decoder layer" and "decoder" into one cluster.
+
+    :param labels: The labels to cluster.
+    :param threshold: The minimum cosine similarity of two labels in the same cluster. Default: 0.65.
+    :param ngram_range: The minimum and maximum n-gram length. Default: (3, 3).
+    :param n_features: The number of buckets the n-grams are hashed into. Default: 65536.
+    :param batch_size: The maximum number of labels compared with the others at once, bounding the memory use. Default: 256.
+    :param weights: The weights of the labels, e.g. their frequencies. If None, labels are taken in order. Default: None.
+    :param top_k: The number of most similar labels considered for every label, so a cluster has at most {top_k} + 1 labels. Default: 15.
+    :return: The cluster id of every label, the index of the canonical label of its cluster.
+    """
+    if not labels:
+        return []
+
+    firsts, seconds, similarities = similar_pairs(*_sparse_vectors(labels, ngram_range, n_features), threshold, batch_size)
+
+    # the {top_k} most similar labels of every label
+    order = np.lexsort((-similarities, firsts))
+    firsts, seconds, similarities = firsts[order], seconds[order], similarities[order]
+    ranks = np.arange(firsts.size) - np.searchsorted(firsts, firsts)
+    kept = ranks < top_k
+    firsts, seconds, similarities = firsts[kept].tolist(), seconds[kept].tolist(), similarities[kept].tolist()
+
+    neighbors: Dict[int, Dict[int, float]] = {}
+    for first, second, similarity in zip(firsts, seconds, similarities):
+        neighbors.setdefault(first, {})[second] = similarity
+
+    # a label is only compared with the clusters of its similar labels, so this is linear in the number of labels
+    cluster_ids = [-1] * len(labels)
+    members: Dict[int, List[int]] = {}
+    label_order = range(len(labels)) if weights is None else sorted(range(len(labels)), key=lambda i: -weights[i])
+    for i in label_order:
+        similar = neighbors.get(i, {})
+        best_id, best_score = i, 0.0
+        for cluster_id in {cluster_ids[j] for j in similar if cluster_ids[j] >= 0}:
+            if all(member in similar for member in members[cluster_id]):
+                score = min(similar[member] for member in members[cluster_id])
+                if score > best_score:
+                    best_id, best_score = cluster_id, score
+        cluster_ids[i] = best_id
+        members.setdefault(best_id, []).append(i)
+    return cluster_ids
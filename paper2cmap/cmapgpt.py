@@ -1,101 +1,304 @@
 from __future__ import annotations
 
 import json
-from typing import Dict, List
+import logging
+import os
+from functools import lru_cache
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Callable, Dict, List, Mapping, Tuple
 
-import pkg_resources
-import yaml
+from paper2cmap import logger, metrics, ChatClient, ConceptMap
+from paper2cmap.output_parser import parse_fused, parse_triples
 
-from langchain.chat_models import AzureChatOpenAI, ChatOpenAI
-from langchain import PromptTemplate
-from langchain.prompts.chat import (
-    ChatPromptTemplate,
-    SystemMessagePromptTemplate,
-    AIMessagePromptTemplate,
-    HumanMessagePromptTemplate,
-)
+if TYPE_CHECKING:
+    from langchain.chat_models import AzureChatOpenAI, ChatOpenAI
+    from langchain.prompts.chat import ChatPromptTemplate
+    from langchain.schema import BaseMessage
 
-from paper2cmap import logger
+_METAS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "metas")
+# the number of relationships of a truncated concept map sent back when the rest is asked for
+_CONTINUATION_TAIL = 3
 
 
-class CMapGPT():
-    def __init__(self, chatbot: ChatOpenAI | AzureChatOpenAI) -> None:
-        self._prompt_config = yaml.load(
-            open(pkg_resources.resource_filename('paper2cmap', 'metas/prompts.yaml'), "r"),
-            Loader=yaml.FullLoader
-            )
-        self._preprocess_system_prompt = self._prompt_config["preprocess"]["system"]
-        self._preprocess_user_prompt = self._prompt_config["preprocess"]["user"]
-        self._generate_system_prompt = self._prompt_config["generate"]["system"]
-        self._generate_user_prompt = self._prompt_config["generate"]["user"]
-        self._merge_and_prune_system_prompt = self._prompt_config["merge_and_prune"]["system"]
-        self._merge_and_prune_user_prompt = self._prompt_config["merge_and_prune"]["user"]
-
-        self._preprocess_examples = json.load(
-            open(pkg_resources.resource_filename('paper2cmap', 'metas/preprocess_examples.json'), "r")
-            )
-        self._generate_examples = json.load(
-            open(pkg_resources.resource_filename('paper2cmap', 'metas/generate_examples.json'), "r")
-            )
-        self._merge_and_prune_examples = json.load(
-            open(pkg_resources.resource_filename('paper2cmap', 'metas/merge_and_prune_examples.json'), "r")
-            )
+@lru_cache(maxsize=None)
+def _load_meta(name: str) -> str:
+    with open(os.path.join(_METAS_DIR, name), "r", encoding="utf-8") as f:
+        return f.read()
 
-        self.preprocess_prompt = self._create_prompt(
-            system_prompt=self._preprocess_system_prompt,
-            user_prompt=self._preprocess_user_prompt,
-            user_prompt_vars=["text"],
-            examples=self._preprocess_examples
-        )
-        self.generate_prompt = self._create_prompt(
-            system_prompt=self._generate_system_prompt,
-            user_prompt=self._generate_user_prompt,
-            user_prompt_vars=["text", "max_num_concepts", "max_num_relationships"],
-            examples=self._generate_examples
+
+def _create_prompt(system_prompt: str = "", system_prompt_vars: List[str] = [],
+                   user_prompt: str = "", user_prompt_vars: List[str] = [],
+                   examples: List[Dict] = []) -> ChatPromptTemplate:
+    from langchain.prompts import PromptTemplate
+    from langchain.prompts.chat import (
+        ChatPromptTemplate,
+        SystemMessagePromptTemplate,
+        AIMessagePromptTemplate,
+        HumanMessagePromptTemplate,
+    )
+
+    system_message_prompt = SystemMessagePromptTemplate(
+        prompt=PromptTemplate(
+            template=system_prompt,
+            input_variables=system_prompt_vars,
+            template_format="jinja2"
         )
-        self.merge_and_prune_prompt = self._create_prompt(
-            system_prompt=self._merge_and_prune_system_prompt,
-            user_prompt=self._merge_and_prune_user_prompt,
-            user_prompt_vars=["cmap", "max_num_concepts", "max_num_relationships"],
-            examples=self._merge_and_prune_examples
+    )
+
+    human_message_prompt = HumanMessagePromptTemplate(
+        prompt=PromptTemplate(
+            template=user_prompt,
+            input_variables=user_prompt_vars,
+            template_format="jinja2"
         )
-        
-        self.chatbot = chatbot
+    )
 
-    def _create_prompt(self, 
-                       system_prompt: str = "", system_prompt_vars: List[str] = [],
-                       user_prompt: str = "", user_prompt_vars: List[str] = [], 
-                       examples: List[Dict] = []) -> ChatPromptTemplate:
-        system_message_prompt = SystemMessagePromptTemplate(
-            prompt=PromptTemplate(
-                template=system_prompt,
-                input_variables=system_prompt_vars,
-                template_format="jinja2"
+    examples_message_prompts = []
+    for example in examples:
+        role_message_prompt_template = AIMessagePromptTemplate if example["role"] == "assistant" else HumanMessagePromptTemplate
+        examples_message_prompts.append(
+            role_message_prompt_template(
+                prompt=PromptTemplate(
+                    template=example["content"],
+                    input_variables=[],
+                    template_format="jinja2"
+                )
             )
         )
 
-        human_message_prompt = HumanMessagePromptTemplate(
+    return ChatPromptTemplate.from_messages([system_message_prompt, *examples_message_prompts, human_message_prompt])
+
+
+@lru_cache(maxsize=None)
+def load_prompts(compact_prompts: bool = False) -> Mapping[str, ChatPromptTemplate]:
+    """
+    Compile the prompt templates of CMapGPT from `metas/`. They are compiled once per process, on first use, and
+    shared read-only by all instances, so that building a CMapGPT costs nothing.
+
+    :param compact_prompts: Whether to use the token-lean generate and merge prompts, see `CMapGPT`. Default: False.
+    :return: The prompt templates by name: "preprocess", "generate", "merge_and_prune", "fuse", "fuse_summary", "answer"
+             and "continue".
+    """
+    import yaml
+    from langchain.prompts import PromptTemplate
+    from langchain.prompts.chat import ChatPromptTemplate, HumanMessagePromptTemplate, MessagesPlaceholder
+
+    generate_key = "generate_compact" if compact_prompts else "generate"
+    merge_and_prune_key = "merge_and_prune_compact" if compact_prompts else "merge_and_prune"
+    prompt_config = yaml.safe_load(_load_meta("prompts.yaml"))
+
+    # prompt name -> (key in prompts.yaml, user prompt variables, examples file)
+    specs = {
+        "preprocess": ("preprocess", ["text"], "preprocess_examples.json"),
+        "generate": (generate_key, ["text", "max_num_concepts", "max_num_relationships"], "generate_examples.json"),
+        "merge_and_prune": (merge_and_prune_key, ["cmap", "max_num_concepts", "max_num_relationships"], f"{merge_and_prune_key}_examples.json"),
+        "fuse": ("fuse", ["text", "max_num_concepts", "max_num_relationships"], "fuse_examples.json"),
+        "fuse_summary": ("fuse_summary", ["text", "max_num_concepts", "max_num_relationships"], "fuse_summary_examples.json"),
+        "answer": ("answer", ["passages", "relationships", "question"], None),
+    }
+    logger.debug("[CMapGPT] Compiling the prompts (compact_prompts=%s)", compact_prompts)
+    prompts = {
+        name: _create_prompt(
+            system_prompt=prompt_config[key]["system"],
+            user_prompt=prompt_config[key]["user"],
+            user_prompt_vars=user_prompt_vars,
+            examples=json.loads(_load_meta(examples)) if examples is not None else [],
+        )
+        for name, (key, user_prompt_vars, examples) in specs.items()
+    }
+    # the continuation of a truncated concept map follows the messages of the call it continues
+    prompts["continue"] = ChatPromptTemplate.from_messages([
+        MessagesPlaceholder(variable_name="history"),
+        HumanMessagePromptTemplate(
             prompt=PromptTemplate(
-                template=user_prompt,
-                input_variables=user_prompt_vars,
+                template=prompt_config["continue"]["user"],
+                input_variables=["num_relationships"],
                 template_format="jinja2"
             )
+        ),
+    ])
+    return MappingProxyType(prompts)
+
+
+class CMapGPT():
+    def __init__(self, chatbot: ChatOpenAI | AzureChatOpenAI | ChatClient, compact_prompts: bool = False,
+                 max_continuations: int = 1) -> None:
+        """
+        The concept maps written by the model are parsed tolerantly, see `output_parser`: fences, notes and trailing
+        commas are repaired locally and malformed relationships are dropped alone. A concept map cut off by the output
+        token limit keeps its complete relationships, and only the missing ones are asked for in a follow-up call. An
+        output holding no concept map at all is not cached, and is asked for again once with the continuation prompt.
+        If that fails too, the generation raises ValueError, and the merge falls back to a local merge.
+
+        :param chatbot: The chat model, or the ChatClient shared with the other components.
+        :param compact_prompts: Whether to use the token-lean prompts: all the static instructions are in the system
+                                message, so that it forms a cacheable prefix with the examples, and the concept maps to
+                                merge are sent as a numbered concept table with id-based relationships. Default: False.
+        :param max_continuations: The maximum number of follow-up calls for the rest of a truncated concept map. Default: 1.
+        """
+        self.compact_prompts = compact_prompts
+        self.max_continuations = max_continuations
+        self.chatbot = chatbot
+        self.chat_client = chatbot if isinstance(chatbot, ChatClient) else ChatClient(chatbot)
+
+    @property
+    def prompts(self) -> Mapping[str, ChatPromptTemplate]:
+        """
+        The prompt templates, see `load_prompts`.
+        """
+        return load_prompts(self.compact_prompts)
+
+    @property
+    def preprocess_prompt(self) -> ChatPromptTemplate:
+        return self.prompts["preprocess"]
+
+    @property
+    def generate_prompt(self) -> ChatPromptTemplate:
+        return self.prompts["generate"]
+
+    @property
+    def merge_and_prune_prompt(self) -> ChatPromptTemplate:
+        return self.prompts["merge_and_prune"]
+
+    @property
+    def fuse_prompt(self) -> ChatPromptTemplate:
+        return self.prompts["fuse"]
+
+    @property
+    def fuse_summary_prompt(self) -> ChatPromptTemplate:
+        return self.prompts["fuse_summary"]
+
+    @property
+    def answer_prompt(self) -> ChatPromptTemplate:
+        return self.prompts["answer"]
+
+    def _preprocess_messages(self, text: str) -> List[BaseMessage]:
+        inputs = self.preprocess_prompt.format_prompt(text=text)
+        if logger.isEnabledFor(logging.DEBUG):
+            # rendering the whole prompt is only worth it if it is printed
+            logger.debug("[CMapGPT] Preprocess Prompt: %s", inputs.to_string())
+        return inputs.to_messages()
+
+    def _generate_messages(self, text: str, max_num_concepts: int, max_num_relationships: int) -> List[BaseMessage]:
+        inputs = self.generate_prompt.format_prompt(
+            text=text,
+            max_num_concepts=max_num_concepts,
+            max_num_relationships=max_num_relationships
+        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[CMapGPT] Generate Prompt: %s", inputs.to_string())
+        return inputs.to_messages()
+
+    def _merge_and_prune_messages(self, cmap: List[Dict] | ConceptMap, max_num_concepts: int,
+                                  max_num_relationships: int) -> List[BaseMessage]:
+        if self.compact_prompts:
+            # a ConceptMap keeps the weights of its relationships, which order the compact encoding
+            cmap = (cmap if isinstance(cmap, ConceptMap) else ConceptMap.from_triples(cmap)).to_compact()
+        else:
+            cmap = json.dumps(cmap.to_triples() if isinstance(cmap, ConceptMap) else cmap)
+        inputs = self.merge_and_prune_prompt.format_prompt(
+            cmap=cmap,
+            max_num_concepts=max_num_concepts,
+            max_num_relationships=max_num_relationships
+        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[CMapGPT] Merge&Prune Prompt: %s", inputs.to_string())
+        return inputs.to_messages()
+
+    def _fuse_messages(self, text: str, max_num_concepts: int, max_num_relationships: int,
+                       with_summary: bool) -> List[BaseMessage]:
+        prompt = self.fuse_summary_prompt if with_summary else self.fuse_prompt
+        inputs = prompt.format_prompt(
+            text=text,
+            max_num_concepts=max_num_concepts,
+            max_num_relationships=max_num_relationships
         )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[CMapGPT] Fuse Prompt: %s", inputs.to_string())
+        return inputs.to_messages()
 
-        examples_message_prompts = []
-        for example in examples:
-            role_message_prompt_template = AIMessagePromptTemplate if example["role"] == "assistant" else HumanMessagePromptTemplate
-            examples_message_prompts.append(
-                role_message_prompt_template(
-                    prompt=PromptTemplate(
-                        template=example["content"],
-                        input_variables=[],
-                        template_format="jinja2"
-                    )
+    def _answer_messages(self, question: str, passages: List[str], relationships: List[List[str]]) -> List[BaseMessage]:
+        inputs = self.answer_prompt.format_prompt(
+            passages="\n".join(f"[{i + 1}] {' '.join(passage.split())}" for i, passage in enumerate(passages)),
+            relationships="\n".join(" | ".join(relationship) for relationship in relationships),
+            question=question
+        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[CMapGPT] Answer Prompt: %s", inputs.to_string())
+        return inputs.to_messages()
+
+    def _continue_messages(self, messages: List[BaseMessage], cmap: List[List[str]]) -> List[BaseMessage]:
+        from langchain.schema import AIMessage
+
+        # the original request and the last relationships received, not the whole cut-off output
+        return self.prompts["continue"].format_prompt(
+            history=[*messages, AIMessage(content=json.dumps(cmap[-_CONTINUATION_TAIL:]))],
+            num_relationships=len(cmap)
+        ).to_messages()
+
+    @staticmethod
+    def _extend(cmap: List[List[str]], more: List[List[str]]) -> List[List[str]]:
+        seen = {tuple(triple) for triple in cmap}
+        return cmap + [triple for triple in more if tuple(triple) not in seen]
+
+    @staticmethod
+    def _parser(step: str, parse: Callable[[str], Tuple]) -> Callable[[str], Tuple]:
+        def _parse(response: str) -> Tuple:
+            logger.debug("[CMapGPT] %s Result: %s", step, response)
+            try:
+                return parse(response)
+            except ValueError as e:
+                metrics.increment("output_failures", step=step)
+                logger.warning("[CMapGPT] Unusable %s output: %s", step, e)
+                raise
+        return _parse
+
+    def _complete_cmap(self, messages: List[BaseMessage], cmap: List[List[str]], complete: bool,
+                       max_num_relationships: int) -> List[List[str]]:
+        for _ in range(self.max_continuations):
+            if complete or len(cmap) >= max_num_relationships:
+                break
+            logger.info("[CMapGPT] Asking for the rest of a truncated concept map after %s relationships", len(cmap))
+            try:
+                more, complete = self.chat_client.chat(
+                    self._continue_messages(messages, cmap), tag="continue", parse=self._parser("continue", parse_triples)
                 )
-            )
+            except ValueError:
+                # the relationships received so far are kept
+                break
+            cmap = self._extend(cmap, more)
+        return cmap
 
-        return ChatPromptTemplate.from_messages([system_message_prompt, *examples_message_prompts, human_message_prompt])
+    async def _acomplete_cmap(self, messages: List[BaseMessage], cmap: List[List[str]], complete: bool,
+                              max_num_relationships: int) -> List[List[str]]:
+        for _ in range(self.max_continuations):
+            if complete or len(cmap) >= max_num_relationships:
+                break
+            logger.info("[CMapGPT] Asking for the rest of a truncated concept map after %s relationships", len(cmap))
+            try:
+                more, complete = await self.chat_client.achat(
+                    self._continue_messages(messages, cmap), tag="continue", parse=self._parser("continue", parse_triples)
+                )
+            except ValueError:
+                break
+            cmap = self._extend(cmap, more)
+        return cmap
+
+    def _retry_cmap(self, messages: List[BaseMessage], step: str) -> Tuple[List[List[str]], bool]:
+        # an unusable output is asked for again once, with the continuation prompt and no relationship received
+        logger.info("[CMapGPT] Asking again for an unusable %s output", step)
+        return self.chat_client.chat(self._continue_messages(messages, []), tag="continue",
+                                     parse=self._parser("continue", parse_triples))
+
+    async def _aretry_cmap(self, messages: List[BaseMessage], step: str) -> Tuple[List[List[str]], bool]:
+        logger.info("[CMapGPT] Asking again for an unusable %s output", step)
+        return await self.chat_client.achat(self._continue_messages(messages, []), tag="continue",
+                                            parse=self._parser("continue", parse_triples))
+
+    @staticmethod
+    def _prune_locally(cmap: List | ConceptMap, max_num_concepts: int, max_num_relationships: int) -> List[List[str]]:
+        logger.warning("[CMapGPT] Merging and pruning the concept map locally instead")
+        return ConceptMap.from_triples(cmap).prune(max_num_concepts, max_num_relationships).to_triples()
 
     def preprocess(self, text: str) -> str:
         """
@@ -105,46 +308,156 @@ class CMapGPT():
         :param text: str, the text input to the model.
         :return: str, the preprocessed text.
         """
-        inputs = self.preprocess_prompt.format_prompt(text=text)
-        logger.debug(f"[CMapGPT] Preprocess Prompt: {inputs.to_string()}")
-        response = self.chatbot(inputs.to_messages()).content
-        logger.debug(f"[CMapGPT] Preprocess Result: {response}")
+        response = self.chat_client.chat(self._preprocess_messages(text), tag="preprocess")
+        logger.debug("[CMapGPT] Preprocess Result: %s", response)
         return response
 
-    def generate(self, text: str, max_num_concepts: int = 10, max_num_relationships: int = 30) -> List[Dict]:
+    async def apreprocess(self, text: str) -> str:
+        """
+        Asynchronous version of `preprocess`.
+
+        :param text: str, the text input to the model.
+        :return: str, the preprocessed text.
+        """
+        response = await self.chat_client.achat(self._preprocess_messages(text), tag="preprocess")
+        logger.debug("[CMapGPT] Preprocess Result: %s", response)
+        return response
+
+    def generate(self, text: str, max_num_concepts: int = 10, max_num_relationships: int = 30) -> List[List[str]]:
         """
         Generate a concept map from the given text.
 
         :param text: str, the text input to the model.
         :param max_num_concepts: int, the maximum number of concepts to generate.
         :param max_num_relationships: int, the maximum number of relationships to generate.
-        :return: List[Dict], the generated concept map.
+        :return: List[List[str]], the generated concept map, as [source, relationship, target] lists.
+        :raises ValueError: If the output of the model holds no concept map, even when asked again.
         """
-        inputs = self.generate_prompt.format_prompt(
-            text=text,
-            max_num_concepts=max_num_concepts,
-            max_num_relationships=max_num_relationships
-        )
-        logger.debug(f"[CMapGPT] Generate Prompt: {inputs.to_string()}")
-        response = self.chatbot(inputs.to_messages()).content
-        logger.debug(f"[CMapGPT] Generate Result: {response}")
-        return json.loads(response)
+        messages = self._generate_messages(text, max_num_concepts, max_num_relationships)
+        try:
+            cmap, complete = self.chat_client.chat(messages, tag="generate", parse=self._parser("generate", parse_triples))
+        except ValueError:
+            cmap, complete = self._retry_cmap(messages, "generate")
+        return self._complete_cmap(messages, cmap, complete, max_num_relationships)
+
+    async def agenerate(self, text: str, max_num_concepts: int = 10, max_num_relationships: int = 30) -> List[List[str]]:
+        """
+        Asynchronous version of `generate`.
+
+        :param text: str, the text input to the model.
+        :param max_num_concepts: int, the maximum number of concepts to generate.
+        :param max_num_relationships: int, the maximum number of relationships to generate.
+        :return: List[List[str]], the generated concept map, as [source, relationship, target] lists.
+        :raises ValueError: If the output of the model holds no concept map, even when asked again.
+        """
+        messages = self._generate_messages(text, max_num_concepts, max_num_relationships)
+        try:
+            cmap, complete = await self.chat_client.achat(messages, tag="generate", parse=self._parser("generate", parse_triples))
+        except ValueError:
+            cmap, complete = await self._aretry_cmap(messages, "generate")
+        return await self._acomplete_cmap(messages, cmap, complete, max_num_relationships)
 
-    def merge_and_prune(self, cmap: List[Dict], max_num_concepts: int = 10, max_num_relationships: int = 30) -> List[Dict]:
+    def merge_and_prune(self, cmap: List[Dict] | ConceptMap, max_num_concepts: int = 10, max_num_relationships: int = 30) -> List[List[str]]:
         """
         Merge and prune the given concept map.
 
-        :param cmap: List[Dict], the concept map to merge and prune.
+        :param cmap: List[Dict] | ConceptMap, the concept map to merge and prune. The weights of a ConceptMap, e.g. a
+                     union of concept maps, order its relationships in the compact prompt.
         :param max_num_concepts: int, the maximum number of concepts to generate.
         :param max_num_relationships: int, the maximum number of relationships to generate.
-        :return: List[Dict], the merged and pruned concept map.
+        :return: List[List[str]], the merged and pruned concept map, as [source, relationship, target] lists. If the output was
+                 unusable, {cmap} merged and pruned locally.
         """
-        inputs = self.merge_and_prune_prompt.format_prompt(
-            cmap=json.dumps(cmap),
-            max_num_concepts=max_num_concepts,
-            max_num_relationships=max_num_relationships
-        )
-        logger.debug(f"[CMapGPT] Merge&Prune Prompt: {inputs.to_string()}")
-        response = self.chatbot(inputs.to_messages()).content
-        logger.debug(f"[CMapGPT] Merge&Prune Result: {response}")
-        return json.loads(response)
\ No newline at end of file
+        messages = self._merge_and_prune_messages(cmap, max_num_concepts, max_num_relationships)
+        try:
+            merged, complete = self.chat_client.chat(
+                messages, tag="merge_and_prune", parse=self._parser("merge_and_prune", parse_triples)
+            )
+        except ValueError:
+            return self._prune_locally(cmap, max_num_concepts, max_num_relationships)
+        return self._complete_cmap(messages, merged, complete, max_num_relationships)
+
+    async def amerge_and_prune(self, cmap: List[Dict] | ConceptMap, max_num_concepts: int = 10, max_num_relationships: int = 30) -> List[List[str]]:
+        """
+        Asynchronous version of `merge_and_prune`.
+
+        :param cmap: List[Dict] | ConceptMap, the concept map to merge and prune. The weights of a ConceptMap, e.g. a
+                     union of concept maps, order its relationships in the compact prompt.
+        :param max_num_concepts: int, the maximum number of concepts to generate.
+        :param max_num_relationships: int, the maximum number of relationships to generate.
+        :return: List[List[str]], the merged and pruned concept map, as [source, relationship, target] lists. If the output was
+                 unusable, {cmap} merged and pruned locally.
+        """
+        messages = self._merge_and_prune_messages(cmap, max_num_concepts, max_num_relationships)
+        try:
+            merged, complete = await self.chat_client.achat(
+                messages, tag="merge_and_prune", parse=self._parser("merge_and_prune", parse_triples)
+            )
+        except ValueError:
+            return self._prune_locally(cmap, max_num_concepts, max_num_relationships)
+        return await self._acomplete_cmap(messages, merged, complete, max_num_relationships)
+
+    def generate_fused(self, text: str, max_num_concepts: int = 10, max_num_relationships: int = 30,
+                       with_summary: bool = False) -> Tuple[List[List[str]], str | None]:
+        """
+        Generate a concept map from the given raw text in a single call, without preprocessing it first.
+
+        :param text: str, the text input to the model.
+        :param max_num_concepts: int, the maximum number of concepts to generate.
+        :param max_num_relationships: int, the maximum number of relationships to generate.
+        :param with_summary: bool, whether the model also summarizes the text, like `preprocess`, in the same call.
+        :return: Tuple[List[List[str]], str | None], the generated concept map, and the summary or None.
+        :raises ValueError: If the output of the model holds no concept map, even when asked again.
+        """
+        messages = self._fuse_messages(text, max_num_concepts, max_num_relationships, with_summary)
+        try:
+            cmap, summary, complete = self.chat_client.chat(messages, tag="fuse", parse=self._parser("fuse", parse_fused))
+        except ValueError:
+            # the summary is not asked for again
+            (cmap, complete), summary = self._retry_cmap(messages, "fuse"), None
+        return self._complete_cmap(messages, cmap, complete, max_num_relationships), summary
+
+    async def agenerate_fused(self, text: str, max_num_concepts: int = 10, max_num_relationships: int = 30,
+                              with_summary: bool = False) -> Tuple[List[List[str]], str | None]:
+        """
+        Asynchronous version of `generate_fused`.
+
+        :param text: str, the text input to the model.
+        :param max_num_concepts: int, the maximum number of concepts to generate.
+        :param max_num_relationships: int, the maximum number of relationships to generate.
+        :param with_summary: bool, whether the model also summarizes the text, like `preprocess`, in the same call.
+        :return: Tuple[List[List[str]], str | None], the generated concept map, and the summary or None.
+        :raises ValueError: If the output of the model holds no concept map, even when asked again.
+        """
+        messages = self._fuse_messages(text, max_num_concepts, max_num_relationships, with_summary)
+        try:
+            cmap, summary, complete = await self.chat_client.achat(messages, tag="fuse", parse=self._parser("fuse", parse_fused))
+        except ValueError:
+            (cmap, complete), summary = await self._aretry_cmap(messages, "fuse"), None
+        return await self._acomplete_cmap(messages, cmap, complete, max_num_relationships), summary
+
+    def answer(self, question: str, passages: List[str], relationships: List[List[str]] = []) -> str:
+        """
+        Answer a question from a few passages of a paper and relationships of its concept map, see `ConceptIndex.retrieve`.
+
+        :param question: str, the question.
+        :param passages: List[str], the passages, cited by their 1-based number in the answer.
+        :param relationships: List[List[str]], the [source, relationship, target] triples related to the question.
+        :return: str, the answer.
+        """
+        response = self.chat_client.chat(self._answer_messages(question, passages, relationships), tag="answer")
+        logger.debug("[CMapGPT] Answer Result: %s", response)
+        return response
+
+    async def aanswer(self, question: str, passages: List[str], relationships: List[List[str]] = []) -> str:
+        """
+        Asynchronous version of `answer`.
+
+        :param question: str, the question.
+        :param passages: List[str], the passages, cited by their 1-based number in the answer.
+        :param relationships: List[List[str]], the [source, relationship, target] triples related to the question.
+        :return: str, the answer.
+        """
+        response = await self.chat_client.achat(self._answer_messages(question, passages, relationships), tag="answer")
+        logger.debug("[CMapGPT] Answer Result: %s", response)
+        return response
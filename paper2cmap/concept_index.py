@@ -0,0 +1,402 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+
+from paper2cmap import logger, metrics
+from paper2cmap.checkpoint import hash_file
+from paper2cmap.concept_map import ConceptMap
+from paper2cmap.title_matcher import TitleMatcher, normalize_title
+
+_WORDS = re.compile(r"\w+")
+# too common to tell passages apart, and they would make every query match the whole corpus
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "has", "have", "how", "in",
+    "is", "it", "its", "of", "on", "or", "that", "the", "this", "to", "was", "what", "when", "where", "which", "who",
+    "why", "with",
+}
+
+
+def split_passages(text: str, passage_size: int = 1000) -> List[Tuple[int, int]]:
+    """
+    Cut a text into passages of at most {passage_size} characters, at paragraph or sentence boundaries where possible.
+
+    :param text: The text, e.g. a section.
+    :param passage_size: The maximum number of characters of a passage. Default: 1000.
+    :return: The (start, end) offsets of the passages.
+    """
+    spans = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + passage_size)
+        if end < len(text):
+            # cut after the last paragraph or sentence break of the second half of the window
+            cut = max(text.rfind("\n\n", start, end), text.rfind(". ", start, end))
+            if cut > start + passage_size // 2:
+                end = cut + 1
+        spans.append((start, end))
+        start = end
+    return spans
+
+
+class ConceptIndex():
+    def __init__(self, db_path: str, passage_size: int = 1000, max_mentions: int = 20) -> None:
+        """
+        A persistent index of the concept maps of many papers, backed by SQLite. It maps every concept and relationship
+        of a concept map to the sections and character spans of the paper it came from, and keeps a full-text index
+        (SQLite FTS5, BM25 ranked) of the passages of every section, so that a question can be answered from a few
+        passages instead of the whole paper. Several processes may share one database.
+
+        :param db_path: The path of the database file.
+        :param passage_size: The maximum number of characters of an indexed passage. Default: 1000.
+        :param max_mentions: The maximum number of mentions of a concept kept per paper. Default: 20.
+        """
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self.passage_size = passage_size
+        self.max_mentions = max_mentions
+        # sqlite connections must not be shared across threads
+        self._local = threading.local()
+
+        conn = self._connect()
+        conn.executescript(
+            "CREATE TABLE IF NOT EXISTS papers ("
+            "id INTEGER PRIMARY KEY, key TEXT UNIQUE NOT NULL, path TEXT NOT NULL, cmap TEXT NOT NULL, "
+            "num_sections INTEGER NOT NULL, first_passage INTEGER, last_passage INTEGER, created_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS passages ("
+            "id INTEGER PRIMARY KEY, paper_id INTEGER NOT NULL, section INTEGER NOT NULL, "
+            "start INTEGER NOT NULL, end INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS passages_paper ON passages (paper_id, section, start);"
+            "CREATE VIRTUAL TABLE IF NOT EXISTS passages_fts USING fts5(text, tokenize='porter unicode61');"
+            "CREATE TABLE IF NOT EXISTS mentions ("
+            "paper_id INTEGER NOT NULL, concept TEXT NOT NULL, norm TEXT NOT NULL, passage_id INTEGER NOT NULL, "
+            "section INTEGER NOT NULL, start INTEGER NOT NULL, end INTEGER NOT NULL, exact INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS mentions_norm ON mentions (norm, paper_id);"
+            "CREATE INDEX IF NOT EXISTS mentions_paper ON mentions (paper_id, concept);"
+            "CREATE TABLE IF NOT EXISTS edges ("
+            "paper_id INTEGER NOT NULL, source TEXT NOT NULL, relationship TEXT NOT NULL, target TEXT NOT NULL, "
+            "passage_id INTEGER, section INTEGER, start INTEGER, end INTEGER, exact INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS edges_paper ON edges (paper_id, source);"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # a generous busy timeout lets concurrent writers from other processes wait for the lock
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _fts_query(text: str, operator: str = "OR") -> str:
+        # every word is quoted, so that the punctuation of a question is never read as FTS5 syntax
+        words = dict.fromkeys(word for word in _WORDS.findall(text.lower()) if word not in _STOPWORDS)
+        return f" {operator} ".join(f'"{word}"' for word in words)
+
+    def _delete(self, conn: sqlite3.Connection, paper_id: int) -> None:
+        conn.execute("DELETE FROM passages_fts WHERE rowid IN (SELECT id FROM passages WHERE paper_id = ?)", (paper_id,))
+        for table in ("passages", "mentions", "edges"):
+            conn.execute(f"DELETE FROM {table} WHERE paper_id = ?", (paper_id,))
+        conn.execute("DELETE FROM papers WHERE id = ?", (paper_id,))
+
+    def _index_concepts(self, conn: sqlite3.Connection, paper_id: int, concepts: List[str],
+                        sections: Iterable[str]) -> Tuple[Dict[str, List[Tuple]], int]:
+        """
+        Find the mentions of every concept in the sections, and index the passages of every section.
+
+        :return: The (passage id, section, start, end) of the literal mentions of every concept, and the number of sections.
+        """
+        matcher = TitleMatcher(concepts)
+        mentions: Dict[str, List[Tuple]] = {concept: [] for concept in concepts}
+        num_sections = 0
+        # sections are read one at a time, so that TextRanges are never materialized all at once
+        for section_index, section in enumerate(sections):
+            num_sections += 1
+            spans = split_passages(section, self.passage_size)
+            passage_ids = []
+            for start, end in spans:
+                cursor = conn.execute(
+                    "INSERT INTO passages (paper_id, section, start, end) VALUES (?, ?, ?, ?)",
+                    (paper_id, section_index, start, end)
+                )
+                passage_ids.append(cursor.lastrowid)
+                conn.execute("INSERT INTO passages_fts (rowid, text) VALUES (?, ?)", (cursor.lastrowid, section[start:end]))
+
+            passage = 0
+            for offset, concept_index in matcher.find_all(section):
+                concept = concepts[concept_index]
+                if len(mentions[concept]) >= self.max_mentions:
+                    continue
+                while spans[passage][1] <= offset:
+                    passage += 1
+                mentions[concept].append((passage_ids[passage], section_index, offset, offset + len(concept)))
+        return mentions, num_sections
+
+    @staticmethod
+    def _match(conn: sqlite3.Connection, fts_query: str, k: int, paper_id: int | None = None) -> List[int]:
+        """
+        :return: The ids of the {k} passages ranked best by BM25 for an FTS5 query, optionally within one paper.
+        """
+        if paper_id is None:
+            rows = conn.execute(
+                "SELECT rowid FROM passages_fts WHERE passages_fts MATCH ? ORDER BY rank LIMIT ?", (fts_query, k)
+            ).fetchall()
+            return [row[0] for row in rows]
+
+        # FTS5 only scans the rowid range of the paper, instead of the matches of the whole corpus
+        passage_range = conn.execute(
+            "SELECT COALESCE(first_passage, (SELECT MIN(id) FROM passages WHERE paper_id = ?)), "
+            "COALESCE(last_passage, (SELECT MAX(id) FROM passages WHERE paper_id = ?)) FROM papers WHERE id = ?",
+            (paper_id, paper_id, paper_id)
+        ).fetchone()
+        if passage_range is None or passage_range[0] is None:
+            return []
+        rows = conn.execute(
+            "SELECT rowid FROM passages_fts WHERE passages_fts MATCH ? AND rowid BETWEEN ? AND ? ORDER BY rank LIMIT ?",
+            (fts_query, *passage_range, k)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _ground(self, conn: sqlite3.Connection, paper_id: int, concept: str) -> List[Tuple]:
+        """
+        Find the passage best matching a concept that is not literally in the paper, e.g. rephrased by the LLM.
+        """
+        query = self._fts_query(concept, "OR")
+        passage_ids = self._match(conn, query, 1, paper_id) if query else []
+        if not passage_ids:
+            return []
+        row = conn.execute("SELECT id, section, start, end FROM passages WHERE id = ?", (passage_ids[0],)).fetchone()
+        return [tuple(row)]
+
+    def add(self, path: str, sections: Iterable[str], cmap: List | ConceptMap, key: str | None = None) -> int:
+        """
+        Index the concept map of a paper, replacing any previous version of the same paper.
+
+        :param path: The path of the PDF file.
+        :param sections: The texts of the sections the concept map was generated from, e.g. `PaperReader.sections`.
+        :param cmap: The concept map.
+        :param key: The key identifying the paper. If None, the content hash of the PDF file. Default: None.
+        :return: The id of the paper in the index.
+        """
+        cmap = cmap if isinstance(cmap, ConceptMap) else ConceptMap.from_triples(cmap)
+        key = key or hash_file(path)
+        conn = self._connect()
+        with metrics.span("index", path=path):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT id FROM papers WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._delete(conn, row[0])
+                triples = cmap.to_triples()
+                paper_id = conn.execute(
+                    "INSERT INTO papers (key, path, cmap, num_sections, created_at) VALUES (?, ?, ?, 0, ?)",
+                    (key, path, json.dumps(triples, ensure_ascii=False), time.time())
+                ).lastrowid
+
+                mentions, num_sections = self._index_concepts(conn, paper_id, cmap.concepts, sections)
+                # the passages of a paper are inserted in one transaction, so their ids are contiguous
+                conn.execute(
+                    "UPDATE papers SET num_sections = ?, first_passage = (SELECT MIN(id) FROM passages WHERE paper_id = ?), "
+                    "last_passage = (SELECT MAX(id) FROM passages WHERE paper_id = ?) WHERE id = ?",
+                    (num_sections, paper_id, paper_id, paper_id)
+                )
+
+                exact = {concept: bool(spans) for concept, spans in mentions.items()}
+                for concept in cmap.concepts:
+                    if not mentions[concept]:
+                        mentions[concept] = self._ground(conn, paper_id, concept)
+                    conn.executemany(
+                        "INSERT INTO mentions (paper_id, concept, norm, passage_id, section, start, end, exact) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        [(paper_id, concept, normalize_title(concept), *span, exact[concept]) for span in mentions[concept]]
+                    )
+
+                for source, relationship, target in triples:
+                    span, both = self._edge_span(mentions[source], mentions[target])
+                    conn.execute(
+                        "INSERT INTO edges (paper_id, source, relationship, target, passage_id, section, start, end, exact) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (paper_id, source, relationship, target, *span, both and exact[source] and exact[target])
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+        num_grounded = sum(exact.values())
+        logger.info("[ConceptIndex] Indexed %s: %s sections, %s of %s concepts found verbatim",
+                    path, num_sections, num_grounded, len(exact))
+        return paper_id
+
+    @staticmethod
+    def _edge_span(source_mentions: List[Tuple], target_mentions: List[Tuple]) -> Tuple[Tuple, bool]:
+        """
+        The span of a relationship: the first passage mentioning both of its concepts, or else the first one mentioning either.
+
+        :return: The (passage id, section, start, end) of the span, and whether both concepts are in it.
+        """
+        target_by_passage = {}
+        for mention in target_mentions:
+            target_by_passage.setdefault(mention[0], mention)
+        for mention in source_mentions:
+            other = target_by_passage.get(mention[0])
+            if other is not None:
+                return (mention[0], mention[1], min(mention[2], other[2]), max(mention[3], other[3])), True
+        mentions = source_mentions or target_mentions
+        return (mentions[0] if mentions else (None, None, None, None)), False
+
+    def papers(self) -> List[Dict]:
+        """
+        :return: The id, key, path and number of sections of every indexed paper.
+        """
+        rows = self._connect().execute("SELECT id, key, path, num_sections FROM papers ORDER BY id").fetchall()
+        return [{"id": row[0], "key": row[1], "path": row[2], "num_sections": row[3]} for row in rows]
+
+    def paper_id(self, key: str) -> int | None:
+        """
+        :param key: The key of the paper, by default the content hash of its PDF file, see `checkpoint.hash_file`.
+        :return: The id of the paper, or None if it is not indexed.
+        """
+        row = self._connect().execute("SELECT id FROM papers WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def cmap(self, paper_id: int) -> List[List[str]]:
+        """
+        :param paper_id: The id of the paper.
+        :return: The concept map of the paper, as [source, relationship, target] triples.
+        """
+        row = self._connect().execute("SELECT cmap FROM papers WHERE id = ?", (paper_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"Paper {paper_id} is not indexed")
+        return json.loads(row[0])
+
+    def locate(self, concept: str, paper_id: int | None = None) -> List[Dict]:
+        """
+        Find where a concept comes from.
+
+        :param concept: The label of the concept, matched regardless of case and spacing.
+        :param paper_id: If given, only the mentions in this paper. Default: None.
+        :return: The mentions, as {"paper_id", "concept", "section", "start", "end", "exact"} dicts, where the offsets
+                 are relative to the section and "exact" tells whether the label is literally in the text, or the span
+                 is the passage best matching it.
+        """
+        sql = "SELECT paper_id, concept, section, start, end, exact FROM mentions WHERE norm = ?"
+        params: Tuple = (normalize_title(concept),)
+        if paper_id is not None:
+            sql, params = sql + " AND paper_id = ?", params + (paper_id,)
+        keys = ("paper_id", "concept", "section", "start", "end", "exact")
+        return [dict(zip(keys, row)) for row in self._connect().execute(sql + " ORDER BY paper_id, section, start", params)]
+
+    def relationships(self, paper_id: int, concept: str | None = None) -> List[Dict]:
+        """
+        :param paper_id: The id of the paper.
+        :param concept: If given, only the relationships from or to this concept. Default: None.
+        :return: The relationships, as {"source", "relationship", "target", "section", "start", "end", "exact"} dicts,
+                 where "exact" tells whether both concepts are literally in the span.
+        """
+        sql = "SELECT source, relationship, target, section, start, end, exact FROM edges WHERE paper_id = ?"
+        params: Tuple = (paper_id,)
+        if concept is not None:
+            sql, params = sql + " AND (source = ? OR target = ?)", params + (concept, concept)
+        keys = ("source", "relationship", "target", "section", "start", "end", "exact")
+        return [dict(zip(keys, row)) for row in self._connect().execute(sql, params)]
+
+    def _passages(self, passage_ids: List[int]) -> List[Dict]:
+        if not passage_ids:
+            return []
+        rows = self._connect().execute(
+            "SELECT p.id, p.paper_id, p.section, p.start, p.end, f.text FROM passages p "
+            f"JOIN passages_fts f ON f.rowid = p.id WHERE p.id IN ({','.join('?' * len(passage_ids))})",
+            passage_ids
+        ).fetchall()
+        by_id = {row[0]: dict(zip(("id", "paper_id", "section", "start", "end", "text"), row)) for row in rows}
+        return [by_id[passage_id] for passage_id in passage_ids if passage_id in by_id]
+
+    def search(self, query: str, k: int = 5, paper_id: int | None = None) -> List[Dict]:
+        """
+        Rank the passages by BM25 relevance to a query.
+
+        :param query: The query, e.g. a question.
+        :param k: The number of passages. Default: 5.
+        :param paper_id: If given, only the passages of this paper. Default: None.
+        :return: The passages, as {"id", "paper_id", "section", "start", "end", "text"} dicts, best first.
+        """
+        fts_query = self._fts_query(query)
+        if not fts_query:
+            return []
+        return self._passages(self._match(self._connect(), fts_query, k, paper_id))
+
+    def retrieve(self, question: str, k: int = 4, paper_id: int | None = None, max_ngram: int = 4) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Pick the passages to answer a question with: first the passages where the concepts named in the question come
+        from, then the passages ranked best by `search`.
+
+        :param question: The question.
+        :param k: The maximum number of passages. Default: 4.
+        :param paper_id: If given, only the passages of this paper. Default: None.
+        :param max_ngram: The maximum number of words of a concept looked up in the question. Default: 4.
+        :return: The passages, and the relationships of the concept maps involving the concepts of the question.
+        """
+        with metrics.span("retrieve", paper_id=paper_id):
+            words = normalize_title(question).replace("-", " - ").split()
+            words = [word.strip("?!.,;:'\"()") for word in words]
+            ngrams = {
+                " ".join(words[i:i + n]).replace(" - ", "-")
+                for n in range(1, max_ngram + 1) for i in range(len(words) - n + 1)
+            }
+            ngrams = [ngram for ngram in ngrams if ngram and ngram not in _STOPWORDS]
+
+            conn = self._connect()
+            mentions = []
+            if ngrams:
+                sql = (f"SELECT paper_id, concept, passage_id FROM mentions WHERE norm IN ({','.join('?' * len(ngrams))})")
+                params: Tuple = tuple(ngrams)
+                if paper_id is not None:
+                    sql, params = sql + " AND paper_id = ?", params + (paper_id,)
+                mentions = conn.execute(sql + " ORDER BY exact DESC, section, start", params).fetchall()
+
+            # passages mentioning more (and longer, so more specific) concepts of the question come first
+            scores: Dict[int, int] = {}
+            for passage_id, concepts in self._group(mentions).items():
+                scores[passage_id] = sum(len(concept) for concept in concepts)
+            passage_ids = sorted(scores, key=lambda passage_id: -scores[passage_id])[:k]
+            if len(passage_ids) < k:
+                for passage in self.search(question, k, paper_id):
+                    if passage["id"] not in passage_ids and len(passage_ids) < k:
+                        passage_ids.append(passage["id"])
+
+            relationships = []
+            for concept_paper_id, concept in dict.fromkeys((row[0], row[1]) for row in mentions):
+                relationships.extend(self.relationships(concept_paper_id, concept))
+            return self._passages(passage_ids), relationships
+
+    @staticmethod
+    def _group(mentions: List[Tuple]) -> Dict[int, set]:
+        # passage id -> concepts mentioned in it, by order of first mention
+        groups: Dict[int, set] = {}
+        for _, concept, passage_id in mentions:
+            groups.setdefault(passage_id, set()).add(concept)
+        return groups
+
+    def remove(self, paper_id: int) -> None:
+        """
+        Remove a paper from the index.
+
+        :param paper_id: The id of the paper.
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._delete(conn, paper_id)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+import re
+from array import array
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from paper2cmap import logger
+
+
+class ConceptMap():
+    _ARTICLES = re.compile(r"^(the|a|an)\s+")
+    _PUNCTUATIONS = re.compile(r"[^\w\s-]")
+    _SPACES = re.compile(r"\s+")
+
+    def __init__(self, normalize: bool = True) -> None:
+        """
+        A compact concept map. Concept and relationship labels are interned to integer ids,
+        and edges are stored as parallel integer arrays with adjacency indexes.
+
+        :param normalize: Whether labels differing only in case, punctuation, spacing or a leading article are the same concept. Default: True.
+        """
+        self.normalize = normalize
+
+        self.concepts: List[str] = []
+        self.relationships: List[str] = []
+        self._concept_ids: Dict[str, int] = {}
+        self._relationship_ids: Dict[str, int] = {}
+
+        # edge i is (_sources[i], _relations[i], _targets[i]), seen _weights[i] times
+        self._sources = array("i")
+        self._relations = array("i")
+        self._targets = array("i")
+        self._weights = array("i")
+        self._edge_ids: Dict[Tuple[int, int, int], int] = {}
+
+        # concept id -> ids of its outgoing / incoming edges
+        self._out_edges: List[List[int]] = []
+        self._in_edges: List[List[int]] = []
+
+    @classmethod
+    def _normalize_label(cls, label: str) -> str:
+        label = cls._SPACES.sub(" ", label.strip().lower())
+        label = cls._PUNCTUATIONS.sub("", label)
+        return cls._ARTICLES.sub("", label).strip()
+
+    def _key(self, label: str) -> str:
+        return self._normalize_label(label) if self.normalize else label
+
+    def _intern_concept(self, label: str) -> int:
+        key = self._key(label)
+        concept_id = self._concept_ids.get(key)
+        if concept_id is None:
+            concept_id = len(self.concepts)
+            self._concept_ids[key] = concept_id
+            self.concepts.append(label.strip())
+            self._out_edges.append([])
+            self._in_edges.append([])
+        return concept_id
+
+    def _intern_relationship(self, label: str) -> int:
+        key = self._key(label)
+        relationship_id = self._relationship_ids.get(key)
+        if relationship_id is None:
+            relationship_id = len(self.relationships)
+            self._relationship_ids[key] = relationship_id
+            self.relationships.append(label.strip())
+        return relationship_id
+
+    def add(self, source: str, relationship: str, target: str, weight: int = 1) -> None:
+        """
+        Add a relationship between two concepts. Adding an existing relationship increases its weight.
+
+        :param source: The source concept.
+        :param relationship: The relationship.
+        :param target: The target concept.
+        :param weight: The weight to add. Default: 1.
+        """
+        edge = (self._intern_concept(source), self._intern_relationship(relationship), self._intern_concept(target))
+        edge_id = self._edge_ids.get(edge)
+        if edge_id is not None:
+            self._weights[edge_id] += weight
+            return
+
+        edge_id = len(self._sources)
+        self._edge_ids[edge] = edge_id
+        self._sources.append(edge[0])
+        self._relations.append(edge[1])
+        self._targets.append(edge[2])
+        self._weights.append(weight)
+        self._out_edges[edge[0]].append(edge_id)
+        self._in_edges[edge[2]].append(edge_id)
+
+    def update(self, cmap: List | ConceptMap) -> ConceptMap:
+        """
+        Add every relationship of another concept map to this one.
+
+        :param cmap: A concept map, either a ConceptMap or a list of [source, relationship, target] lists
+                     or {"source", "relationship", "target"} dicts.
+        :return: This concept map.
+        """
+        if isinstance(cmap, ConceptMap):
+            for edge_id in range(len(cmap)):
+                self.add(*cmap._edge_labels(edge_id), weight=cmap._weights[edge_id])
+            return self
+
+        for triple in cmap:
+            if isinstance(triple, dict) and {"source", "relationship", "target"} <= triple.keys():
+                self.add(str(triple["source"]), str(triple["relationship"]), str(triple["target"]))
+            elif isinstance(triple, (list, tuple)) and len(triple) == 3:
+                self.add(*[str(label) for label in triple])
+            else:
+                logger.warning("[ConceptMap] Skipped malformed relationship: %s", triple)
+        return self
+
+    @classmethod
+    def from_triples(cls, cmap: List, normalize: bool = True) -> ConceptMap:
+        """
+        Build a concept map from a list of [source, relationship, target] lists or {"source", "relationship", "target"} dicts.
+
+        :param cmap: The relationships.
+        :param normalize: Whether to merge labels differing only in case, punctuation, spacing or a leading article. Default: True.
+        :return: The concept map.
+        """
+        return cls(normalize=normalize).update(cmap)
+
+    @classmethod
+    def union(cls, cmaps: Iterable[List | ConceptMap], normalize: bool = True) -> ConceptMap:
+        """
+        Merge several concept maps into one, removing duplicated relationships.
+
+        :param cmaps: The concept maps.
+        :param normalize: Whether to merge labels differing only in case, punctuation, spacing or a leading article. Default: True.
+        :return: The merged concept map.
+        """
+        merged = cls(normalize=normalize)
+        for cmap in cmaps:
+            merged.update(cmap)
+        return merged
+
+    def _edge_labels(self, edge_id: int) -> Tuple[str, str, str]:
+        return (
+            self.concepts[self._sources[edge_id]],
+            self.relationships[self._relations[edge_id]],
+            self.concepts[self._targets[edge_id]],
+        )
+
+    def __len__(self) -> int:
+        return len(self._sources)
+
+    def __iter__(self) -> Iterator[Tuple[str, str, str]]:
+        for edge_id in range(len(self)):
+            yield self._edge_labels(edge_id)
+
+    @property
+    def num_concepts(self) -> int:
+        return len(self.concepts)
+
+    def neighbors(self, concept: str) -> List[str]:
+        """
+        List the concepts directly connected to the given concept, in either direction.
+
+        :param concept: The concept.
+        :return: The neighboring concepts.
+        """
+        concept_id = self._concept_ids.get(self._key(concept))
+        if concept_id is None:
+            return []
+        neighbor_ids = dict.fromkeys(
+            [self._targets[edge_id] for edge_id in self._out_edges[concept_id]] +
+            [self._sources[edge_id] for edge_id in self._in_edges[concept_id]]
+        )
+        return [self.concepts[neighbor_id] for neighbor_id in neighbor_ids]
+
+    def degrees(self) -> List[int]:
+        """
+        Compute the weighted degree of every concept, indexed by concept id.
+
+        :return: The weighted degrees.
+        """
+        return [
+            sum(self._weights[edge_id] for edge_id in self._out_edges[concept_id]) +
+            sum(self._weights[edge_id] for edge_id in self._in_edges[concept_id])
+            for concept_id in range(self.num_concepts)
+        ]
+
+    def prune(self, max_num_concepts: int = 10, max_num_relationships: int = 30) -> ConceptMap:
+        """
+        Deterministically keep the most central concepts and relationships.
+        Concepts are ranked by weighted degree, and relationships among the kept concepts
+        by their weight and the degrees of their endpoints. Ties keep the insertion order.
+
+        :param max_num_concepts: The maximum number of concepts.
+        :param max_num_relationships: The maximum number of relationships.
+        :return: A new, pruned concept map.
+        """
+        degrees = self.degrees()
+        ranked_concepts = sorted(range(self.num_concepts), key=lambda concept_id: -degrees[concept_id])
+        kept_concepts = set(ranked_concepts[:max_num_concepts])
+
+        kept_edges = [
+            edge_id for edge_id in range(len(self))
+            if self._sources[edge_id] in kept_concepts and self._targets[edge_id] in kept_concepts
+        ]
+        kept_edges.sort(key=lambda edge_id: (
+            -self._weights[edge_id],
+            -(degrees[self._sources[edge_id]] + degrees[self._targets[edge_id]]),
+        ))
+        kept_edges = sorted(kept_edges[:max_num_relationships])
+
+        pruned = ConceptMap(normalize=self.normalize)
+        for edge_id in kept_edges:
+            pruned.add(*self._edge_labels(edge_id), weight=self._weights[edge_id])
+        return pruned
+
+    def concept_clusters(self, threshold: float = 0.65) -> Dict[str, str]:
+        """
+        Cluster near-duplicate concepts such as "Transformer" and "transformer model" by character n-gram similarity,
+        see `clustering.cluster_labels`. The canonical label of a cluster is its concept with the highest weighted degree,
+        and every other concept of the cluster is similar to all of them.
+
+        :param threshold: The minimum cosine similarity of two concepts in the same cluster. Default: 0.65.
+        :return: A mapping from the (normalized) concept labels to the canonical labels of their clusters.
+        """
+        from paper2cmap.clustering import cluster_labels
+
+        cluster_ids = cluster_labels([self._normalize_label(concept) for concept in self.concepts], threshold,
+                                     weights=self.degrees())
+        return {
+            self._key(concept): self.concepts[cluster_ids[concept_id]]
+            for concept_id, concept in enumerate(self.concepts)
+        }
+
+    def rename_concepts(self, mapping: Dict[str, str]) -> ConceptMap:
+        """
+        Replace concept labels, merging the relationships of concepts renamed to the same label.
+        Relationships whose source and target become the same concept are dropped.
+
+        :param mapping: A mapping from the (normalized) old labels to the new labels, e.g. the result of `concept_clusters`.
+        :return: A new concept map.
+        """
+        renamed = ConceptMap(normalize=self.normalize)
+        for edge_id, (source, relationship, target) in enumerate(self):
+            source = mapping.get(self._key(source), source)
+            target = mapping.get(self._key(target), target)
+            if self._key(source) != self._key(target):
+                renamed.add(source, relationship, target, weight=self._weights[edge_id])
+        return renamed
+
+    def cluster_concepts(self, threshold: float = 0.65) -> ConceptMap:
+        """
+        Merge near-duplicate concepts, see `concept_clusters`.
+
+        :param threshold: The minimum cosine similarity of two concepts in the same cluster. Default: 0.65.
+        :return: A new concept map.
+        """
+        return self.rename_concepts(self.concept_clusters(threshold))
+
+    def to_compact(self) -> str:
+        """
+        Encode the concept map for a prompt without repeating labels: a numbered table of the concepts, followed by
+        one "source id|relationship|target id" line per relationship, from the heaviest to the lightest.
+
+        :return: The encoded concept map.
+        """
+        edge_ids = sorted(range(len(self)), key=lambda edge_id: -self._weights[edge_id])
+        return "\n".join([
+            "Concepts:",
+            *[f"{concept_id + 1} {concept}" for concept_id, concept in enumerate(self.concepts)],
+            "Relationships:",
+            *[
+                f"{self._sources[edge_id] + 1}|{self.relationships[self._relations[edge_id]]}|{self._targets[edge_id] + 1}"
+                for edge_id in edge_ids
+            ],
+        ])
+
+    def to_triples(self) -> List[List[str]]:
+        """
+        Export the concept map as a list of [source, relationship, target] lists, the format the prompts use.
+
+        :return: The relationships.
+        """
+        return [list(edge) for edge in self]
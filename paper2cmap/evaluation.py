@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import re
+from typing import Dict, List
+
+from paper2cmap.clustering import vectorize_labels
+from paper2cmap.concept_map import ConceptMap
+
+_WORDS = re.compile(r"[a-z][a-z0-9]{2,}")
+
+
+def _words(text: str) -> List[str]:
+    # crude plural folding, so that "networks" is grounded by "network"
+    return [word[:-1] if word.endswith("s") and len(word) > 3 else word for word in _WORDS.findall(text.lower())]
+
+
+def concept_grounding(cmap: List | ConceptMap, text: str) -> float:
+    """
+    Measure how much of a concept map is grounded in the source text: the share of its concepts
+    with at least half of their words found in the text. Hallucinated concepts lower the score.
+
+    :param cmap: The concept map.
+    :param text: The source text, e.g. the full text of the paper.
+    :return: The share of grounded concepts, 1.0 for an empty concept map.
+    """
+    cmap = cmap if isinstance(cmap, ConceptMap) else ConceptMap.from_triples(cmap)
+    vocabulary = set(_words(text))
+    grounded = 0
+    for concept in cmap.concepts:
+        words = _words(concept)
+        if not words or sum(word in vocabulary for word in words) * 2 >= len(words):
+            grounded += 1
+    return grounded / len(cmap.concepts) if cmap.concepts else 1.0
+
+
+def compare_cmaps(reference: List | ConceptMap, candidate: List | ConceptMap, threshold: float = 0.65) -> Dict[str, float]:
+    """
+    Compare two concept maps of the same text, e.g. generated with two different settings. Concepts are matched
+    across the maps by character n-gram similarity, so rephrased labels still match, and two relationships match
+    when they link matched concepts, in either direction and whatever their labels.
+
+    :param reference: The reference concept map.
+    :param candidate: The candidate concept map.
+    :param threshold: The minimum cosine similarity of two matching concepts, see `clustering.cluster_labels`. Default: 0.65.
+    :return: The precision, recall and F1 of the candidate concepts and relationships against the reference.
+    """
+    reference = reference if isinstance(reference, ConceptMap) else ConceptMap.from_triples(reference)
+    candidate = candidate if isinstance(candidate, ConceptMap) else ConceptMap.from_triples(candidate)
+
+    # candidate concept id -> id of the most similar reference concept, if similar enough
+    mapping: Dict[int, int] = {}
+    if reference.concepts and candidate.concepts:
+        vectors = vectorize_labels(reference.concepts + candidate.concepts)
+        similarities = vectors[len(reference.concepts):] @ vectors[:len(reference.concepts)].T
+        best = similarities.argmax(axis=1)
+        mapping = {
+            concept_id: int(best[concept_id])
+            for concept_id in range(len(candidate.concepts))
+            if similarities[concept_id, best[concept_id]] >= threshold
+        }
+
+    reference_links = {frozenset(link) for link in zip(reference._sources, reference._targets)}
+    candidate_links = {
+        frozenset((mapping.get(source, -1 - source), mapping.get(target, -1 - target)))
+        for source, target in zip(candidate._sources, candidate._targets)
+    }
+
+    def _scores(num_matched_candidates: int, num_matched_references: int, num_candidates: int, num_references: int) -> Dict[str, float]:
+        precision = num_matched_candidates / num_candidates if num_candidates else 1.0
+        recall = num_matched_references / num_references if num_references else 1.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        return {"precision": precision, "recall": recall, "f1": f1}
+
+    concepts = _scores(len(mapping), len(set(mapping.values())), len(candidate.concepts), len(reference.concepts))
+    matched_links = len(reference_links & candidate_links)
+    links = _scores(matched_links, matched_links, len(candidate_links), len(reference_links))
+    return {
+        **{f"concept_{key}": value for key, value in concepts.items()},
+        **{f"relationship_{key}": value for key, value in links.items()},
+    }
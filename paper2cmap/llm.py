@@ -1,8 +1,20 @@
+from __future__ import annotations
+
+import asyncio
+import json
 import os
+import threading
+import time
+import weakref
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Tuple
 
-from langchain.chat_models import AzureChatOpenAI, ChatOpenAI
+from paper2cmap import logger, metrics, RateLimiter, LLMCache, LatencyPolicy
+from paper2cmap.policy import THROTTLED_ERRORS, TRANSIENT_ERRORS
+from paper2cmap.utils import estimate_messages_tokens, estimate_tokens
 
-from paper2cmap import logger
+if TYPE_CHECKING:
+    from langchain.chat_models import AzureChatOpenAI, ChatOpenAI
+    from langchain.schema import BaseMessage, LLMResult
 
 
 class LLMManager():
@@ -10,6 +22,7 @@ class LLMManager():
                  model_name: str = "",
                  deployment_name: str = "",
                  deployment_version: str = "",
+                 endpoints: List[Dict] | None = None,
                  **kwargs
                  ) -> None:
         """
@@ -18,15 +31,12 @@ class LLMManager():
         :param model_name: The OpenAI model name. If not provided, it will be read from the environment variable OPENAI_MODEL_NAME.
         :param deployment_name: The Azure deployment name. If not provided, it will be read from the environment variable OPENAI_MODEL_NAME.
         :param deployment_version: The Azure deployment version. If not provided, it will be read from the environment variable OPENAI_MODEL_VERSION.
+        :param endpoints: Several endpoints to balance the requests across, each a dict with "api_type", "api_key", and optionally
+                          "api_base", "model_name", "deployment_name", "deployment_version", "requests_per_minute" and "tokens_per_minute".
+                          Missing model and deployment fields default to the parameters above. If not provided, it will be read as a JSON
+                          list from the environment variable OPENAI_ENDPOINTS, and if that is not set either, a single endpoint is
+                          configured from the OPENAI_API_* environment variables. Default: None.
         """
-        # Required Env Vars
-        OPENAI_API_TYPE = os.environ["OPENAI_API_TYPE"]
-        OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
-
-        # Required for Azure
-        if OPENAI_API_TYPE == "azure":
-            OPENAI_API_BASE = os.environ["OPENAI_API_BASE"]
-
         # Optional Env Vars
         if model_name == "":
             model_name = os.environ.get("OPENAI_MODEL_NAME", "")
@@ -37,26 +47,534 @@ class LLMManager():
         if deployment_version == "":
             deployment_version = os.environ.get("OPENAI_MODEL_VERSION", "")
 
-        if OPENAI_API_TYPE == "azure":
-            logger.info(f"Using Azure deployment {deployment_name} (version {deployment_version})")
-            self._LLM = AzureChatOpenAI(
-                openai_api_type=OPENAI_API_TYPE,
-                openai_api_base=OPENAI_API_BASE,
-                openai_api_key=OPENAI_API_KEY,
+        if endpoints is None and os.environ.get("OPENAI_ENDPOINTS"):
+            endpoints = json.loads(os.environ["OPENAI_ENDPOINTS"])
+
+        if endpoints:
+            # the pool retries on another endpoint rather than waiting for a throttled one
+            max_retries = kwargs.pop("max_retries", 6)
+            chatbots, rate_limiters = [], []
+            for endpoint in endpoints:
+                endpoint = {
+                    "model_name": model_name,
+                    "deployment_name": deployment_name,
+                    "deployment_version": deployment_version,
+                    **endpoint,
+                }
+                requests_per_minute = endpoint.pop("requests_per_minute", None)
+                tokens_per_minute = endpoint.pop("tokens_per_minute", None)
+                chatbots.append(self._build_chat_model(**endpoint, max_retries=1, **kwargs))
+                rate_limiters.append(
+                    RateLimiter(requests_per_minute, tokens_per_minute)
+                    if requests_per_minute is not None or tokens_per_minute is not None else None
+                )
+            logger.info("Using a pool of %s endpoints", len(chatbots))
+            self._LLM = EndpointPool(chatbots, rate_limiters=rate_limiters, max_retries=max_retries)
+            return
+
+        # Required Env Vars
+        OPENAI_API_TYPE = os.environ["OPENAI_API_TYPE"]
+        OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
+
+        # Required for Azure
+        OPENAI_API_BASE = os.environ["OPENAI_API_BASE"] if OPENAI_API_TYPE == "azure" else None
+
+        self._LLM = self._build_chat_model(
+            api_type=OPENAI_API_TYPE,
+            api_key=OPENAI_API_KEY,
+            api_base=OPENAI_API_BASE,
+            model_name=model_name,
+            deployment_name=deployment_name,
+            deployment_version=deployment_version,
+            **kwargs
+        )
+
+    @staticmethod
+    def _build_chat_model(api_type: str, api_key: str, api_base: str | None = None,
+                          model_name: str = "", deployment_name: str = "", deployment_version: str = "",
+                          **kwargs) -> ChatOpenAI | AzureChatOpenAI:
+        # langchain and openai take most of the import time of the package, so they are only imported with the first model
+        from langchain.chat_models import AzureChatOpenAI, ChatOpenAI
+
+        if api_type == "azure":
+            logger.info("Using Azure deployment %s (version %s)", deployment_name, deployment_version)
+            return AzureChatOpenAI(
+                openai_api_type=api_type,
+                openai_api_base=api_base,
+                openai_api_key=api_key,
                 deployment_name=deployment_name,
                 openai_api_version=deployment_version,
                 **kwargs
             )
-        elif OPENAI_API_TYPE == "openai":
-            logger.info(f"Using OpenAI model {model_name}")
-            self._LLM = ChatOpenAI(
-                openai_api_key=OPENAI_API_KEY,
+        elif api_type == "openai":
+            logger.info("Using OpenAI model %s", model_name)
+            if api_base:
+                kwargs["openai_api_base"] = api_base
+            return ChatOpenAI(
+                openai_api_key=api_key,
                 model_name=model_name,
                 **kwargs
             )
         else:
-            raise ValueError(f"OPENAI_API_TYPE must be either 'azure' or 'openai', but got {OPENAI_API_TYPE}")
+            raise ValueError(f"OPENAI_API_TYPE must be either 'azure' or 'openai', but got {api_type}")
+
+    @property
+    def LLM(self) -> ChatOpenAI | AzureChatOpenAI | EndpointPool:
+        return self._LLM
+
+
+class _Endpoint():
+    def __init__(self, name: str, chatbot: ChatOpenAI | AzureChatOpenAI, rate_limiter: RateLimiter | None) -> None:
+        self.name = name
+        self.chatbot = chatbot
+        self.rate_limiter = rate_limiter
+
+        self.in_flight = 0
+        self.latency: float | None = None
+        self.throttled_until = 0.0
+        self.num_requests = 0
+        self.num_errors = 0
+
+
+class EndpointPool():
+    def __init__(self,
+                 chatbots: List[ChatOpenAI | AzureChatOpenAI],
+                 rate_limiters: List[RateLimiter | None] | None = None,
+                 max_retries: int = 6,
+                 cooldown: float = 10.0,
+                 latency_decay: float = 0.2,
+                 ) -> None:
+        """
+        Balance chat completions across several endpoints (keys, regions or deployments) of the same model.
+        Every request goes to the endpoint with the lowest expected wait, i.e. its number of in-flight requests times
+        its average latency, among the endpoints that are not throttled and whose own rate limit has room for it.
+        A throttled endpoint is skipped until its Retry-After delay or {cooldown} has passed, and failed requests
+        are retried on another endpoint.
+
+        :param chatbots: The chat models of the endpoints.
+        :param rate_limiters: The rate limiter of every endpoint, or None for the endpoints without a limit. Default: None.
+        :param max_retries: The maximum number of attempts of a request across all endpoints. Default: 6.
+        :param cooldown: The number of seconds a throttled endpoint is skipped when it does not send Retry-After. Default: 10.0.
+        :param latency_decay: The weight of the latest latency in the moving average of every endpoint. Default: 0.2.
+        """
+        if not chatbots:
+            raise ValueError("EndpointPool needs at least one endpoint")
+
+        rate_limiters = rate_limiters or [None] * len(chatbots)
+        self.endpoints = [
+            _Endpoint(self._endpoint_name(chatbot, i), chatbot, rate_limiter)
+            for i, (chatbot, rate_limiter) in enumerate(zip(chatbots, rate_limiters))
+        ]
+        self.max_retries = max_retries
+        self.cooldown = cooldown
+        self.latency_decay = latency_decay
+
+        self._lock = threading.Lock()
+        self._next = 0
+        # aiohttp sessions are bound to their event loop
+        self._aiosessions: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def _endpoint_name(chatbot: ChatOpenAI | AzureChatOpenAI, index: int) -> str:
+        model = getattr(chatbot, "deployment_name", None) or getattr(chatbot, "model_name", "")
+        base = getattr(chatbot, "openai_api_base", None) or "default"
+        return f"{index}:{model}@{base}"
+
+    # the pool stands for one model, so the cache key and the token estimate do not depend on the endpoint serving a request
+    @property
+    def model_name(self) -> str:
+        return getattr(self.endpoints[0].chatbot, "model_name", "")
+
+    @property
+    def deployment_name(self) -> str:
+        return getattr(self.endpoints[0].chatbot, "deployment_name", "")
+
+    @property
+    def temperature(self) -> float | None:
+        return getattr(self.endpoints[0].chatbot, "temperature", None)
 
     @property
-    def LLM(self) -> ChatOpenAI:
-        return self._LLM
\ No newline at end of file
+    def max_tokens(self) -> int | None:
+        return getattr(self.endpoints[0].chatbot, "max_tokens", None)
+
+    def _select(self, tokens: int) -> Tuple[_Endpoint | None, float]:
+        """
+        Pick the endpoint of the next request and count it as in flight.
+
+        :return: The endpoint, or None and how long to wait if every endpoint is throttled or out of budget.
+        """
+        with self._lock:
+            now = time.monotonic()
+            known = [endpoint.latency for endpoint in self.endpoints if endpoint.latency is not None]
+            default_latency = min(known) if known else 1.0
+
+            # rotate the starting point so that endpoints with the same score share the load
+            order = self.endpoints[self._next:] + self.endpoints[:self._next]
+            self._next = (self._next + 1) % len(self.endpoints)
+            order.sort(key=lambda endpoint: (endpoint.in_flight + 1) * (endpoint.latency or default_latency))
+
+            wait = float("inf")
+            for endpoint in order:
+                if endpoint.throttled_until > now:
+                    wait = min(wait, endpoint.throttled_until - now)
+                    continue
+                if endpoint.rate_limiter is not None:
+                    acquired, limiter_wait = endpoint.rate_limiter.try_acquire(tokens)
+                    if not acquired:
+                        wait = min(wait, limiter_wait)
+                        continue
+                endpoint.in_flight += 1
+                endpoint.num_requests += 1
+                return endpoint, 0.0
+            return None, wait
+
+    def _release(self, endpoint: _Endpoint, elapsed: float, error: Exception | None = None) -> bool:
+        """
+        Record the outcome of a request.
+
+        :return: Whether the request can be retried on another endpoint.
+        """
+        with self._lock:
+            endpoint.in_flight -= 1
+            if error is None or type(error).__name__ in TRANSIENT_ERRORS:
+                # failed requests count with their elapsed time, so a slow or failing endpoint gets fewer requests
+                endpoint.latency = elapsed if endpoint.latency is None else \
+                    (1 - self.latency_decay) * endpoint.latency + self.latency_decay * elapsed
+            if error is None:
+                return False
+
+            endpoint.num_errors += 1
+            if type(error).__name__ in THROTTLED_ERRORS:
+                headers = getattr(error, "headers", None) or {}
+                try:
+                    cooldown = float(headers.get("retry-after", self.cooldown))
+                except (TypeError, ValueError):
+                    cooldown = self.cooldown
+                endpoint.throttled_until = time.monotonic() + cooldown
+                logger.warning("[EndpointPool] %s is throttled for %.1fs", endpoint.name, cooldown)
+                metrics.increment("llm_throttled", endpoint=endpoint.name)
+                return True
+            return type(error).__name__ in TRANSIENT_ERRORS
+
+    def generate(self, messages: List[List[BaseMessage]], **kwargs) -> LLMResult:
+        """
+        Same as `BaseChatModel.generate`, served by the best available endpoint.
+        """
+        tokens = sum(estimate_messages_tokens(message_list) for message_list in messages) + (self.max_tokens or 0)
+        for attempt in range(1, self.max_retries + 1):
+            endpoint, wait = self._select(tokens)
+            while endpoint is None:
+                time.sleep(wait)
+                endpoint, wait = self._select(tokens)
+
+            start = time.monotonic()
+            try:
+                result = endpoint.chatbot.generate(messages, **kwargs)
+            except Exception as e:
+                if not self._release(endpoint, time.monotonic() - start, e) or attempt == self.max_retries:
+                    raise
+                logger.warning("[EndpointPool] Attempt %s on %s failed: %r", attempt, endpoint.name, e)
+                metrics.increment("llm_retries", endpoint=endpoint.name)
+                continue
+            self._release(endpoint, time.monotonic() - start)
+            return result
+
+    def _aiosession(self):
+        # the 0.x openai package opens a new HTTP session per async request unless one is provided
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        session = self._aiosessions.get(loop)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession()
+            self._aiosessions[loop] = session
+        return session
+
+    async def agenerate(self, messages: List[List[BaseMessage]], **kwargs) -> LLMResult:
+        """
+        Asynchronous version of `generate`. Requests sent from the same event loop reuse their HTTP connections.
+        """
+        import openai
+
+        aiosession = getattr(openai, "aiosession", None)
+        context_token = aiosession.set(self._aiosession()) if aiosession is not None else None
+        try:
+            tokens = sum(estimate_messages_tokens(message_list) for message_list in messages) + (self.max_tokens or 0)
+            for attempt in range(1, self.max_retries + 1):
+                endpoint, wait = self._select(tokens)
+                while endpoint is None:
+                    await asyncio.sleep(wait)
+                    endpoint, wait = self._select(tokens)
+
+                start = time.monotonic()
+                try:
+                    result = await endpoint.chatbot.agenerate(messages, **kwargs)
+                except asyncio.CancelledError:
+                    self._release(endpoint, time.monotonic() - start)
+                    raise
+                except Exception as e:
+                    if not self._release(endpoint, time.monotonic() - start, e) or attempt == self.max_retries:
+                        raise
+                    logger.warning("[EndpointPool] Attempt %s on %s failed: %r", attempt, endpoint.name, e)
+                    metrics.increment("llm_retries", endpoint=endpoint.name)
+                    continue
+                self._release(endpoint, time.monotonic() - start)
+                return result
+        finally:
+            if context_token is not None:
+                aiosession.reset(context_token)
+
+    async def aclose(self) -> None:
+        """
+        Close the HTTP session of the running event loop.
+        """
+        session = self._aiosessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    def __call__(self, messages: List[BaseMessage], **kwargs) -> BaseMessage:
+        return self.generate([messages], **kwargs).generations[0][0].message
+
+    def stats(self) -> List[Dict]:
+        """
+        :return: The number of requests and errors, the in-flight requests and the average latency of every endpoint.
+        """
+        with self._lock:
+            return [
+                {
+                    "name": endpoint.name,
+                    "requests": endpoint.num_requests,
+                    "errors": endpoint.num_errors,
+                    "in_flight": endpoint.in_flight,
+                    "latency": endpoint.latency,
+                    "throttled": endpoint.throttled_until > time.monotonic(),
+                }
+                for endpoint in self.endpoints
+            ]
+
+
+class ChatClient():
+    def __init__(self, chatbot: ChatOpenAI | AzureChatOpenAI | EndpointPool,
+                 rate_limiter: RateLimiter | None = None,
+                 cache: LLMCache | None = None,
+                 policy: LatencyPolicy | None = None) -> None:
+        """
+        The single entry point of all chat completions, shared by CMapGPT and PaperReader.
+
+        :param chatbot: The chat model, or a pool of endpoints.
+        :param rate_limiter: The rate limiter applied to every request. Default: None.
+        :param cache: The cache of chat completions. Cached requests skip both the rate limiter and the chat model. Default: None.
+        :param policy: The hedging, timeout and circuit breaking policy applied to every request. Default: None.
+        """
+        self.chatbot = chatbot
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.policy = policy
+
+        # the calls and tokens per tag, e.g. "generate" or "merge_and_prune"
+        self.token_usage: Dict[str, Dict[str, int]] = {}
+        self._usage_lock = threading.Lock()
+
+    def _estimate_request_tokens(self, messages: List[BaseMessage]) -> int:
+        # the completion counts against the token budget as well
+        return estimate_messages_tokens(messages) + (getattr(self.chatbot, "max_tokens", None) or 0)
+
+    def _cache_key(self, messages: List[BaseMessage]) -> str:
+        return self.cache.make_key(
+            messages,
+            model_name=getattr(self.chatbot, "model_name", ""),
+            deployment_name=getattr(self.chatbot, "deployment_name", ""),
+            temperature=getattr(self.chatbot, "temperature", None),
+            max_tokens=getattr(self.chatbot, "max_tokens", None),
+        )
+
+    def _can_hedge(self, messages: List[BaseMessage]) -> bool:
+        # a hedge is only sent if the rate limit has room for it right now
+        return self.rate_limiter is None or self.rate_limiter.try_acquire(self._estimate_request_tokens(messages))[0]
+
+    def _record_usage(self, tag: str, messages: List[BaseMessage], response: str,
+                      result: LLMResult | None = None) -> None:
+        usage = (result.llm_output or {}).get("token_usage") if result is not None else None
+        with self._usage_lock:
+            stats = self.token_usage.setdefault(
+                tag, {"calls": 0, "cached_calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+            )
+            stats["calls"] += 1
+            if result is None:
+                stats["cached_calls"] += 1
+            else:
+                # not every backend reports its usage, e.g. some proxies
+                prompt_tokens = usage.get("prompt_tokens", 0) if usage else estimate_messages_tokens(messages)
+                completion_tokens = usage.get("completion_tokens", 0) if usage else estimate_tokens(response)
+                stats["prompt_tokens"] += prompt_tokens
+                stats["completion_tokens"] += completion_tokens
+
+        metrics.increment("llm_calls", tag=tag)
+        if result is None:
+            metrics.increment("llm_cache_hits", tag=tag)
+            return
+        metrics.increment("llm_prompt_tokens", prompt_tokens, tag=tag)
+        metrics.increment("llm_completion_tokens", completion_tokens, tag=tag)
+        logger.debug("[ChatClient] %s: %s prompt tokens, %s completion tokens%s",
+                     tag, prompt_tokens, completion_tokens, "" if usage else " (estimated)")
+
+    def _acquire(self, messages: List[BaseMessage]) -> None:
+        start = time.perf_counter()
+        self.rate_limiter.acquire(self._estimate_request_tokens(messages))
+        metrics.increment("rate_limit_wait_seconds", time.perf_counter() - start)
+
+    async def _aacquire(self, messages: List[BaseMessage]) -> None:
+        start = time.perf_counter()
+        await self.rate_limiter.aacquire(self._estimate_request_tokens(messages))
+        metrics.increment("rate_limit_wait_seconds", time.perf_counter() - start)
+
+    def chat(self, messages: List[BaseMessage], tag: str = "chat", parse: Callable[[str], Any] | None = None) -> Any:
+        """
+        Send the messages to the chat model and return the content of its reply.
+
+        :param messages: The chat messages.
+        :param tag: The name the tokens of the call are counted under in `token_usage`. Default: "chat".
+        :param parse: The parser of the reply. If given, the reply is only cached once it is parsed, and a reply it
+                      rejects with ValueError is not cached, so that the next try calls the model again. Default: None.
+        :return: The content of the reply, or the result of {parse} on it.
+        :raises ValueError: If {parse} rejects the reply.
+        """
+        if self.cache is not None:
+            key = self._cache_key(messages)
+            response = self.cache.get(key)
+            if response is not None:
+                try:
+                    parsed = parse(response) if parse is not None else response
+                except ValueError:
+                    # cached before it was checked, it is replaced by a new reply
+                    logger.warning("[ChatClient] Ignoring an unusable cached reply: %s", key)
+                else:
+                    logger.debug("[ChatClient] Cache hit: %s", key)
+                    self._record_usage(tag, messages, response)
+                    return parsed
+
+        if self.rate_limiter is not None:
+            self._acquire(messages)
+        with metrics.span("llm", tag=tag):
+            if self.policy is not None:
+                result = self.policy.run(lambda: self.chatbot.generate([messages]), lambda: self._can_hedge(messages))
+            else:
+                result = self.chatbot.generate([messages])
+        response = result.generations[0][0].message.content
+        self._record_usage(tag, messages, response, result)
+
+        parsed = parse(response) if parse is not None else response
+        if self.cache is not None:
+            self.cache.set(key, response)
+        return parsed
+
+    async def achat(self, messages: List[BaseMessage], tag: str = "chat", parse: Callable[[str], Any] | None = None) -> Any:
+        """
+        Asynchronously send the messages to the chat model and return the content of its reply.
+
+        :param messages: The chat messages.
+        :param tag: The name the tokens of the call are counted under in `token_usage`. Default: "chat".
+        :param parse: The parser of the reply. If given, the reply is only cached once it is parsed, and a reply it
+                      rejects with ValueError is not cached, so that the next try calls the model again. Default: None.
+        :return: The content of the reply, or the result of {parse} on it.
+        :raises ValueError: If {parse} rejects the reply.
+        """
+        if self.cache is not None:
+            key = self._cache_key(messages)
+            response = self.cache.get(key)
+            if response is not None:
+                try:
+                    parsed = parse(response) if parse is not None else response
+                except ValueError:
+                    # cached before it was checked, it is replaced by a new reply
+                    logger.warning("[ChatClient] Ignoring an unusable cached reply: %s", key)
+                else:
+                    logger.debug("[ChatClient] Cache hit: %s", key)
+                    self._record_usage(tag, messages, response)
+                    return parsed
+
+        if self.rate_limiter is not None:
+            await self._aacquire(messages)
+        with metrics.span("llm", tag=tag):
+            if self.policy is not None:
+                result = await self.policy.arun(lambda: self.chatbot.agenerate([messages]), lambda: self._can_hedge(messages))
+            else:
+                result = await self.chatbot.agenerate([messages])
+        response = result.generations[0][0].message.content
+        self._record_usage(tag, messages, response, result)
+
+        parsed = parse(response) if parse is not None else response
+        if self.cache is not None:
+            self.cache.set(key, response)
+        return parsed
+
+    def usage(self) -> Dict[str, int]:
+        """
+        :return: The total number of calls, cached calls, prompt tokens and completion tokens over all tags.
+        """
+        with self._usage_lock:
+            return {
+                key: sum(stats[key] for stats in self.token_usage.values())
+                for key in ("calls", "cached_calls", "prompt_tokens", "completion_tokens")
+            }
+
+
+def build_chat_client(chatbot: ChatOpenAI | AzureChatOpenAI | EndpointPool | None = None,
+                      model_name: str = "",
+                      deployment_name: str = "",
+                      deployment_version: str = "",
+                      temperature: float = 0.7,
+                      request_timeout: int = 60,
+                      max_retries: int = 6,
+                      max_tokens: int | None = None,
+                      endpoints: List[Dict] | None = None,
+                      requests_per_minute: int | None = None,
+                      tokens_per_minute: int | None = None,
+                      cache_dir: str | None = None,
+                      cache_max_size: int | None = None,
+                      cache_ttl: float | None = None,
+                      hedge_percentile: float | None = None,
+                      adaptive_timeout: bool = False,
+                      circuit_breaker_threshold: int | None = None,
+                      verbose: bool = False,
+                      ) -> ChatClient:
+    """
+    Build a ChatClient with its model, rate limiter, cache and latency policy, see `Paper2CMap` for the parameters.
+
+    :param chatbot: An existing chat model. If None, the model is configured by `LLMManager`. Default: None.
+    :return: The chat client.
+    """
+    if chatbot is None:
+        chatbot = LLMManager(
+            model_name=model_name,
+            deployment_name=deployment_name,
+            deployment_version=deployment_version,
+            temperature=temperature,
+            request_timeout=request_timeout,
+            max_retries=max_retries,
+            max_tokens=max_tokens,
+            endpoints=endpoints,
+            verbose=verbose,
+        ).LLM
+
+    rate_limiter = None
+    if requests_per_minute is not None or tokens_per_minute is not None:
+        rate_limiter = RateLimiter(
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+        )
+    cache = None
+    if cache_dir is not None:
+        cache = LLMCache(cache_dir, max_size=cache_max_size, ttl=cache_ttl)
+    policy = None
+    if hedge_percentile is not None or adaptive_timeout or circuit_breaker_threshold is not None:
+        policy = LatencyPolicy(
+            hedge_percentile=hedge_percentile,
+            timeout_percentile=0.99 if adaptive_timeout else None,
+            min_timeout=min(10.0, request_timeout),
+            # without adaptive timeouts, the retries of the model decide when to give up
+            max_timeout=float(request_timeout) if adaptive_timeout else float(request_timeout * max_retries),
+            max_attempts=2 if adaptive_timeout else 1,
+            failure_threshold=circuit_breaker_threshold,
+        )
+    return ChatClient(chatbot, rate_limiter=rate_limiter, cache=cache, policy=policy)
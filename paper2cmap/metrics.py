@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from paper2cmap import logger
+
+# the innermost span of the current thread or asyncio task
+_current_span: contextvars.ContextVar = contextvars.ContextVar("paper2cmap_span", default=None)
+
+
+class Metrics():
+    def __init__(self) -> None:
+        """
+        A registry of spans and counters.
+        - Spans time a stage, e.g. "parse", "catelogue", "split", "section", "preprocess", "generate", "fuse" or "merge".
+          A span also sums the counters incremented while it is open, including by its child spans, so e.g. a
+          "section" span reports the tokens, cache hits and retries of its own LLM calls.
+        - Counters count events by name and labels, e.g. "llm_prompt_tokens" with {"tag": "generate"}.
+
+        Every finished span and counter increment is passed to the callbacks, see `add_callback`,
+        and the totals can be exported with `to_json` or `to_prometheus`.
+        """
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._spans: Dict[str, Dict[str, float]] = {}
+        self._callbacks: List[Callable[[Dict], None]] = []
+
+    def add_callback(self, callback: Callable[[Dict], None]) -> None:
+        """
+        Register a hook called with every event:
+        - {"type": "span", "name", "start", "duration", "status", "parent", "attributes", "counters"} when a span ends,
+          where "status" is "ok" or "error", and "parent" is the name of the enclosing span or None.
+        - {"type": "counter", "name", "value", "labels"} when a counter is incremented.
+        Callbacks run synchronously in the thread of the event, so they should be quick.
+
+        :param callback: The callback.
+        """
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def remove_callback(self, callback: Callable[[Dict], None]) -> None:
+        """
+        Unregister a hook registered with `add_callback`.
+
+        :param callback: The callback.
+        """
+        with self._lock:
+            self._callbacks.remove(callback)
+
+    def _emit(self, event: Dict) -> None:
+        for callback in list(self._callbacks):
+            try:
+                callback(event)
+            except Exception as e:
+                # a broken hook must not break the job it observes
+                logger.warning("[Metrics] Callback %r failed: %r", callback, e)
+
+    def increment(self, name: str, value: float = 1, **labels: Any) -> None:
+        """
+        Increment a counter, and the counters of all open spans of the current thread or asyncio task.
+
+        :param name: The name of the counter.
+        :param value: The increment. Default: 1.
+        :param labels: The labels of the counter, e.g. tag="generate".
+        """
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        record = _current_span.get()
+        while record is not None:
+            record["counters"][name] = record["counters"].get(name, 0) + value
+            record = record["_parent"]
+        if self._callbacks:
+            self._emit({"type": "counter", "name": name, "value": value, "labels": labels})
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Dict]:
+        """
+        Time a stage. Spans nest within a thread or an asyncio task, and must be closed in the order they were opened.
+
+        :param name: The name of the span.
+        :param attributes: The attributes of the span, e.g. index=3 for a section.
+        :return: A context manager yielding the span record, whose "attributes" can still be updated by the stage.
+        """
+        parent = _current_span.get()
+        record = {"name": name, "attributes": attributes, "counters": {}, "_parent": parent}
+        token = _current_span.set(record)
+        start_time, start = time.time(), time.perf_counter()
+        status = "ok"
+        try:
+            yield record
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            _current_span.reset(token)
+            with self._lock:
+                stats = self._spans.setdefault(name, {"count": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+                stats["count"] += 1
+                stats["errors"] += status == "error"
+                stats["total_seconds"] += duration
+                stats["max_seconds"] = max(stats["max_seconds"], duration)
+            if self._callbacks:
+                self._emit({
+                    "type": "span",
+                    "name": name,
+                    "start": start_time,
+                    "duration": duration,
+                    "status": status,
+                    "parent": parent["name"] if parent is not None else None,
+                    "attributes": attributes,
+                    "counters": record["counters"],
+                })
+
+    def counter(self, name: str, **labels: Any) -> float:
+        """
+        :param name: The name of the counter.
+        :param labels: If given, only the counters with these labels are summed.
+        :return: The total of the counter over all its labels matching {labels}.
+        """
+        wanted = {(label, str(label_value)) for label, label_value in labels.items()}
+        with self._lock:
+            return sum(
+                value for (counter_name, counter_labels), value in self._counters.items()
+                if counter_name == name and wanted <= set(counter_labels)
+            )
+
+    def cost(self, prompt_price: float, completion_price: float) -> float:
+        """
+        Estimate the cost of the LLM calls made so far.
+
+        :param prompt_price: The price of 1000 prompt tokens.
+        :param completion_price: The price of 1000 completion tokens.
+        :return: The cost, in the currency of the prices.
+        """
+        return (self.counter("llm_prompt_tokens") * prompt_price + self.counter("llm_completion_tokens") * completion_price) / 1000
+
+    def snapshot(self) -> Dict:
+        """
+        :return: The counters, as {"name", "labels", "value"} dicts, and the count, errors, total and max seconds of the spans by name.
+        """
+        with self._lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self._counters.items())
+                ],
+                "spans": {name: dict(stats) for name, stats in self._spans.items()},
+            }
+
+    def to_json(self) -> str:
+        """
+        :return: The snapshot as a JSON string.
+        """
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self, prefix: str = "paper2cmap") -> str:
+        """
+        Render the snapshot in the Prometheus text exposition format, e.g. to be served by a metrics endpoint
+        or written for the node exporter's textfile collector.
+
+        :param prefix: The prefix of the metric names. Default: "paper2cmap".
+        :return: The metrics.
+        """
+        def _labels(labels: Dict[str, str]) -> str:
+            if not labels:
+                return ""
+            escaped = (value.replace("\\", "\\\\").replace('"', '\\"') for value in labels.values())
+            return "{" + ",".join(f'{label}="{value}"' for label, value in zip(labels, escaped)) + "}"
+
+        snapshot = self.snapshot()
+        lines = []
+        for name in dict.fromkeys(counter["name"] for counter in snapshot["counters"]):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            for counter in snapshot["counters"]:
+                if counter["name"] == name:
+                    lines.append(f"{prefix}_{name}_total{_labels(counter['labels'])} {counter['value']:g}")
+        if snapshot["spans"]:
+            lines.append(f"# TYPE {prefix}_span_seconds summary")
+            for name, stats in snapshot["spans"].items():
+                lines.append(f"{prefix}_span_seconds_sum{_labels({'span': name})} {stats['total_seconds']:.6f}")
+                lines.append(f"{prefix}_span_seconds_count{_labels({'span': name})} {stats['count']:g}")
+            lines.append(f"# TYPE {prefix}_span_errors_total counter")
+            for name, stats in snapshot["spans"].items():
+                lines.append(f"{prefix}_span_errors_total{_labels({'span': name})} {stats['errors']:g}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: str) -> None:
+        """
+        Write the snapshot to a file, in the Prometheus text format if the path ends with ".prom", and in JSON otherwise.
+
+        :param path: The path of the file.
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus() if path.endswith(".prom") else self.to_json())
+
+    def reset(self) -> None:
+        """
+        Clear all the counters and spans. The callbacks are kept.
+        """
+        with self._lock:
+            self._counters.clear()
+            self._spans.clear()
+
+
+# the registry shared by the whole package, like the logger
+metrics = Metrics()
@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+import json
+import re
+from typing import Any, List, Tuple
+
+from paper2cmap import logger, metrics
+
+_FENCE = re.compile(r"```[\w-]*[ \t]*\n?(.*?)(?:```|$)", re.DOTALL)
+_CLOSERS = {"[": "]", "{": "}"}
+_TRIPLE_KEYS = ("source", "relationship", "target")
+
+
+def strip_fences(text: str) -> str:
+    """
+    Take the content of the first markdown code block of a completion, if it has one.
+
+    :param text: The completion.
+    :return: The content of its first code block, or the completion itself.
+    """
+    if "```" not in text:
+        return text
+    match = _FENCE.search(text)
+    return match.group(1) if match else text
+
+
+def repair_json(text: str, openers: str = "[{") -> Tuple[str, bool]:
+    """
+    Repair the common defects of a JSON value written by a model: markdown fences, notes before or after the value,
+    trailing commas, and a truncated end. A truncated value is cut after its last complete element and closed.
+
+    :param text: The completion.
+    :param openers: The characters the value may start with, the text before the first of them is skipped. Default: "[{".
+    :return: The repaired JSON text, and whether the value was complete.
+    :raises ValueError: If the completion holds no JSON value.
+    """
+    text = strip_fences(text)
+    start = min((i for i in (text.find(opener) for opener in openers) if i >= 0), default=-1)
+    if start < 0:
+        raise ValueError(f"No JSON value in the output: {text[:200]!r}")
+
+    out: List[str] = []
+    stack: List[str] = []
+    # for each open bracket, the length of out after it and at its last comma, where a truncated value can be cut
+    opened: List[int] = []
+    commas: List[int | None] = []
+    in_string = escape = False
+    for c in text[start:]:
+        if in_string:
+            out.append(c)
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+            out.append(c)
+        elif c in _CLOSERS:
+            stack.append(c)
+            out.append(c)
+            opened.append(len(out))
+            commas.append(None)
+        elif c in "]}":
+            if not stack:
+                break
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            # a mismatched closer still closes the innermost bracket
+            out.append(_CLOSERS[stack.pop()])
+            opened.pop()
+            commas.pop()
+            if not stack:
+                return "".join(out), True
+        elif c == ",":
+            commas[-1] = len(out)
+            out.append(c)
+        else:
+            out.append(c)
+
+    # an unfinished element of a list is dropped whole, an unfinished value of an object is cut after its last comma
+    depth = len(stack)
+    while depth > 1 and stack[depth - 2] == "[":
+        depth -= 1
+    cut = commas[depth - 1] if commas[depth - 1] is not None else opened[depth - 1]
+    return "".join(out[:cut]) + "".join(_CLOSERS[opener] for opener in reversed(stack[:depth])), False
+
+
+def parse_json(text: str, openers: str = "[{") -> Tuple[Any, bool]:
+    """
+    Parse a JSON value written by a model, see `repair_json`.
+
+    :param text: The completion.
+    :param openers: The characters the value may start with. Default: "[{".
+    :return: The value, and whether it was complete.
+    :raises ValueError: If the completion holds no JSON value, or it cannot be repaired.
+    """
+    repaired, complete = repair_json(text, openers)
+    if repaired != text.strip():
+        metrics.increment("output_repairs", kind="complete" if complete else "truncated")
+        logger.debug("[OutputParser] Repaired output: %s", repaired)
+    return json.loads(repaired), complete
+
+
+def normalize_triple(triple: Any) -> List[str] | None:
+    """
+    :param triple: A relationship, a [source, relationship, target] list or a {"source", "relationship", "target"} dict.
+    :return: The [source, relationship, target] list of non-empty labels, or None if {triple} is malformed.
+    """
+    if isinstance(triple, dict):
+        triple = [triple.get(key) for key in _TRIPLE_KEYS]
+    if not isinstance(triple, (list, tuple)) or len(triple) != 3:
+        return None
+    labels = [str(label).strip() for label in triple if isinstance(label, (str, int, float))]
+    if len(labels) != 3 or not all(labels):
+        return None
+    return labels
+
+
+def normalize_triples(cmap: Any) -> List[List[str]]:
+    """
+    Normalize a concept map written by a model to [source, relationship, target] lists. Malformed relationships
+    are skipped.
+
+    :param cmap: A list of relationships, or a dict holding it under "cmap".
+    :return: The relationships.
+    """
+    if isinstance(cmap, dict):
+        cmap = cmap.get("cmap", [])
+    if not isinstance(cmap, list):
+        logger.warning("[OutputParser] Expected a list of relationships, got: %s", cmap)
+        return []
+    triples = []
+    for triple in cmap:
+        normalized = normalize_triple(triple)
+        if normalized is None:
+            metrics.increment("output_repairs", kind="malformed")
+            logger.warning("[OutputParser] Skipped malformed relationship: %s", triple)
+        else:
+            triples.append(normalized)
+    return triples
+
+
+class TripleParser():
+    def __init__(self) -> None:
+        """
+        An incremental parser of a [[source, relationship, target]] list written by a model. Feed it the
+        completion, as a whole or chunk by chunk as it is streamed, and it returns each relationship as soon as it is
+        complete. Markdown fences and notes around the list are skipped, a malformed relationship is dropped alone,
+        and a truncated list keeps every relationship before the cut.
+        """
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._element_start = -1
+
+        # whether the list was opened / closed
+        self.started = False
+        self.complete = False
+        self.num_malformed = 0
+
+    def _parse_element(self, text: str) -> List[str] | None:
+        try:
+            element, _ = parse_json(text)
+        except ValueError:
+            element = None
+        triple = normalize_triple(element)
+        if triple is None:
+            self.num_malformed += 1
+            metrics.increment("output_repairs", kind="malformed")
+            logger.warning("[OutputParser] Skipped malformed relationship: %s", text)
+        return triple
+
+    def feed(self, chunk: str) -> List[List[str]]:
+        """
+        :param chunk: The next part of the completion.
+        :return: The relationships completed by {chunk}.
+        """
+        if self.complete:
+            return []
+        self._buffer += chunk
+        triples = []
+        buffer = self._buffer
+        while self._pos < len(buffer):
+            c = buffer[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif not self.started:
+                # notes and fences before the list
+                if c == "[":
+                    self.started = True
+                    self._depth = 1
+            elif c == '"':
+                self._in_string = True
+            elif c in "[{":
+                self._depth += 1
+                if self._depth == 2:
+                    self._element_start = self._pos
+            elif c in "]}":
+                self._depth -= 1
+                if self._depth == 1 and self._element_start >= 0:
+                    triple = self._parse_element(buffer[self._element_start:self._pos + 1])
+                    if triple is not None:
+                        triples.append(triple)
+                    self._element_start = -1
+                elif self._depth == 0:
+                    self.complete = True
+                    self._pos += 1
+                    break
+            self._pos += 1
+
+        # the parsed relationships are not needed anymore
+        keep = self._element_start if self._element_start >= 0 else self._pos
+        self._buffer = buffer[keep:]
+        self._pos -= keep
+        if self._element_start >= 0:
+            self._element_start = 0
+        return triples
+
+
+def parse_triples(text: str) -> Tuple[List[List[str]], bool]:
+    """
+    Parse a [[source, relationship, target]] list written by a model, see `TripleParser`. Relationships written as
+    {"source", "relationship", "target"} dicts are converted.
+
+    :param text: The completion.
+    :return: The relationships, and whether the list was complete.
+    :raises ValueError: If the completion holds no list.
+    """
+    parser = TripleParser()
+    triples = parser.feed(text)
+    if not parser.started:
+        raise ValueError(f"No concept map in the output: {text[:200]!r}")
+    if not parser.complete:
+        metrics.increment("output_repairs", kind="truncated")
+        logger.warning("[OutputParser] Truncated concept map, kept its first %s relationships", len(triples))
+    return triples, parser.complete
+
+
+def parse_fused(text: str) -> Tuple[List[List[str]], str | None, bool]:
+    """
+    Parse the {"summary", "cmap"} output of a fused generation, or a concept map alone.
+
+    :param text: The completion.
+    :return: The relationships, the summary or None, and whether the output was complete.
+    :raises ValueError: If the completion holds no concept map.
+    """
+    result, complete = parse_json(text)
+    # the model may leave out the summary and answer with the concept map alone
+    cmap = result.get("cmap") if isinstance(result, dict) else result
+    if not isinstance(cmap, list):
+        if complete:
+            raise ValueError(f"No concept map in the output: {text[:200]!r}")
+        # cut off before the concept map
+        cmap = []
+    if not complete:
+        metrics.increment("output_repairs", kind="truncated")
+        logger.warning("[OutputParser] Truncated fused output, kept its first %s relationships", len(cmap))
+    summary = result.get("summary") if isinstance(result, dict) else None
+    return normalize_triples(cmap), summary if isinstance(summary, str) else None, complete
+
+
+def parse_titles(text: str) -> List[str]:
+    """
+    Parse the {"titles": [...]} catelogue written by a model. A bare list of titles is accepted too.
+
+    :param text: The completion.
+    :return: The titles.
+    :raises ValueError: If the completion holds no list of titles.
+    """
+    result, _ = parse_json(text)
+    titles: Any = result.get("titles") if isinstance(result, dict) else result
+    if not isinstance(titles, list):
+        raise ValueError(f"No titles in the output: {text[:200]!r}")
+    return [str(title).strip() for title in titles if isinstance(title, (str, int, float)) and str(title).strip()]
@@ -1,9 +1,22 @@
 from __future__ import annotations
 
-from typing import Dict, List
+import asyncio
+import contextvars
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterator, List, Sequence, Tuple
 import colorlog
 
-from paper2cmap import LLMManager, CMapGPT, PaperReader, logger
+from paper2cmap import ChatClient, ConceptMap, CMapGPT, PaperReader, SectionPlanner, logger, metrics
+from paper2cmap.llm import build_chat_client
+from paper2cmap.checkpoint import JobCheckpoint, hash_file
+from paper2cmap.concept_index import ConceptIndex
+from paper2cmap.chunker import chunk_sections, iter_chunks
+from paper2cmap.text_store import TextRanges, TextStore
+from paper2cmap.utils import estimate_messages_tokens, estimate_tokens
+
+if TYPE_CHECKING:
+    from langchain.chat_models import AzureChatOpenAI, ChatOpenAI
 
 
 class Paper2CMap():
@@ -15,6 +28,21 @@ class Paper2CMap():
                  request_timeout: int = 60,
                  max_retries: int = 6,
                  max_tokens: int | None = None,
+                 endpoints: List[Dict] | None = None,
+                 requests_per_minute: int | None = None,
+                 tokens_per_minute: int | None = None,
+                 cache_dir: str | None = None,
+                 cache_max_size: int | None = None,
+                 cache_ttl: float | None = None,
+                 hedge_percentile: float | None = None,
+                 adaptive_timeout: bool = False,
+                 circuit_breaker_threshold: int | None = None,
+                 compact_prompts: bool = False,
+                 checkpoint_dir: str | None = None,
+                 catelogue_mode: str = "auto",
+                 low_memory: bool = False,
+                 spill_dir: str | None = None,
+                 chatbot: ChatOpenAI | AzureChatOpenAI | ChatClient | None = None,
                  verbose: bool = False,
                  ) -> None:
         """
@@ -27,82 +55,576 @@ class Paper2CMap():
         :param request_timeout: The request timeout. Default: 60.
         :param max_retries: The maximum number of retries. Default: 6.
         :param max_tokens: The maximum number of tokens. Default: None.
+        :param endpoints: Several endpoints (keys, regions or deployments) of the model to balance the requests across, see `LLMManager`. Default: None.
+        :param requests_per_minute: The maximum number of LLM requests per minute. If None, requests are not limited. Default: None.
+        :param tokens_per_minute: The maximum number of LLM tokens per minute. If None, tokens are not limited. Default: None.
+        :param cache_dir: The directory of the persistent LLM response cache. If None, responses are not cached. Default: None.
+        :param cache_max_size: The maximum size of the cache in bytes. If None, the size is not limited. Default: None.
+        :param cache_ttl: The time to live of the cache entries in seconds. If None, entries never expire. Default: None.
+        :param hedge_percentile: If set, a request still running after this percentile of the observed latencies is duplicated and the first reply wins, e.g. 0.95. Default: None.
+        :param adaptive_timeout: Whether requests time out after a multiple of the observed tail latency (at most {request_timeout}) and are tried again, instead of waiting for all the retries of the model. Default: False.
+        :param circuit_breaker_threshold: If set, requests fail fast with CircuitOpenError for a while after this number of consecutive failures of the backend. Default: None.
+        :param compact_prompts: Whether to use the token-lean prompts, see `CMapGPT`. Token counts per stage are kept in `chat_client.token_usage`. Default: False.
+        :param checkpoint_dir: The directory where the result of every stage of a job is persisted. A re-run on the same PDF with the same parameters resumes from the first missing stage. If None, nothing is persisted. Default: None.
+        :param catelogue_mode: How the section titles are found. "auto" reads the PDF outline, then the layout features of the text, and only asks the LLM when neither is confident; "local" never asks the LLM; "llm" always asks the LLM. Default: "auto".
+        :param low_memory: Whether the text of the PDF file is spilled to disk while it is parsed, and every section is only read back when it is sent to the LLM, so memory stays flat for very large documents, see `PaperReader`. Default: False.
+        :param spill_dir: The directory of the spilled text in low memory mode. If None, the default temporary directory. Default: None.
+        :param chatbot: An existing chat model, or a ChatClient shared with other instances (including its rate limiter and cache). If given, the model, rate limit and cache parameters are ignored. Default: None.
         :param verbose: Whether to print debug logs. Default: False.
         """
-        self.chatbot = LLMManager(
-            model_name=model_name,
-            deployment_name=deployment_name,
-            deployment_version=deployment_version,
-            temperature=temperature,
-            request_timeout=request_timeout,
-            max_retries=max_retries,
-            max_tokens=max_tokens,
-            verbose=verbose,
-        ).LLM
+        if isinstance(chatbot, ChatClient):
+            self.chat_client = chatbot
+        else:
+            self.chat_client = build_chat_client(
+                chatbot=chatbot,
+                model_name=model_name,
+                deployment_name=deployment_name,
+                deployment_version=deployment_version,
+                temperature=temperature,
+                request_timeout=request_timeout,
+                max_retries=max_retries,
+                max_tokens=max_tokens,
+                endpoints=endpoints,
+                requests_per_minute=requests_per_minute,
+                tokens_per_minute=tokens_per_minute,
+                cache_dir=cache_dir,
+                cache_max_size=cache_max_size,
+                cache_ttl=cache_ttl,
+                hedge_percentile=hedge_percentile,
+                adaptive_timeout=adaptive_timeout,
+                circuit_breaker_threshold=circuit_breaker_threshold,
+                verbose=verbose,
+            )
+
+        self.chatbot = self.chat_client.chatbot
+        self.rate_limiter = self.chat_client.rate_limiter
+        self.cache = self.chat_client.cache
+        self.policy = self.chat_client.policy
+
+        self.paper_reader = PaperReader(chatbot=self.chat_client, catelogue_mode=catelogue_mode,
+                                        low_memory=low_memory, spill_dir=spill_dir)
+        self.cmap_gpt = CMapGPT(chatbot=self.chat_client, compact_prompts=compact_prompts)
 
-        self.paper_reader = PaperReader(chatbot=self.chatbot)
-        self.cmap_gpt = CMapGPT(chatbot=self.chatbot)
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint = None
 
+        # section index -> summary of the section, from the last generation. Indexes are those of
+        # `paper_reader.sections`, or of the chunks when sections are chunked, whatever the planner selects
+        self.section_summaries: Dict[int, str] = {}
+        # the plan of the last generation with a SectionPlanner, see `SectionPlanner.plan`
+        self.section_plan: List[Dict] = []
+
+        self.pdf_path: str | None = None
+        self._pdf_hash: str | None = None
         self._loaded = False
 
         if verbose:
             logger.setLevel(colorlog.DEBUG)
 
-    def load(self, pdf_path: str) -> None:
+    def load(self, pdf_path: str, num_workers: int = 1, parsed: Tuple[List[str], List[Tuple[str, float, bool]]] | None = None) -> None:
         """
         Load a PDF file.
 
         :param pdf_path: The path to the PDF file.
+        :param num_workers: The number of processes used to parse the pages. Default: 1.
+        :param parsed: The output of `pdf_parser.parse_pdf` for the PDF file, e.g. computed in another process. If given, the PDF file is not parsed again. Default: None.
+        """
+        logger.info("[Paper2CMap] Loading PDF file: %s", pdf_path)
+        catelogue = self._open_checkpoint(pdf_path)
+        self.paper_reader.load(pdf_path, num_workers, catelogue, parsed)
+        self.pdf_path, self._pdf_hash = pdf_path, None
+        self._checkpoint_save("catelogue", self.paper_reader.catelogue_mode, self.paper_reader.catelogue)
+        self._loaded = True
+
+    async def aload(self, pdf_path: str, num_workers: int = 1, parsed: Tuple[List[str], List[Tuple[str, float, bool]]] | None = None) -> None:
+        """
+        Asynchronous version of `load`.
+
+        :param pdf_path: The path to the PDF file.
+        :param num_workers: The number of processes used to parse the pages. Default: 1.
+        :param parsed: The output of `pdf_parser.parse_pdf` for the PDF file, e.g. computed in another process. If given, the PDF file is not parsed again. Default: None.
         """
-        logger.info(f"[Paper2CMap] Loading PDF file: {pdf_path}")
-        self.paper_reader.load(pdf_path)
+        logger.info("[Paper2CMap] Loading PDF file: %s", pdf_path)
+        catelogue = self._open_checkpoint(pdf_path)
+        await self.paper_reader.aload(pdf_path, num_workers, catelogue, parsed)
+        self.pdf_path, self._pdf_hash = pdf_path, None
+        self._checkpoint_save("catelogue", self.paper_reader.catelogue_mode, self.paper_reader.catelogue)
         self._loaded = True
 
+    def _open_checkpoint(self, pdf_path: str) -> List[str] | None:
+        """
+        Open the job checkpoint of a PDF file if checkpointing is enabled.
+
+        :param pdf_path: The path to the PDF file.
+        :return: The checkpointed catelogue of the PDF file, or None if there is none.
+        """
+        if self.checkpoint_dir is None:
+            return None
+        self.checkpoint = JobCheckpoint(self.checkpoint_dir, pdf_path, model_params={
+            "model_name": getattr(self.chatbot, "model_name", ""),
+            "deployment_name": getattr(self.chatbot, "deployment_name", ""),
+            "temperature": getattr(self.chatbot, "temperature", None),
+        })
+        logger.info("[Paper2CMap] Checkpoint directory: %s", self.checkpoint.job_dir)
+        return self._checkpoint_load("catelogue", self.paper_reader.catelogue_mode)
+
+    def _checkpoint_load(self, stage: str, inputs: Any) -> Any | None:
+        if self.checkpoint is None:
+            return None
+        result = self.checkpoint.load(stage, inputs)
+        if result is not None:
+            metrics.increment("checkpoint_hits", stage=stage)
+        return result
+
+    def _checkpoint_save(self, stage: str, inputs: Any, result: Any) -> None:
+        if self.checkpoint is not None:
+            self.checkpoint.save(stage, inputs, result)
+
+    def _generate_cmap_for_section(self, i: int, section: str,
+                                   max_num_concepts: int = 10, max_num_relationships: int = 30,
+                                   section_mode: str = "two_pass", fused_summary: bool = False) -> List[Dict] | None:
+        """
+        Generate a concept map for a single section.
+
+        :param i: The index of the section.
+        :param section: The text of the section.
+        :param max_num_concepts: The maximum number of concepts.
+        :param max_num_relationships: The maximum number of relationships.
+        :param section_mode: "two_pass" summarizes the section, then generates the concept map from the summary; "fused" generates it from the section in one call.
+        :param fused_summary: Whether the fused call also returns a summary of the section.
+        :return: A concept map, or None if the section is skipped because the outputs of the model were unusable.
+        """
+        with metrics.span("section", index=i, mode=section_mode):
+            if section_mode == "fused":
+                inputs = [section, max_num_concepts, max_num_relationships, fused_summary]
+                result = self._checkpoint_load("fuse", inputs)
+                if result is None:
+                    logger.info("[Paper2CMap] Generating concept map for section %s in one call", i)
+                    with metrics.span("fuse", index=i):
+                        try:
+                            cmap, summary = self.cmap_gpt.generate_fused(
+                                text=section,
+                                max_num_concepts=max_num_concepts,
+                                max_num_relationships=max_num_relationships,
+                                with_summary=fused_summary
+                                )
+                        except ValueError as e:
+                            return self._section_skipped(i, e)
+                    result = {"cmap": cmap, "summary": summary}
+                    self._checkpoint_save("fuse", inputs, result)
+                return self._section_done(i, result["cmap"], result["summary"])
+
+            text = self._checkpoint_load("preprocess", section)
+            if text is None:
+                logger.info("[Paper2CMap] Preprocessing section %s", i)
+                with metrics.span("preprocess", index=i):
+                    text = self.cmap_gpt.preprocess(section)
+                self._checkpoint_save("preprocess", section, text)
+
+            inputs = [text, max_num_concepts, max_num_relationships, self.cmap_gpt.compact_prompts]
+            cmap = self._checkpoint_load("generate", inputs)
+            if cmap is None:
+                logger.info("[Paper2CMap] Generating concept map for section %s", i)
+                with metrics.span("generate", index=i):
+                    try:
+                        cmap = self.cmap_gpt.generate(
+                            text=text,
+                            max_num_concepts=max_num_concepts,
+                            max_num_relationships=max_num_relationships
+                            )
+                    except ValueError as e:
+                        return self._section_skipped(i, e)
+                self._checkpoint_save("generate", inputs, cmap)
+            return self._section_done(i, cmap, text)
+
+    async def _agenerate_cmap_for_section(self, i: int, section: str,
+                                          max_num_concepts: int = 10, max_num_relationships: int = 30,
+                                          section_mode: str = "two_pass", fused_summary: bool = False) -> List[Dict] | None:
+        """
+        Asynchronous version of `_generate_cmap_for_section`.
+        """
+        with metrics.span("section", index=i, mode=section_mode):
+            if section_mode == "fused":
+                inputs = [section, max_num_concepts, max_num_relationships, fused_summary]
+                result = self._checkpoint_load("fuse", inputs)
+                if result is None:
+                    logger.info("[Paper2CMap] Generating concept map for section %s in one call", i)
+                    with metrics.span("fuse", index=i):
+                        try:
+                            cmap, summary = await self.cmap_gpt.agenerate_fused(
+                                text=section,
+                                max_num_concepts=max_num_concepts,
+                                max_num_relationships=max_num_relationships,
+                                with_summary=fused_summary
+                                )
+                        except ValueError as e:
+                            return self._section_skipped(i, e)
+                    result = {"cmap": cmap, "summary": summary}
+                    self._checkpoint_save("fuse", inputs, result)
+                return self._section_done(i, result["cmap"], result["summary"])
+
+            text = self._checkpoint_load("preprocess", section)
+            if text is None:
+                logger.info("[Paper2CMap] Preprocessing section %s", i)
+                with metrics.span("preprocess", index=i):
+                    text = await self.cmap_gpt.apreprocess(section)
+                self._checkpoint_save("preprocess", section, text)
+
+            inputs = [text, max_num_concepts, max_num_relationships, self.cmap_gpt.compact_prompts]
+            cmap = self._checkpoint_load("generate", inputs)
+            if cmap is None:
+                logger.info("[Paper2CMap] Generating concept map for section %s", i)
+                with metrics.span("generate", index=i):
+                    try:
+                        cmap = await self.cmap_gpt.agenerate(
+                            text=text,
+                            max_num_concepts=max_num_concepts,
+                            max_num_relationships=max_num_relationships
+                            )
+                    except ValueError as e:
+                        return self._section_skipped(i, e)
+                self._checkpoint_save("generate", inputs, cmap)
+            return self._section_done(i, cmap, text)
+
+    def _section_done(self, i: int, cmap: List[Dict], summary: str | None) -> List[Dict]:
+        if summary is not None:
+            self.section_summaries[i] = summary
+        logger.info("[Paper2CMap] Concept map for section %s: %s", i, cmap)
+        return cmap
+
+    @staticmethod
+    def _section_skipped(i: int, error: ValueError) -> None:
+        # like an unusable merge output, an unusable section does not abort the job
+        metrics.increment("skipped_sections")
+        logger.warning("[Paper2CMap] Skipping section %s: %s", i, error)
+        return None
+
+    @staticmethod
+    def _usable_cmaps(cmap_list: List[List[Dict] | None]) -> List[List[Dict]]:
+        """
+        :return: The concept maps of the sections that were not skipped.
+        :raises ValueError: If every section was skipped.
+        """
+        usable = [cmap for cmap in cmap_list if cmap is not None]
+        if cmap_list and not usable:
+            raise ValueError(f"The outputs of the model were unusable for all {len(cmap_list)} sections")
+        return usable
+
+    @staticmethod
+    def _check_section_mode(section_mode: str) -> None:
+        if section_mode not in ("two_pass", "fused"):
+            raise ValueError(f"Unknown section_mode: {section_mode}, expected one of 'two_pass' and 'fused'")
+
+    def _prompt_overheads(self, max_num_concepts: int, max_num_relationships: int) -> Tuple[Dict[str, int], int]:
+        # the prompt tokens of the instructions and examples, i.e. of the prompts rendered without any text
+        overheads = {
+            "preprocess": estimate_messages_tokens(self.cmap_gpt._preprocess_messages("")),
+            "generate": estimate_messages_tokens(self.cmap_gpt._generate_messages("", max_num_concepts, max_num_relationships)),
+            "fuse": estimate_messages_tokens(self.cmap_gpt._fuse_messages("", max_num_concepts, max_num_relationships, False)),
+        }
+        return overheads, estimate_messages_tokens(self.cmap_gpt._merge_and_prune_messages([], max_num_concepts, max_num_relationships))
+
+    def _plan_sections(self, sections: Sequence[str], planner: SectionPlanner, section_mode: str, max_workers: int,
+                       max_num_concepts: int, max_num_relationships: int) -> Tuple[Sequence[str], List[int]]:
+        """
+        Keep the sections selected by the planner, without their trailing reference lists.
+
+        :return: The selected texts in document order, as TextRanges in low memory mode, and their indexes in {sections}.
+        """
+        overheads, merge_overhead = self._prompt_overheads(max_num_concepts, max_num_relationships)
+        with metrics.span("plan", sections=len(sections)):
+            self.section_plan = planner.plan(sections, section_mode, max_workers, overheads, max_num_relationships, merge_overhead)
+        selected = [entry for entry in self.section_plan if entry["selected"]]
+        indexes = [entry["index"] for entry in selected]
+        if not isinstance(sections, TextRanges):
+            return [sections[entry["index"]][:entry["end"]] for entry in selected], indexes
+
+        # the selected texts are ranges of the same store, cut before their reference lists, not copies
+        ranges = []
+        for entry in selected:
+            start, end = sections.ranges[entry["index"]]
+            if sections.strip:
+                # {entry["end"]} is an offset in the stripped text
+                text = sections.store[start:end]
+                start += len(text) - len(text.lstrip())
+            ranges.append((start, start + entry["end"]))
+        return TextRanges(sections.store, ranges), indexes
+
+    def _release_sections(self, sections: Sequence[str]) -> None:
+        # the chunks spilled by `_select_sections` are deleted once their concept maps are generated
+        if isinstance(sections, TextRanges) and sections.store is not self.paper_reader.full_text:
+            sections.store.close()
+
+    def _select_sections(self, max_num_iterations: int = -1,
+                         chunk_target_tokens: int | None = None, chunk_max_tokens: int | None = None,
+                         planner: SectionPlanner | None = None, section_mode: str = "two_pass", max_workers: int = 1,
+                         max_num_concepts: int = 5, max_num_relationships: int = 15) -> Tuple[Sequence[str], List[int]]:
+        """
+        Select the texts to generate concept maps for.
+
+        :param max_num_iterations: The maximum number of iterations. If set to -1, it will iterate over all sections.
+        :param chunk_target_tokens: If set, small adjacent sections are packed up to this number of tokens, see `chunk_sections`.
+        :param chunk_max_tokens: Sections larger than this number of tokens are split, see `chunk_sections`.
+        :param planner: If set, only the sections it selects within its budgets are kept, see `SectionPlanner`. The plan is kept in `section_plan`.
+        :param section_mode: "two_pass" or "fused", for the estimates of the planner.
+        :param max_workers: The maximum number of sections processed concurrently, for the estimates of the planner.
+        :param max_num_concepts: The maximum number of concepts of a section, for the estimates of the planner.
+        :param max_num_relationships: The maximum number of relationships of a section, for the estimates of the planner.
+        :return: The texts in document order, as TextRanges in low memory mode, and their indexes in
+                 `paper_reader.sections`, or in the chunks when sections are chunked. Chunks spilled in low memory
+                 mode are deleted with `_release_sections`.
+        """
+        sections = self.paper_reader.sections
+        if chunk_target_tokens is not None and isinstance(sections, TextRanges):
+            # the chunks are spilled like the sections, so they are not all held in memory either
+            store = TextStore(self.paper_reader.spill_dir)
+            ranges = [store.append(chunk) for chunk in iter_chunks(sections, chunk_target_tokens, chunk_max_tokens)]
+            sections = TextRanges(store, ranges)
+            logger.info("[Paper2CMap] Chunked %s sections into %s", len(self.paper_reader.sections), len(sections))
+        elif chunk_target_tokens is not None:
+            sections = chunk_sections(sections, chunk_target_tokens, chunk_max_tokens)
+            logger.info("[Paper2CMap] Chunked %s sections into %s", len(self.paper_reader.sections), len(sections))
+        self.section_plan = []
+        indexes = list(range(len(sections)))
+        if planner is not None:
+            sections, indexes = self._plan_sections(sections, planner, section_mode, max_workers, max_num_concepts, max_num_relationships)
+        if max_num_iterations != -1:
+            sections, indexes = sections[:max_num_iterations], indexes[:max_num_iterations]
+        return sections, indexes
+
     def _generate_cmaps_by_section(self, max_num_concepts: int = 10, max_num_relationships: int = 30, 
-                   max_num_iterations: int = -1) -> List[List[Dict]]:
+                   max_num_iterations: int = -1, max_workers: int = 1,
+                   chunk_target_tokens: int | None = None, chunk_max_tokens: int | None = None,
+                   section_mode: str = "two_pass", fused_summary: bool = False,
+                   planner: SectionPlanner | None = None) -> List[List[Dict]]:
         """
         Generate concept maps for each section separately.
 
         :param max_num_concepts: The maximum number of concepts.
         :param max_num_relationships: The maximum number of relationships.
         :param max_num_iterations: The maximum number of iterations. If set to -1, it will iterate over all sections.
-        :return: A list of concept maps.
-        """
-        cmap_list = []
-        for i, section in enumerate(self.paper_reader.sections):
-            if max_num_iterations != -1 and i >= max_num_iterations:
-                break
-
-            logger.info(f"[Paper2CMap] Preprocessing section {i}")
-            text = self.cmap_gpt.preprocess(section)
-
-            logger.info(f"[Paper2CMap] Generating concept map for section {i}")
-            cmap = self.cmap_gpt.generate(
-                text=text,
-                max_num_concepts=max_num_concepts,
-                max_num_relationships=max_num_relationships
-                )
-            logger.info(f"[Paper2CMap] Concept map for section {i}: {cmap}")
-            
-            cmap_list.append(cmap)
-
-        return cmap_list
+        :param max_workers: The maximum number of sections processed concurrently. If set to 1, sections are processed one by one.
+        :param chunk_target_tokens: If set, small adjacent sections are packed up to this number of tokens, see `chunk_sections`.
+        :param chunk_max_tokens: Sections larger than this number of tokens are split, see `chunk_sections`.
+        :param section_mode: "two_pass" or "fused", see `_generate_cmap_for_section`.
+        :param fused_summary: Whether the fused calls also return a summary of the section.
+        :param planner: If set, only the sections selected by the planner are processed, see `_select_sections`.
+        :return: A list of concept maps, in the same order as the sections. Skipped sections are left out.
+        :raises ValueError: If every section is skipped, see `_generate_cmap_for_section`.
+        """
+        sections, indexes = self._select_sections(max_num_iterations, chunk_target_tokens, chunk_max_tokens,
+                                                  planner, section_mode, max_workers, max_num_concepts, max_num_relationships)
+        try:
+            if max_workers <= 1:
+                return self._usable_cmaps([
+                    self._generate_cmap_for_section(index, section, max_num_concepts, max_num_relationships, section_mode, fused_summary)
+                    for index, section in zip(indexes, sections)
+                ])
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # results are collected in submission order, so sections stay in order. Sections are read in the
+                # workers, so that in low memory mode only the sections in flight are materialized. Each worker runs in
+                # a copy of the caller's context, so that its section span keeps the paper span as parent.
+                futures = [
+                    executor.submit(contextvars.copy_context().run,
+                                    lambda i: self._generate_cmap_for_section(indexes[i], sections[i], max_num_concepts, max_num_relationships,
+                                                                              section_mode, fused_summary), i)
+                    for i in range(len(sections))
+                ]
+                return self._usable_cmaps([future.result() for future in futures])
+        finally:
+            self._release_sections(sections)
     
+    async def _agenerate_cmaps_by_section(self, max_num_concepts: int = 10, max_num_relationships: int = 30,
+                                          max_num_iterations: int = -1, max_workers: int = 1,
+                                          chunk_target_tokens: int | None = None,
+                                          chunk_max_tokens: int | None = None,
+                                          section_mode: str = "two_pass", fused_summary: bool = False,
+                                          planner: SectionPlanner | None = None) -> List[List[Dict]]:
+        """
+        Asynchronous version of `_generate_cmaps_by_section`. At most {max_workers} sections are in flight at a time.
+        """
+        sections, indexes = self._select_sections(max_num_iterations, chunk_target_tokens, chunk_max_tokens,
+                                                  planner, section_mode, max_workers, max_num_concepts, max_num_relationships)
+
+        semaphore = asyncio.Semaphore(max(max_workers, 1))
+
+        async def _generate(i: int) -> List[Dict]:
+            async with semaphore:
+                return await self._agenerate_cmap_for_section(indexes[i], sections[i], max_num_concepts, max_num_relationships,
+                                                              section_mode, fused_summary)
+
+        try:
+            # asyncio.gather returns results in the order of the awaitables, so sections stay in order
+            return self._usable_cmaps(list(await asyncio.gather(*[_generate(i) for i in range(len(sections))])))
+        finally:
+            self._release_sections(sections)
+
     def _merge_and_prune_cmaps(self, cmap_list: List[List[Dict]],
-                               max_num_concepts: int = 10, max_num_relationships: int = 30) -> List[Dict]:
+                               max_num_concepts: int = 10, max_num_relationships: int = 30,
+                               merge_mode: str = "flat", merge_token_budget: int = 2000,
+                               max_workers: int = 1, cluster_threshold: float | None = None) -> List[Dict]:
         """
         Merge and prune a list of concept maps.
 
         :param cmap_list: A list of concept maps.
         :param max_num_concepts: The maximum number of concepts.
         :param max_num_relationships: The maximum number of relationships.
+        :param merge_mode: "flat" merges all concept maps in a single LLM call; "tree" merges groups of concept maps
+                           fitting into {merge_token_budget} tokens, level by level, until one concept map remains;
+                           "local" deduplicates and prunes the concept maps by concept centrality without calling the LLM.
+        :param merge_token_budget: The maximum number of input tokens of one merge call in "tree" mode.
+        :param max_workers: The maximum number of merge calls running concurrently in "tree" mode.
+        :param cluster_threshold: If set, near-duplicate concepts across all concept maps are merged locally
+                                  before merging, see `ConceptMap.concept_clusters`.
         :return: A merged and pruned concept map.
         """
-        cmap = [_ele for _cmap in cmap_list for _ele in _cmap]
-        return self.cmap_gpt.merge_and_prune(cmap, max_num_concepts, max_num_relationships)
+        inputs = [cmap_list, max_num_concepts, max_num_relationships, merge_mode, merge_token_budget, cluster_threshold,
+                  self.cmap_gpt.compact_prompts]
+        cmap = self._checkpoint_load("merge", inputs)
+        if cmap is None:
+            with metrics.span("merge", mode=merge_mode, num_cmaps=len(cmap_list)):
+                cmap = self._reduce_cmaps(cmap_list, max_num_concepts, max_num_relationships,
+                                          merge_mode, merge_token_budget, max_workers, cluster_threshold)
+            self._checkpoint_save("merge", inputs, cmap)
+        return cmap
+
+    def _reduce_cmaps(self, cmap_list: List[List[Dict]],
+                      max_num_concepts: int = 10, max_num_relationships: int = 30,
+                      merge_mode: str = "flat", merge_token_budget: int = 2000,
+                      max_workers: int = 1, cluster_threshold: float | None = None) -> List[Dict]:
+        """
+        Merge and prune a list of concept maps, see `_merge_and_prune_cmaps`.
+        """
+        if cluster_threshold is not None:
+            cmap_list = self._cluster_concepts(cmap_list, cluster_threshold)
+
+        if merge_mode == "local":
+            return ConceptMap.union(cmap_list).prune(max_num_concepts, max_num_relationships).to_triples()
+        if merge_mode == "flat":
+            cmap = ConceptMap.union(cmap_list)
+            return self.cmap_gpt.merge_and_prune(cmap, max_num_concepts, max_num_relationships)
+        if merge_mode != "tree":
+            raise ValueError(f"merge_mode must be one of 'flat', 'tree' or 'local', but got {merge_mode}")
+
+        level = 0
+        while True:
+            groups = self._group_cmaps(cmap_list, merge_token_budget)
+            logger.info("[Paper2CMap] Merging %s concept maps into %s at level %s", len(cmap_list), len(groups), level)
+
+            def _merge(group: List[List[Dict]]) -> List[Dict]:
+                # a lone concept map has nothing to merge with until the final level
+                if len(group) == 1 and len(groups) > 1:
+                    return group[0]
+                cmap = ConceptMap.union(group)
+                return self.cmap_gpt.merge_and_prune(cmap, max_num_concepts, max_num_relationships)
+
+            with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+                futures = [executor.submit(contextvars.copy_context().run, _merge, group) for group in groups]
+                cmap_list = [future.result() for future in futures]
+
+            if len(cmap_list) == 1:
+                return cmap_list[0]
+            level += 1
+
+    async def _amerge_and_prune_cmaps(self, cmap_list: List[List[Dict]],
+                                      max_num_concepts: int = 10, max_num_relationships: int = 30,
+                                      merge_mode: str = "flat", merge_token_budget: int = 2000,
+                                      max_workers: int = 1, cluster_threshold: float | None = None) -> List[Dict]:
+        """
+        Asynchronous version of `_merge_and_prune_cmaps`.
+        """
+        inputs = [cmap_list, max_num_concepts, max_num_relationships, merge_mode, merge_token_budget, cluster_threshold,
+                  self.cmap_gpt.compact_prompts]
+        cmap = self._checkpoint_load("merge", inputs)
+        if cmap is None:
+            with metrics.span("merge", mode=merge_mode, num_cmaps=len(cmap_list)):
+                cmap = await self._areduce_cmaps(cmap_list, max_num_concepts, max_num_relationships,
+                                                 merge_mode, merge_token_budget, max_workers, cluster_threshold)
+            self._checkpoint_save("merge", inputs, cmap)
+        return cmap
+
+    async def _areduce_cmaps(self, cmap_list: List[List[Dict]],
+                             max_num_concepts: int = 10, max_num_relationships: int = 30,
+                             merge_mode: str = "flat", merge_token_budget: int = 2000,
+                             max_workers: int = 1, cluster_threshold: float | None = None) -> List[Dict]:
+        """
+        Asynchronous version of `_reduce_cmaps`.
+        """
+        if cluster_threshold is not None:
+            cmap_list = self._cluster_concepts(cmap_list, cluster_threshold)
+
+        if merge_mode == "local":
+            return ConceptMap.union(cmap_list).prune(max_num_concepts, max_num_relationships).to_triples()
+        if merge_mode == "flat":
+            cmap = ConceptMap.union(cmap_list)
+            return await self.cmap_gpt.amerge_and_prune(cmap, max_num_concepts, max_num_relationships)
+        if merge_mode != "tree":
+            raise ValueError(f"merge_mode must be one of 'flat', 'tree' or 'local', but got {merge_mode}")
+
+        semaphore = asyncio.Semaphore(max(max_workers, 1))
+        level = 0
+        while True:
+            groups = self._group_cmaps(cmap_list, merge_token_budget)
+            logger.info("[Paper2CMap] Merging %s concept maps into %s at level %s", len(cmap_list), len(groups), level)
+
+            async def _merge(group: List[List[Dict]]) -> List[Dict]:
+                if len(group) == 1 and len(groups) > 1:
+                    return group[0]
+                cmap = ConceptMap.union(group)
+                async with semaphore:
+                    return await self.cmap_gpt.amerge_and_prune(cmap, max_num_concepts, max_num_relationships)
+
+            cmap_list = list(await asyncio.gather(*[_merge(group) for group in groups]))
+
+            if len(cmap_list) == 1:
+                return cmap_list[0]
+            level += 1
+
+    @staticmethod
+    def _cluster_concepts(cmap_list: List[List[Dict]], threshold: float) -> List[List[Dict]]:
+        """
+        Rename near-duplicate concepts of all concept maps to one canonical label.
+
+        :param cmap_list: A list of concept maps.
+        :param threshold: The minimum cosine similarity of two concepts in the same cluster.
+        :return: The renamed concept maps.
+        """
+        merged = ConceptMap.union(cmap_list)
+        mapping = merged.concept_clusters(threshold)
+        logger.info("[Paper2CMap] Clustered %s concepts into %s", merged.num_concepts, len(set(mapping.values())))
+        return [ConceptMap.from_triples(cmap).rename_concepts(mapping).to_triples() for cmap in cmap_list]
+
+    @staticmethod
+    def _group_cmaps(cmap_list: List[List[Dict]], token_budget: int) -> List[List[List[Dict]]]:
+        """
+        Group adjacent concept maps so that each group fits into {token_budget} tokens.
+        Every group but a trailing one holds at least two concept maps, so each level shrinks the list.
+
+        :param cmap_list: A list of concept maps.
+        :param token_budget: The maximum number of tokens of one group.
+        :return: A list of groups of concept maps.
+        """
+        groups = []
+        group, group_tokens = [], 0
+        for cmap in cmap_list:
+            tokens = estimate_tokens(json.dumps(cmap))
+            if len(group) >= 2 and group_tokens + tokens > token_budget:
+                groups.append(group)
+                group, group_tokens = [], 0
+            group.append(cmap)
+            group_tokens += tokens
+        if group:
+            groups.append(group)
+        return groups
 
     def generate_cmap(self, max_num_concepts: int = 10, max_num_relationships: int = 30, 
-                   max_num_iterations: int = -1, section_scale: float = 0.5) -> List[Dict]:
+                   max_num_iterations: int = -1, section_scale: float = 0.5, max_workers: int = 1,
+                   merge_mode: str = "flat", merge_token_budget: int = 2000,
+                   cluster_threshold: float | None = None,
+                   chunk_target_tokens: int | None = None, chunk_max_tokens: int | None = None,
+                   section_mode: str = "two_pass", fused_summary: bool = False,
+                   planner: SectionPlanner | None = None) -> List[Dict]:
         """
         Generate a concept map for the entire paper or {max_num_iterations} sections.
 
@@ -110,18 +632,301 @@ class Paper2CMap():
         :param max_num_relationships: The maximum number of relationships. Default: 30.
         :param max_num_iterations: The maximum number of iterations. If set to -1, it will iterate over all sections. Default: -1.
         :param section_scale: The scale of the maximum number of concepts and relationships for each section. Default: 0.5.
+        :param max_workers: The maximum number of sections processed concurrently. Default: 1.
+        :param merge_mode: "flat" merges all section concept maps in one LLM call; "tree" merges them hierarchically in groups of at most {merge_token_budget} tokens; "local" merges them without calling the LLM. Default: "flat".
+        :param merge_token_budget: The maximum number of input tokens of one merge call in "tree" mode. Default: 2000.
+        :param cluster_threshold: If set, near-duplicate concepts whose character n-gram similarity reaches this threshold are merged locally before merging the concept maps, e.g. 0.65. Default: None.
+        :param chunk_target_tokens: If set, adjacent small sections are packed into one LLM request up to this estimated number of tokens, e.g. 1500. Default: None.
+        :param chunk_max_tokens: Sections larger than this estimated number of tokens are split at paragraph boundaries. If None, twice {chunk_target_tokens}. Default: None.
+        :param section_mode: "two_pass" summarizes every section, then generates its concept map from the summary; "fused" generates it from the raw section in a single call, halving the calls per section. Default: "two_pass".
+        :param fused_summary: Whether the fused call also returns a summary of the section, kept in `section_summaries` like the summaries of "two_pass". Default: False.
+        :param planner: If set, the sections are scored and selected locally within the token, cost and latency budgets of the planner before any LLM call, instead of taking the first {max_num_iterations}, see `SectionPlanner`. The plan is kept in `section_plan`. Default: None.
         :return: A concept map.
         """
         if not self._loaded:
-            logger.error(f"[Paper2CMap] Please load a PDF file first.")
+            logger.error("[Paper2CMap] Please load a PDF file first.")
             raise Exception("Please load a PDF file first.")
+        self._check_section_mode(section_mode)
+        self.section_summaries = {}
         
-        logger.info(f"[Paper2CMap] Generating concept maps by section")
-        cmap_list = self._generate_cmaps_by_section(int(max_num_concepts * section_scale), int(max_num_relationships * section_scale), max_num_iterations)
+        logger.info("[Paper2CMap] Generating concept maps by section")
+        cmap_list = self._generate_cmaps_by_section(int(max_num_concepts * section_scale), int(max_num_relationships * section_scale), max_num_iterations, max_workers,
+                                                    chunk_target_tokens, chunk_max_tokens, section_mode, fused_summary, planner)
+
+        logger.info("[Paper2CMap] Merging and pruning concept maps")
+        cmap = self._merge_and_prune_cmaps(cmap_list, max_num_concepts, max_num_relationships,
+                                           merge_mode, merge_token_budget, max_workers, cluster_threshold)
+
+        logger.info("[Paper2CMap] Fianl concept map: %s", cmap)
+        logger.info("[Paper2CMap] Token usage by stage: %s", self.chat_client.token_usage)
+        return cmap
+
+    async def agenerate_cmap(self, max_num_concepts: int = 10, max_num_relationships: int = 30,
+                             max_num_iterations: int = -1, section_scale: float = 0.5, max_workers: int = 1,
+                             merge_mode: str = "flat", merge_token_budget: int = 2000,
+                             cluster_threshold: float | None = None,
+                             chunk_target_tokens: int | None = None, chunk_max_tokens: int | None = None,
+                             section_mode: str = "two_pass", fused_summary: bool = False,
+                             planner: SectionPlanner | None = None) -> List[Dict]:
+        """
+        Asynchronous version of `generate_cmap`. A single event loop can drive many papers at once,
+        each with its own Paper2CMap instance.
+
+        :param max_num_concepts: The maximum number of concepts. Default: 10.
+        :param max_num_relationships: The maximum number of relationships. Default: 30.
+        :param max_num_iterations: The maximum number of iterations. If set to -1, it will iterate over all sections. Default: -1.
+        :param section_scale: The scale of the maximum number of concepts and relationships for each section. Default: 0.5.
+        :param max_workers: The maximum number of sections in flight concurrently. Default: 1.
+        :param merge_mode: "flat" merges all section concept maps in one LLM call; "tree" merges them hierarchically in groups of at most {merge_token_budget} tokens; "local" merges them without calling the LLM. Default: "flat".
+        :param merge_token_budget: The maximum number of input tokens of one merge call in "tree" mode. Default: 2000.
+        :param cluster_threshold: If set, near-duplicate concepts whose character n-gram similarity reaches this threshold are merged locally before merging the concept maps, e.g. 0.65. Default: None.
+        :param chunk_target_tokens: If set, adjacent small sections are packed into one LLM request up to this estimated number of tokens, e.g. 1500. Default: None.
+        :param chunk_max_tokens: Sections larger than this estimated number of tokens are split at paragraph boundaries. If None, twice {chunk_target_tokens}. Default: None.
+        :param section_mode: "two_pass" summarizes every section, then generates its concept map from the summary; "fused" generates it from the raw section in a single call, halving the calls per section. Default: "two_pass".
+        :param fused_summary: Whether the fused call also returns a summary of the section, kept in `section_summaries` like the summaries of "two_pass". Default: False.
+        :param planner: If set, the sections are scored and selected locally within the token, cost and latency budgets of the planner before any LLM call, instead of taking the first {max_num_iterations}, see `SectionPlanner`. The plan is kept in `section_plan`. Default: None.
+        :return: A concept map.
+        """
+        if not self._loaded:
+            logger.error("[Paper2CMap] Please load a PDF file first.")
+            raise Exception("Please load a PDF file first.")
+        self._check_section_mode(section_mode)
+        self.section_summaries = {}
+
+        logger.info("[Paper2CMap] Generating concept maps by section")
+        cmap_list = await self._agenerate_cmaps_by_section(int(max_num_concepts * section_scale), int(max_num_relationships * section_scale), max_num_iterations, max_workers,
+                                                           chunk_target_tokens, chunk_max_tokens, section_mode, fused_summary, planner)
 
-        logger.info(f"[Paper2CMap] Merging and pruning concept maps")
-        cmap = self._merge_and_prune_cmaps(cmap_list, max_num_concepts, max_num_relationships)
+        logger.info("[Paper2CMap] Merging and pruning concept maps")
+        cmap = await self._amerge_and_prune_cmaps(cmap_list, max_num_concepts, max_num_relationships,
+                                                  merge_mode, merge_token_budget, max_workers, cluster_threshold)
 
-        logger.info(f"[Paper2CMap] Fianl concept map: {cmap}")
+        logger.info("[Paper2CMap] Fianl concept map: %s", cmap)
+        logger.info("[Paper2CMap] Token usage by stage: %s", self.chat_client.token_usage)
         return cmap
-                
\ No newline at end of file
+
+    def _section_event(self, i: int, num_sections: int, cmap: List[Dict] | None, partial_cmap: ConceptMap,
+                       max_num_concepts: int, max_num_relationships: int) -> Dict:
+        partial_cmap.update(cmap or [])
+        return {
+            "type": "section",
+            "index": i,
+            "num_sections": num_sections,
+            "cmap": cmap,
+            "summary": self.section_summaries.get(i),
+            "partial_cmap": partial_cmap.prune(max_num_concepts, max_num_relationships).to_triples(),
+        }
+
+    def generate_cmap_iter(self, max_num_concepts: int = 10, max_num_relationships: int = 30,
+                           max_num_iterations: int = -1, section_scale: float = 0.5, max_workers: int = 1,
+                           merge_mode: str = "flat", merge_token_budget: int = 2000,
+                           cluster_threshold: float | None = None,
+                           chunk_target_tokens: int | None = None, chunk_max_tokens: int | None = None,
+                           section_mode: str = "two_pass", fused_summary: bool = False,
+                           planner: SectionPlanner | None = None) -> Iterator[Dict]:
+        """
+        Generate a concept map like `generate_cmap`, yielding intermediate results as soon as they are ready.
+
+        Each finished section yields {"type": "section", "index", "num_sections", "cmap", "summary", "partial_cmap"}, where
+        "index" is the index of the section in `paper_reader.sections` (of the chunk when sections are chunked), even
+        when a planner skips some, "num_sections" the number of sections generated, and "partial_cmap" a local merge of
+        all sections finished so far. The "cmap" of a section skipped because the outputs of the model were unusable
+        is None. With max_workers > 1, sections are yielded
+        in completion order. The last event is {"type": "final", "cmap"} with the merged and pruned concept map.
+
+        :param max_num_concepts: The maximum number of concepts. Default: 10.
+        :param max_num_relationships: The maximum number of relationships. Default: 30.
+        :param max_num_iterations: The maximum number of iterations. If set to -1, it will iterate over all sections. Default: -1.
+        :param section_scale: The scale of the maximum number of concepts and relationships for each section. Default: 0.5.
+        :param max_workers: The maximum number of sections processed concurrently. Default: 1.
+        :param merge_mode: "flat" merges all section concept maps in one LLM call; "tree" merges them hierarchically in groups of at most {merge_token_budget} tokens; "local" merges them without calling the LLM. Default: "flat".
+        :param merge_token_budget: The maximum number of input tokens of one merge call in "tree" mode. Default: 2000.
+        :param cluster_threshold: If set, near-duplicate concepts whose character n-gram similarity reaches this threshold are merged locally before merging the concept maps, e.g. 0.65. Default: None.
+        :param chunk_target_tokens: If set, adjacent small sections are packed into one LLM request up to this estimated number of tokens, e.g. 1500. Default: None.
+        :param chunk_max_tokens: Sections larger than this estimated number of tokens are split at paragraph boundaries. If None, twice {chunk_target_tokens}. Default: None.
+        :param section_mode: "two_pass" summarizes every section, then generates its concept map from the summary; "fused" generates it from the raw section in a single call, halving the calls per section. Default: "two_pass".
+        :param fused_summary: Whether the fused call also returns a summary of the section, kept in `section_summaries` like the summaries of "two_pass". Default: False.
+        :param planner: If set, the sections are scored and selected locally within the token, cost and latency budgets of the planner before any LLM call, instead of taking the first {max_num_iterations}, see `SectionPlanner`. The plan is kept in `section_plan`. Default: None.
+        :return: An iterator of events.
+        """
+        if not self._loaded:
+            logger.error("[Paper2CMap] Please load a PDF file first.")
+            raise Exception("Please load a PDF file first.")
+        self._check_section_mode(section_mode)
+        self.section_summaries = {}
+
+        section_max_num_concepts = int(max_num_concepts * section_scale)
+        section_max_num_relationships = int(max_num_relationships * section_scale)
+        sections, indexes = self._select_sections(max_num_iterations, chunk_target_tokens, chunk_max_tokens, planner, section_mode,
+                                                  max_workers, section_max_num_concepts, section_max_num_relationships)
+
+        logger.info("[Paper2CMap] Generating concept maps by section")
+        cmap_list = [None] * len(sections)
+        partial_cmap = ConceptMap()
+        executor = ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+        futures = {}
+        try:
+            if executor is None:
+                for i, section in enumerate(sections):
+                    cmap_list[i] = self._generate_cmap_for_section(indexes[i], section, section_max_num_concepts, section_max_num_relationships,
+                                                                   section_mode, fused_summary)
+                    yield self._section_event(indexes[i], len(sections), cmap_list[i], partial_cmap, max_num_concepts, max_num_relationships)
+            else:
+                futures = {
+                    executor.submit(contextvars.copy_context().run,
+                                    lambda i: self._generate_cmap_for_section(indexes[i], sections[i], section_max_num_concepts, section_max_num_relationships,
+                                                                              section_mode, fused_summary), i): i
+                    for i in range(len(sections))
+                }
+                for future in as_completed(futures):
+                    i = futures[future]
+                    cmap_list[i] = future.result()
+                    yield self._section_event(indexes[i], len(sections), cmap_list[i], partial_cmap, max_num_concepts, max_num_relationships)
+        finally:
+            if executor is not None:
+                # if the consumer stops early, the sections nobody will read are not generated; a running thread
+                # cannot be interrupted, it finishes in the background and its result is dropped.
+                # Cancelling each future works on Python 3.8 too, where shutdown has no cancel_futures.
+                for future in futures:
+                    future.cancel()
+                executor.shutdown(wait=False)
+            self._release_sections(sections)
+
+        logger.info("[Paper2CMap] Merging and pruning concept maps")
+        cmap = self._merge_and_prune_cmaps(self._usable_cmaps(cmap_list), max_num_concepts, max_num_relationships,
+                                           merge_mode, merge_token_budget, max_workers, cluster_threshold)
+
+        logger.info("[Paper2CMap] Fianl concept map: %s", cmap)
+        logger.info("[Paper2CMap] Token usage by stage: %s", self.chat_client.token_usage)
+        yield {"type": "final", "cmap": cmap}
+
+    async def agenerate_cmap_iter(self, max_num_concepts: int = 10, max_num_relationships: int = 30,
+                                  max_num_iterations: int = -1, section_scale: float = 0.5, max_workers: int = 1,
+                                  merge_mode: str = "flat", merge_token_budget: int = 2000,
+                                  cluster_threshold: float | None = None,
+                                  chunk_target_tokens: int | None = None,
+                                  chunk_max_tokens: int | None = None,
+                                  section_mode: str = "two_pass", fused_summary: bool = False,
+                                  planner: SectionPlanner | None = None) -> AsyncIterator[Dict]:
+        """
+        Asynchronous version of `generate_cmap_iter`.
+
+        :param max_num_concepts: The maximum number of concepts. Default: 10.
+        :param max_num_relationships: The maximum number of relationships. Default: 30.
+        :param max_num_iterations: The maximum number of iterations. If set to -1, it will iterate over all sections. Default: -1.
+        :param section_scale: The scale of the maximum number of concepts and relationships for each section. Default: 0.5.
+        :param max_workers: The maximum number of sections processed concurrently. Default: 1.
+        :param merge_mode: "flat" merges all section concept maps in one LLM call; "tree" merges them hierarchically in groups of at most {merge_token_budget} tokens; "local" merges them without calling the LLM. Default: "flat".
+        :param merge_token_budget: The maximum number of input tokens of one merge call in "tree" mode. Default: 2000.
+        :param cluster_threshold: If set, near-duplicate concepts whose character n-gram similarity reaches this threshold are merged locally before merging the concept maps, e.g. 0.65. Default: None.
+        :param chunk_target_tokens: If set, adjacent small sections are packed into one LLM request up to this estimated number of tokens, e.g. 1500. Default: None.
+        :param chunk_max_tokens: Sections larger than this estimated number of tokens are split at paragraph boundaries. If None, twice {chunk_target_tokens}. Default: None.
+        :param section_mode: "two_pass" summarizes every section, then generates its concept map from the summary; "fused" generates it from the raw section in a single call, halving the calls per section. Default: "two_pass".
+        :param fused_summary: Whether the fused call also returns a summary of the section, kept in `section_summaries` like the summaries of "two_pass". Default: False.
+        :param planner: If set, the sections are scored and selected locally within the token, cost and latency budgets of the planner before any LLM call, instead of taking the first {max_num_iterations}, see `SectionPlanner`. The plan is kept in `section_plan`. Default: None.
+        :return: An asynchronous iterator of events.
+        """
+        if not self._loaded:
+            logger.error("[Paper2CMap] Please load a PDF file first.")
+            raise Exception("Please load a PDF file first.")
+        self._check_section_mode(section_mode)
+        self.section_summaries = {}
+
+        section_max_num_concepts = int(max_num_concepts * section_scale)
+        section_max_num_relationships = int(max_num_relationships * section_scale)
+        sections, indexes = self._select_sections(max_num_iterations, chunk_target_tokens, chunk_max_tokens, planner, section_mode,
+                                                  max_workers, section_max_num_concepts, section_max_num_relationships)
+
+        semaphore = asyncio.Semaphore(max(max_workers, 1))
+
+        async def _generate(i: int) -> Tuple[int, List[Dict]]:
+            async with semaphore:
+                return i, await self._agenerate_cmap_for_section(indexes[i], sections[i], section_max_num_concepts, section_max_num_relationships,
+                                                                 section_mode, fused_summary)
+
+        logger.info("[Paper2CMap] Generating concept maps by section")
+        cmap_list = [None] * len(sections)
+        partial_cmap = ConceptMap()
+        tasks = [asyncio.ensure_future(_generate(i)) for i in range(len(sections))]
+        try:
+            for task in asyncio.as_completed(tasks):
+                i, cmap_list[i] = await task
+                yield self._section_event(indexes[i], len(sections), cmap_list[i], partial_cmap, max_num_concepts, max_num_relationships)
+        finally:
+            # stop the remaining sections if the consumer goes away early
+            for task in tasks:
+                task.cancel()
+            self._release_sections(sections)
+
+        logger.info("[Paper2CMap] Merging and pruning concept maps")
+        cmap = await self._amerge_and_prune_cmaps(self._usable_cmaps(cmap_list), max_num_concepts, max_num_relationships,
+                                                  merge_mode, merge_token_budget, max_workers, cluster_threshold)
+
+        logger.info("[Paper2CMap] Fianl concept map: %s", cmap)
+        logger.info("[Paper2CMap] Token usage by stage: %s", self.chat_client.token_usage)
+        yield {"type": "final", "cmap": cmap}
+
+    def index_cmap(self, index: ConceptIndex, cmap: List) -> int:
+        """
+        Persist a concept map of the loaded paper in an index, mapping its concepts and relationships to the
+        sections and character spans they come from, so that questions can later be answered with `answer`.
+
+        :param index: The index, shared by all the papers of a corpus.
+        :param cmap: The concept map of the loaded paper, e.g. returned by `generate_cmap`.
+        :return: The id of the paper in the index.
+        """
+        if not self._loaded:
+            logger.error("[Paper2CMap] Please load a PDF file first.")
+            raise Exception("Please load a PDF file first.")
+        return index.add(self.pdf_path, self.paper_reader.sections, cmap, key=self._paper_key())
+
+    def _paper_key(self) -> str:
+        # the content hash of the loaded PDF file, computed once, and only if the checkpoint has not already done it
+        if self._pdf_hash is None:
+            self._pdf_hash = self.checkpoint.paper_hash if self.checkpoint is not None else hash_file(self.pdf_path)
+        return self._pdf_hash
+
+    def _retrieve(self, question: str, index: ConceptIndex, k: int, all_papers: bool) -> Tuple[List[Dict], List[List[str]]]:
+        paper_id = None
+        if not all_papers:
+            if not self._loaded:
+                logger.error("[Paper2CMap] Please load a PDF file first.")
+                raise Exception("Please load a PDF file first.")
+            paper_id = index.paper_id(self._paper_key())
+            if paper_id is None:
+                raise ValueError(f"{self.pdf_path} is not indexed, call index_cmap first")
+        passages, relationships = index.retrieve(question, k=k, paper_id=paper_id)
+        triples = list(dict.fromkeys(
+            (relationship["source"], relationship["relationship"], relationship["target"]) for relationship in relationships
+        ))
+        logger.info("[Paper2CMap] Answering from %s passages and %s relationships", len(passages), len(triples))
+        return passages, [list(triple) for triple in triples]
+
+    def answer(self, question: str, index: ConceptIndex, k: int = 4, all_papers: bool = False) -> Dict:
+        """
+        Answer a question about the loaded paper from the few passages of the index most relevant to it,
+        instead of sending the whole paper to the LLM.
+
+        :param question: The question.
+        :param index: The index holding the paper, see `index_cmap`.
+        :param k: The maximum number of passages sent to the LLM. Default: 4.
+        :param all_papers: Whether the passages may come from any paper of the index, not only the loaded one. Default: False.
+        :return: {"answer", "passages", "relationships"}, where "passages" are the passages cited by number in the answer.
+        """
+        passages, relationships = self._retrieve(question, index, k, all_papers)
+        answer = self.cmap_gpt.answer(question, [passage["text"] for passage in passages], relationships)
+        return {"answer": answer, "passages": passages, "relationships": relationships}
+
+    async def aanswer(self, question: str, index: ConceptIndex, k: int = 4, all_papers: bool = False) -> Dict:
+        """
+        Asynchronous version of `answer`.
+
+        :param question: The question.
+        :param index: The index holding the paper, see `index_cmap`.
+        :param k: The maximum number of passages sent to the LLM. Default: 4.
+        :param all_papers: Whether the passages may come from any paper of the index, not only the loaded one. Default: False.
+        :return: {"answer", "passages", "relationships"}, where "passages" are the passages cited by number in the answer.
+        """
+        passages, relationships = self._retrieve(question, index, k, all_papers)
+        answer = await self.cmap_gpt.aanswer(question, [passage["text"] for passage in passages], relationships)
+        return {"answer": answer, "passages": passages, "relationships": relationships}
@@ -1,25 +1,43 @@
 from __future__ import annotations
 
-import json
-import re
-from typing import List
+import asyncio
+from typing import TYPE_CHECKING, List, Tuple
 
-from pdfminer.high_level import extract_pages
-from pdfminer.layout import LTTextContainer
-from PyPDF2 import PdfReader
+from paper2cmap import logger, metrics, ChatClient
+from paper2cmap.catelogue import catelogue_from_outline, detect_catelogue
+from paper2cmap.output_parser import parse_titles
+from paper2cmap.text_store import TextRanges, TextStore
+from paper2cmap.title_matcher import TitleMatcher
 
-from langchain.chat_models import AzureChatOpenAI, ChatOpenAI
-from langchain.schema import (
-    HumanMessage,
-    SystemMessage
-)
-
-from paper2cmap import logger
+if TYPE_CHECKING:
+    from langchain.chat_models import AzureChatOpenAI, ChatOpenAI
+    from langchain.schema import BaseMessage
 
 
 class PaperReader():
-    def __init__(self, chatbot: ChatOpenAI | AzureChatOpenAI) -> None:
+    _CATELOGUE_MODES = ("auto", "local", "llm")
+
+    def __init__(self, chatbot: ChatOpenAI | AzureChatOpenAI | ChatClient, catelogue_mode: str = "auto",
+                 low_memory: bool = False, spill_dir: str | None = None) -> None:
+        """
+        :param chatbot: The chat model, or a ChatClient.
+        :param catelogue_mode: How the section titles are found. "auto" reads the PDF outline, then the layout features
+                               of the text, and only asks the LLM when neither is confident; "local" never asks the LLM;
+                               "llm" always asks the LLM. Default: "auto".
+        :param low_memory: Whether the text is streamed page by page into a TextStore spilled to disk. `full_text` is
+                           then the TextStore, and `pages` and `sections` are TextRanges, whose texts are only read back
+                           when indexed, so memory stays flat whatever the size of the document. Default: False.
+        :param spill_dir: The directory of the TextStore files in low memory mode. If None, the default temporary
+                          directory. Default: None.
+        """
+        if catelogue_mode not in self._CATELOGUE_MODES:
+            raise ValueError(f"catelogue_mode must be one of {self._CATELOGUE_MODES}, but got {catelogue_mode!r}")
+
         self.chatbot = chatbot
+        self.chat_client = chatbot if isinstance(chatbot, ChatClient) else ChatClient(chatbot)
+        self.catelogue_mode = catelogue_mode
+        self.low_memory = low_memory
+        self.spill_dir = spill_dir
 
         self._title_max_len = 50
         self._title_min_len = 5
@@ -34,66 +52,162 @@ You must return me in this json format:
 If the title has a number, the number MUST be retained!!!!
         """
 
-    def _extract_candidate_catelogue(self, paper_path: str) -> List[str]:
-        cand_cate = []
-        for page_layout in extract_pages(paper_path):
-            for element in page_layout:
-                if isinstance(element, LTTextContainer):
-                    title = element.get_text()
-                    if len(title) <= self._title_max_len and len(title) > self._title_min_len:
-                        cand_cate.append(title)
+    def _parse(self, paper_path: str, num_workers: int = 1,
+               parsed: Tuple[List[str], List[Tuple[str, float, bool]]] | None = None) -> List[Tuple[str, float, bool]]:
+        """
+        Parse the paper once, keeping the page texts and returning the candidate catelogue.
+        """
+        if self.low_memory:
+            return self._parse_to_store(paper_path, num_workers, parsed)
+
+        if parsed is None:
+            # pdfminer is only imported when a paper is parsed
+            from paper2cmap.pdf_parser import parse_pdf
+
+            with metrics.span("parse", path=paper_path):
+                parsed = parse_pdf(
+                    paper_path,
+                    title_min_len=self._title_min_len,
+                    title_max_len=self._title_max_len,
+                    num_workers=num_workers
+                )
+        self.pages, cand_cate = parsed
+        self.full_text = "".join(self.pages)
+        logger.info("[PaperReader] Full Text Size: %s", len(self.full_text))
+
+        logger.debug("[PaperReader] Extracted candidate catelogue: %s", cand_cate)
+        return cand_cate
 
-        logger.debug(f"[PaperReader] Extracted candidate catelogue: {cand_cate}")
+    def _parse_to_store(self, paper_path: str, num_workers: int = 1,
+                        parsed: Tuple[List[str], List[Tuple[str, float, bool]]] | None = None) -> List[Tuple[str, float, bool]]:
+        """
+        Low memory version of `_parse`: every page is appended to a TextStore as soon as it is parsed.
+        """
+        store = TextStore(self.spill_dir)
+        page_ranges = []
+        with metrics.span("parse", path=paper_path, low_memory=True):
+            if parsed is not None:
+                pages, cand_cate = parsed
+                parsed_pages = ((text, []) for text in pages)
+            else:
+                from paper2cmap.pdf_parser import iter_pdf
+
+                cand_cate = []
+                parsed_pages = iter_pdf(
+                    paper_path,
+                    title_min_len=self._title_min_len,
+                    title_max_len=self._title_max_len,
+                    num_workers=num_workers
+                )
+            for text, titles in parsed_pages:
+                page_ranges.append(store.append(text))
+                cand_cate.extend(titles)
+
+        self.pages = TextRanges(store, page_ranges)
+        self.full_text = store
+        logger.info("[PaperReader] Full Text Size: %s (spilled to disk)", len(self.full_text))
+
+        logger.debug("[PaperReader] Extracted candidate catelogue: %s", cand_cate)
         return cand_cate
 
-    def _extract_catelogue_with_LLM(self, cand_cate: List[str]) -> List[str]:
-        messages = [
-            SystemMessage(content=self._catelogue_system_prompt),
-            HumanMessage(content=f"These are the texts: {cand_cate}")
-        ]
-        response = self.chatbot(messages).content
-        logger.debug(f"[PaperReader] Raw response from LLM: {response}")
+    def _detect_catelogue(self, paper_path: str, cand_cate: List[Tuple[str, float, bool]]) -> Tuple[List[str] | None, List[str]]:
+        """
+        Find the catelogue without the LLM, from the PDF outline or the layout features of the candidates.
+
+        :return: The catelogue, or None if the LLM should be asked, and the candidates to send to the LLM.
+        """
+        if self.catelogue_mode == "llm":
+            return None, [text for text, _, _ in cand_cate]
 
-        return json.loads(response)["titles"]
+        from paper2cmap.pdf_parser import extract_outline
 
-    def _extract_catelogue(self, paper_path: str) -> List[str]:
-        cand_cate = self._extract_candidate_catelogue(paper_path)
-        return self._extract_catelogue_with_LLM(cand_cate)
+        catelogue = catelogue_from_outline(extract_outline(paper_path), self.full_text)
+        if catelogue is not None:
+            logger.info("[PaperReader] Catelogue found in the PDF outline")
+            return catelogue, []
 
-    def _split_text_by_catelogue(self, full_text: str, catelogue: List[str]) -> List[str]:
+        titles, confident, candidates = detect_catelogue(cand_cate)
+        if confident or self.catelogue_mode == "local":
+            logger.info("[PaperReader] Catelogue detected from the layout (confident: %s)", confident)
+            return titles, []
 
-        def _find_all(text: str, token: str) -> List[int]:
-            pattern = re.compile(re.escape(token))
-            positions = [m.start() for m in re.finditer(pattern, text)]
-            return positions
+        logger.info("[PaperReader] Asking the LLM to pick the catelogue from %s of %s candidates", len(candidates), len(cand_cate))
+        return None, candidates or [text for text, _, _ in cand_cate]
 
-        split_pos_list = []
-        for title in catelogue:
-            split_pos_list.extend(_find_all(full_text, title))
-        split_pos_list = sorted(split_pos_list)
-        logger.debug(f"[PaperReader] Text split positions: {split_pos_list}")
-        
-        sections = []
-        for i in range(len(split_pos_list) - 1):
-            sections.append(full_text[split_pos_list[i]:split_pos_list[i+1]].strip())
-        sections.append(full_text[split_pos_list[-1]:].strip())
+    def _catelogue_messages(self, cand_cate: List[str]) -> List[BaseMessage]:
+        from langchain.schema import HumanMessage, SystemMessage
 
-        return sections
+        return [
+            SystemMessage(content=self._catelogue_system_prompt),
+            HumanMessage(content=f"These are the texts: {cand_cate}")
+        ]
 
-    def load(self, paper_path: str) -> None:
+    def _extract_catelogue_with_LLM(self, cand_cate: List[str]) -> List[str]:
+        # an unusable output raises rather than leaving the paper in a single section
+        catelogue = self.chat_client.chat(self._catelogue_messages(cand_cate), tag="catelogue", parse=parse_titles)
+        logger.debug("[PaperReader] Catelogue from LLM: %s", catelogue)
+        return catelogue
+
+    async def _aextract_catelogue_with_LLM(self, cand_cate: List[str]) -> List[str]:
+        catelogue = await self.chat_client.achat(self._catelogue_messages(cand_cate), tag="catelogue", parse=parse_titles)
+        logger.debug("[PaperReader] Catelogue from LLM: %s", catelogue)
+        return catelogue
+
+    def _split_text_by_catelogue(self, full_text: str | TextStore, catelogue: List[str]) -> List[str] | TextRanges:
+        split_pos_list = [offset for offset, _ in TitleMatcher(catelogue).match(full_text)]
+        logger.debug("[PaperReader] Text split positions: %s", split_pos_list)
+        if not split_pos_list:
+            split_pos_list = [0]
+
+        ranges = [(split_pos_list[i], split_pos_list[i+1]) for i in range(len(split_pos_list) - 1)]
+        ranges.append((split_pos_list[-1], len(full_text)))
+
+        # in low memory mode, sections stay offset ranges until they are sent to the LLM
+        if isinstance(full_text, TextStore):
+            return TextRanges(full_text, ranges, strip=True)
+        return [full_text[start:end].strip() for start, end in ranges]
+
+    def load(self, paper_path: str, num_workers: int = 1, catelogue: List[str] | None = None,
+             parsed: Tuple[List[str], List[Tuple[str, float, bool]]] | None = None) -> None:
         """
         Load the paper and extract the catelogue and sections
 
         :param paper_path: The path of the paper
+        :param num_workers: The number of processes used to parse the pages. Default: 1.
+        :param catelogue: A known catelogue of the paper, e.g. from a checkpoint. If given, the catelogue is not detected again. Default: None.
+        :param parsed: The output of `pdf_parser.parse_pdf` for the paper, e.g. computed in another process. If given, the paper is not parsed again. Default: None.
         """
-        self.paper = PdfReader(paper_path)
-        self.full_text = ""
-        for page in self.paper.pages:
-            self.full_text += page.extract_text()
-        logger.info(f"[PaperReader] Full Text Size: {len(self.full_text)}")
+        cand_cate = self._parse(paper_path, num_workers, parsed)
+
+        with metrics.span("catelogue", path=paper_path, given=catelogue is not None):
+            if catelogue is None:
+                catelogue, cand_cate = self._detect_catelogue(paper_path, cand_cate)
+            self.catelogue = catelogue if catelogue is not None else self._extract_catelogue_with_LLM(cand_cate)
+        logger.info("[PaperReader] Catelogue: %s", self.catelogue)
+
+        with metrics.span("split", path=paper_path):
+            self.sections = self._split_text_by_catelogue(self.full_text, self.catelogue)
+        logger.info("[PaperReader] Sections Count: %s", len(self.sections))
 
-        self.catelogue = self._extract_catelogue(paper_path)
-        logger.info(f"[PaperReader] Catelogue: {self.catelogue}")
+    async def aload(self, paper_path: str, num_workers: int = 1, catelogue: List[str] | None = None,
+                    parsed: Tuple[List[str], List[Tuple[str, float, bool]]] | None = None) -> None:
+        """
+        Asynchronous version of `load`. PDF parsing runs in the default executor so the event loop is never blocked.
 
-        self.sections = self._split_text_by_catelogue(self.full_text, self.catelogue)
-        logger.info(f"[PaperReader] Sections Count: {len(self.sections)}")
\ No newline at end of file
+        :param paper_path: The path of the paper
+        :param num_workers: The number of processes used to parse the pages. Default: 1.
+        :param catelogue: A known catelogue of the paper, e.g. from a checkpoint. If given, the catelogue is not detected again. Default: None.
+        :param parsed: The output of `pdf_parser.parse_pdf` for the paper, e.g. computed in another process. If given, the paper is not parsed again. Default: None.
+        """
+        loop = asyncio.get_running_loop()
+        cand_cate = await loop.run_in_executor(None, self._parse, paper_path, num_workers, parsed)
+
+        with metrics.span("catelogue", path=paper_path, given=catelogue is not None):
+            if catelogue is None:
+                catelogue, cand_cate = await loop.run_in_executor(None, self._detect_catelogue, paper_path, cand_cate)
+            self.catelogue = catelogue if catelogue is not None else await self._aextract_catelogue_with_LLM(cand_cate)
+        logger.info("[PaperReader] Catelogue: %s", self.catelogue)
+
+        with metrics.span("split", path=paper_path):
+            self.sections = self._split_text_by_catelogue(self.full_text, self.catelogue)
+        logger.info("[PaperReader] Sections Count: %s", len(self.sections))
@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List, Tuple
+
+from pdfminer.high_level import extract_pages
+from pdfminer.layout import LTChar, LTTextContainer
+from pdfminer.pdfdocument import PDFDocument, PDFNoOutlines
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfparser import PDFParser
+
+# e.g. "NimbusRomNo9L-Medi", "Arial,Bold", "LinLibertineTB" or "CMBX10"
+_BOLD_FONT = re.compile(r"bold|black|heavy|demi|medi|cmbx|(?<=[a-z])T?B$", re.IGNORECASE)
+# e.g. "3.2", "3.2." or "IV.", set in a text box of its own left of the title it numbers
+_SECTION_NUMBER = re.compile(r"^(?:\d+(?:\.\d+)*\.?|[IVX]+\.|[A-H]\.?)$")
+
+
+def count_pages(paper_path: str) -> int:
+    """
+    Count the pages of a PDF file without running the layout analysis.
+
+    :param paper_path: The path of the PDF file.
+    :return: The number of pages.
+    """
+    with open(paper_path, "rb") as f:
+        return sum(1 for _ in PDFPage.get_pages(f))
+
+
+def extract_outline(paper_path: str) -> List[Tuple[int, str]]:
+    """
+    Read the outline (bookmarks) embedded in a PDF file, without running the layout analysis.
+
+    :param paper_path: The path of the PDF file.
+    :return: The (level, title) pairs of the outline, in document order. Empty if the PDF file has no outline.
+    """
+    with open(paper_path, "rb") as f:
+        try:
+            return [(level, title) for level, title, *_ in PDFDocument(PDFParser(f)).get_outlines()
+                    if isinstance(title, str) and title.strip()]
+        except PDFNoOutlines:
+            return []
+
+
+def _iter_chars(element) -> Iterator[LTChar]:
+    for child in element:
+        if isinstance(child, LTChar):
+            yield child
+        elif isinstance(child, LTTextContainer):
+            yield from _iter_chars(child)
+
+
+def _font_features(element: LTTextContainer) -> Tuple[float, bool]:
+    """
+    The most common font size of the characters of a text box, and whether most of them are bold.
+    """
+    sizes = Counter()
+    num_bold = 0
+    for char in _iter_chars(element):
+        if not char.get_text().isspace():
+            sizes[round(char.size, 1)] += 1
+            num_bold += bool(_BOLD_FONT.search(char.fontname))
+    if not sizes:
+        return 0.0, False
+    return sizes.most_common(1)[0][0], num_bold * 2 > sum(sizes.values())
+
+
+def _line_sizes(element: LTTextContainer) -> Iterator[Tuple[float, int]]:
+    # the size of the first character of every line, weighted by the line length, is enough to find the body font size
+    for line in element:
+        if isinstance(line, LTTextContainer):
+            char = next(_iter_chars(line), None)
+            if char is not None:
+                yield round(char.size, 1), len(line.get_text())
+
+
+def _section_number(bbox: Tuple[float, float, float, float],
+                    numbers: List[Tuple[str, Tuple[float, float, float, float]]]) -> str | None:
+    """
+    The section number set apart on the same line as a title box and just left of it, e.g. "1" before "Introduction".
+    """
+    x0, _, _, y1 = bbox
+    for number, (nx0, ny0, nx1, ny1) in numbers:
+        height = ny1 - ny0
+        if abs(ny1 - y1) <= height / 2 and 0 <= x0 - nx1 <= 2 * height:
+            return number
+    return None
+
+
+def _reading_order(elements: List[LTTextContainer], width: float, min_len: int) -> List[LTTextContainer]:
+    """
+    Sort the text boxes of a page top to bottom, the left column before the right one on a two-column page.
+    The layout analysis alone can put a title of the right column before the left column.
+    A page has two columns if boxes longer than {min_len} characters lie on both sides of its middle.
+    """
+    middle = width / 2
+    paragraphs = [element for element in elements if len(element.get_text()) > min_len]
+    two_columns = (any(element.x1 <= middle for element in paragraphs)
+                   and any(element.x0 >= middle for element in paragraphs))
+    return sorted(elements, key=lambda element: (two_columns and element.x0 >= middle, -element.y1))
+
+
+def iter_pages(paper_path: str, page_numbers: Iterable[int] | None = None,
+               title_min_len: int = 5, title_max_len: int = 50) -> Iterator[Tuple[str, List[Tuple[str, float, bool]]]]:
+    """
+    Run the layout analysis once per page and yield both the page text and the section title candidates.
+    Every candidate comes with its font size relative to the body text of the page, and whether it is bold.
+
+    :param paper_path: The path of the PDF file.
+    :param page_numbers: The zero-based page numbers to parse. If None, all pages are parsed.
+    :param title_min_len: Text boxes not longer than this are not title candidates.
+    :param title_max_len: Text boxes longer than this are not title candidates.
+    :return: An iterator of (page text, [(candidate text, relative font size, bold), ...]) pairs, in page order.
+    """
+    for page_layout in extract_pages(paper_path, page_numbers=page_numbers):
+        texts = []
+        candidates = []
+        numbers = []
+        body_sizes = Counter()
+        elements = [element for element in page_layout if isinstance(element, LTTextContainer)]
+        for element in _reading_order(elements, page_layout.width, title_max_len):
+            text = element.get_text()
+            texts.append(text)
+            if len(text) <= title_max_len and len(text) > title_min_len:
+                candidates.append((text, element.bbox, *_font_features(element)))
+            else:
+                if _SECTION_NUMBER.match(text.strip()):
+                    numbers.append((text.strip(), element.bbox))
+                for size, length in _line_sizes(element):
+                    body_sizes[size] += length
+
+        body_size = body_sizes.most_common(1)[0][0] if body_sizes else 0.0
+        cand_cate = []
+        for text, bbox, size, bold in candidates:
+            number = _section_number(bbox, numbers)
+            if number is not None:
+                text = f"{number} {text}"
+            cand_cate.append((text, round(size / body_size, 2) if body_size else 1.0, bold))
+        yield "".join(texts), cand_cate
+
+
+def _parse_page_range(args: Tuple[str, List[int], int, int]) -> List[Tuple[str, List[Tuple[str, float, bool]]]]:
+    paper_path, page_numbers, title_min_len, title_max_len = args
+    return list(iter_pages(paper_path, page_numbers, title_min_len, title_max_len))
+
+
+def iter_pdf(paper_path: str, title_min_len: int = 5, title_max_len: int = 50,
+             num_workers: int = 1) -> Iterator[Tuple[str, List[Tuple[str, float, bool]]]]:
+    """
+    Parse a PDF file in a single pass, optionally spreading the pages across a process pool, and yield the pages
+    in order as soon as they are parsed, so that the caller never needs to hold the whole document.
+
+    :param paper_path: The path of the PDF file.
+    :param title_min_len: Text boxes not longer than this are not title candidates.
+    :param title_max_len: Text boxes longer than this are not title candidates.
+    :param num_workers: The number of worker processes. If set to 1, pages are parsed in the current process.
+    :return: An iterator of (page text, [(candidate text, relative font size, bold), ...]) pairs, in page order.
+    """
+    if num_workers <= 1:
+        yield from iter_pages(paper_path, None, title_min_len, title_max_len)
+        return
+
+    num_pages = count_pages(paper_path)
+    # a few page ranges per worker keeps the pool busy when some pages are heavier than others
+    num_ranges = min(num_pages, num_workers * 4) or 1
+    page_ranges = [
+        list(range(num_pages * i // num_ranges, num_pages * (i + 1) // num_ranges))
+        for i in range(num_ranges)
+    ]
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for parsed_range in executor.map(
+            _parse_page_range,
+            [(paper_path, page_range, title_min_len, title_max_len) for page_range in page_ranges]
+        ):
+            yield from parsed_range
+
+
+def parse_pdf(paper_path: str, title_min_len: int = 5, title_max_len: int = 50,
+              num_workers: int = 1) -> Tuple[List[str], List[Tuple[str, float, bool]]]:
+    """
+    Parse a PDF file in a single pass, optionally spreading the pages across a process pool.
+
+    :param paper_path: The path of the PDF file.
+    :param title_min_len: Text boxes not longer than this are not title candidates.
+    :param title_max_len: Text boxes longer than this are not title candidates.
+    :param num_workers: The number of worker processes. If set to 1, pages are parsed in the current process.
+    :return: The text of every page, and the (text, relative font size, bold) section title candidates of the whole document.
+    """
+    parsed_pages = list(iter_pdf(paper_path, title_min_len, title_max_len, num_workers))
+
+    pages = [text for text, _ in parsed_pages]
+    cand_cate = [title for _, titles in parsed_pages for title in titles]
+    return pages, cand_cate
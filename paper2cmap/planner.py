@@ -0,0 +1,311 @@
+from __future__ import annotations
+
+import re
+from typing import Dict, Iterable, List, Tuple
+
+from paper2cmap import logger
+from paper2cmap.utils import estimate_tokens
+
+# the leading number of a section title, e.g. "3.2", "3.2.", "IV." or "A."
+_NUMBERING = re.compile(r"^\s*(?:(\d+(?:\.\d+)*)\.?|([IVX]+)\.|([A-H])(?:\.\d+)*\.?)(?=\s|$)\s*")
+_SECTION_TYPES: List[Tuple[str, re.Pattern]] = [
+    ("references", re.compile(r"^(references|bibliography|works cited)\b")),
+    ("acknowledgments", re.compile(r"^acknowledge?ments?\b")),
+    ("appendix", re.compile(r"^(appendix|appendices|supplementary)\b")),
+    ("abstract", re.compile(r"^abstract\b")),
+    ("introduction", re.compile(r"^introduction\b")),
+    ("related_work", re.compile(r"\b(related work|prior work|literature)\b")),
+    ("background", re.compile(r"\b(background|preliminar)")),
+    ("conclusion", re.compile(r"\b(conclusions?|concluding|summary)\b")),
+    ("discussion", re.compile(r"\b(discussion|limitations?|future work|open (?:challenges|problems|questions))\b")),
+    ("results", re.compile(r"\b(results?|ablations?|analysis|variations?|effects? of|impact of)\b")),
+    # "pre-training" and "fine-tuning" name a method, not the training setup of the experiments
+    ("experiments", re.compile(r"\b(experiments?|experimental|evaluation|setup|(?<!-)training|datasets?|implementation)\b")),
+    ("method", re.compile(r"\b(method|methods|methodology|approach|model|architecture|framework|algorithm)\b")),
+]
+# a reference list entry, e.g. "[12] A. Vaswani, ...", "Vaswani et al. 2017" or "In Proceedings of ..."
+_CITATION = re.compile(r"^\s*\[\d+\]|\bet al\.|\bIn Proceedings\b|\barXiv\b|\b(?:19|20)\d\d[a-z]?\b")
+_REFERENCES_HEADING = re.compile(r"^\s*(references|bibliography)\s*$", re.IGNORECASE | re.MULTILINE)
+_WORDS = re.compile(r"[A-Za-z][A-Za-z-]+")
+_STOPWORDS = {
+    "also", "been", "both", "each", "from", "have", "into", "more", "most", "only", "other", "over", "such", "than",
+    "that", "their", "them", "then", "there", "these", "they", "this", "those", "through", "very", "were", "what",
+    "when", "where", "which", "while", "with", "would",
+}
+
+# the types of the sections surrounding the contribution of a paper, see `_resolve_types`
+_BEFORE_METHOD = {"introduction", "background", "related_work"}
+_AFTER_METHOD = {"experiments", "results", "discussion", "conclusion"}
+# the types a subsection keeps whatever its parent is, so that e.g. a trailing reference list is still dropped
+_OWN_TYPES = {"references", "acknowledgments", "appendix"}
+
+DEFAULT_TYPE_WEIGHTS = {
+    "abstract": 0.6,
+    "introduction": 1.0,
+    "related_work": 0.5,
+    "background": 0.8,
+    "method": 1.2,
+    "experiments": 0.9,
+    "results": 1.0,
+    "discussion": 0.9,
+    "conclusion": 1.0,
+    "other": 1.0,
+    "references": 0.0,
+    "acknowledgments": 0.0,
+    "appendix": 0.0,
+}
+
+
+def _citation_share(text: str) -> float:
+    lines = [line for line in text.splitlines() if line.strip()]
+    return sum(bool(_CITATION.search(line)) for line in lines) / len(lines) if lines else 0.0
+
+
+def _split_title(text: str) -> Tuple[str | None, str | None, str]:
+    # the title is the first line, or the first two lines when the number is alone on the first one
+    lines = text.lstrip().split("\n", 2)
+    title = lines[0]
+    if _NUMBERING.sub("", title).strip() == "" and len(lines) > 1:
+        title = f"{title} {lines[1]}"
+    numbering = _NUMBERING.match(title)
+    number, letter = (numbering.group(1) or numbering.group(2), numbering.group(3)) if numbering else (None, None)
+    return number, letter, _NUMBERING.sub("", title).strip().lower()
+
+
+def classify_section(text: str) -> str:
+    """
+    Guess the type of a section from its title, i.e. its first line, and from its content when it looks like a
+    reference list.
+
+    :param text: The text of the section, starting with its title.
+    :return: One of the keys of `DEFAULT_TYPE_WEIGHTS`.
+    """
+    _, letter, title = _split_title(text)
+    for section_type, pattern in _SECTION_TYPES:
+        if pattern.search(title):
+            return section_type
+    # lettered sections, e.g. "A.2 Proofs", are appendices
+    if letter is not None:
+        return "appendix"
+    if _citation_share(text) > 0.5:
+        return "references"
+    return "other"
+
+
+def _resolve_types(types: List[str], numbers: List[str | None]) -> List[str]:
+    """
+    Refine the types guessed from the titles alone with the structure of the paper: an unclassified top-level section
+    between the introduction and the experiments is the contribution of the paper, e.g. "3 BERT", and a subsection has
+    the type of its section, e.g. "5.2 Effect of Model Size" is part of "5 Ablation Studies".
+    """
+    types = list(types)
+    top_level = [i for i, number in enumerate(numbers) if number is not None and "." not in number]
+    starts = [i for i in top_level if types[i] in _BEFORE_METHOD]
+    ends = [i for i in top_level if types[i] in _AFTER_METHOD and (not starts or i > starts[0])]
+    if starts:
+        end = ends[0] if ends else len(types)
+        for i in top_level:
+            if starts[0] < i < end and types[i] == "other":
+                types[i] = "method"
+
+    parent_types = {numbers[i]: types[i] for i in top_level}
+    for i, number in enumerate(numbers):
+        if number is None or "." not in number or types[i] in _OWN_TYPES:
+            continue
+        parent_type = parent_types.get(number.split(".")[0], "other")
+        if parent_type != "other":
+            types[i] = parent_type
+    return types
+
+
+def trim_references(text: str, min_citation_share: float = 0.4) -> int:
+    """
+    Find where a reference list appended to the end of a section starts, e.g. when "References" is not in the catelogue.
+
+    :param text: The text of the section.
+    :param min_citation_share: The minimum share of lines looking like citations after the heading. Default: 0.4.
+    :return: The offset of the reference list, or the length of the text if there is none.
+    """
+    for match in _REFERENCES_HEADING.finditer(text):
+        if match.start() > 0 and _citation_share(text[match.end():]) >= min_citation_share:
+            return match.start()
+    return len(text)
+
+
+def content_words(text: str) -> Tuple[set, float]:
+    """
+    :param text: The text.
+    :return: The distinct content words of the text, and the share of its tokens that are words, which is low for
+             tables, equations and lists of numbers.
+    """
+    words = _WORDS.findall(text)
+    num_tokens = len(text.split())
+    vocabulary = {word.lower().rstrip("s") for word in words if len(word) > 3 and word.lower() not in _STOPWORDS}
+    return vocabulary, min(len(words) / num_tokens, 1.0) if num_tokens else 0.0
+
+
+class SectionPlanner():
+    def __init__(self,
+                 max_tokens: int | None = None,
+                 max_cost: float | None = None,
+                 max_seconds: float | None = None,
+                 prompt_price: float = 0.0015,
+                 completion_price: float = 0.002,
+                 call_latency: float = 1.0,
+                 seconds_per_token: float = 0.02,
+                 type_weights: Dict[str, float] | None = None,
+                 min_tokens: int = 40,
+                 min_gain: float = 5.0,
+                 priority_types: Iterable[str] = ("introduction", "conclusion"),
+                 ) -> None:
+        """
+        Pick the sections worth sending to the LLM before any call is made. Sections are scored locally: their type
+        (references, acknowledgments and appendices are dropped), how much of their text is prose rather than tables
+        or equations, and how many content words they add to the sections already picked, so that e.g. an abstract
+        repeating the introduction is worth little. Sections are then picked greedily by score per estimated token,
+        as long as the estimated tokens, cost and latency of the whole job, including the final merge, fit the budgets.
+        The sections of the {priority_types} are picked first, so that long method sections cannot crowd them out.
+
+        :param max_tokens: The budget of prompt and completion tokens. If None, not limited. Default: None.
+        :param max_cost: The budget of cost, priced with {prompt_price} and {completion_price}. If None, not limited. Default: None.
+        :param max_seconds: The budget of wall-clock seconds of the LLM calls. If None, not limited. Default: None.
+        :param prompt_price: The price of 1000 prompt tokens. Default: 0.0015.
+        :param completion_price: The price of 1000 completion tokens. Default: 0.002.
+        :param call_latency: The expected latency of a call in seconds, besides its completion. Default: 1.0.
+        :param seconds_per_token: The expected generation time of a completion token in seconds. Default: 0.02.
+        :param type_weights: The weight of every section type, see `classify_section`. Sections of weight 0 are dropped. Default: `DEFAULT_TYPE_WEIGHTS`.
+        :param min_tokens: Sections shorter than this, e.g. a title alone or a copyright notice, are dropped. Default: 40.
+        :param min_gain: Sections adding fewer new content words than this, once weighted, are dropped as redundant. Default: 5.0.
+        :param priority_types: The section types picked before the others, budgets permitting. Default: ("introduction", "conclusion").
+        """
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.max_seconds = max_seconds
+        self.prompt_price = prompt_price
+        self.completion_price = completion_price
+        self.call_latency = call_latency
+        self.seconds_per_token = seconds_per_token
+        self.type_weights = {**DEFAULT_TYPE_WEIGHTS, **(type_weights or {})}
+        self.min_tokens = min_tokens
+        self.min_gain = min_gain
+        self.priority_types = set(priority_types)
+
+    def estimate(self, tokens: int, section_mode: str = "two_pass", overheads: Dict[str, int] | None = None,
+                 max_num_relationships: int = 15) -> Dict[str, float]:
+        """
+        Estimate the LLM usage of one section.
+
+        :param tokens: The number of tokens of the section.
+        :param section_mode: "two_pass" or "fused", see `Paper2CMap.generate_cmap`. Default: "two_pass".
+        :param overheads: The prompt tokens of the instructions and examples of the "preprocess", "generate" and "fuse" prompts. Default: None.
+        :param max_num_relationships: The maximum number of relationships of the concept map of the section. Default: 15.
+        :return: The calls, prompt tokens, completion tokens and seconds of the section.
+        """
+        overheads = {"preprocess": 100, "generate": 530, "fuse": 570, **(overheads or {})}
+        # about 12 tokens per [source, relationship, target] triple
+        cmap_tokens = 12 * max_num_relationships
+        if section_mode == "fused":
+            calls, prompt_tokens, completion_tokens = 1, overheads["fuse"] + tokens, cmap_tokens
+        else:
+            summary_tokens = min(tokens, 150)
+            calls = 2
+            prompt_tokens = overheads["preprocess"] + tokens + overheads["generate"] + summary_tokens
+            completion_tokens = summary_tokens + cmap_tokens
+        # the concept map of the section also lengthens the merge prompt
+        prompt_tokens += cmap_tokens
+        seconds = calls * self.call_latency + completion_tokens * self.seconds_per_token
+        return {"calls": calls, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "seconds": seconds}
+
+    def _fits(self, used: Dict[str, float], cost: Dict[str, float], max_workers: int) -> bool:
+        prompt_tokens = used["prompt_tokens"] + cost["prompt_tokens"]
+        completion_tokens = used["completion_tokens"] + cost["completion_tokens"]
+        if self.max_tokens is not None and prompt_tokens + completion_tokens > self.max_tokens:
+            return False
+        if self.max_cost is not None and \
+                (prompt_tokens * self.prompt_price + completion_tokens * self.completion_price) / 1000 > self.max_cost:
+            return False
+        # sections run {max_workers} at a time, the merge after all of them
+        if self.max_seconds is not None and \
+                used["merge_seconds"] + (used["seconds"] + cost["seconds"]) / max(max_workers, 1) > self.max_seconds:
+            return False
+        return True
+
+    def plan(self, sections: Iterable[str], section_mode: str = "two_pass", max_workers: int = 1,
+             overheads: Dict[str, int] | None = None, max_num_relationships: int = 15,
+             merge_overhead: int = 420) -> List[Dict]:
+        """
+        Plan which sections to generate concept maps for.
+
+        :param sections: The texts of the sections, in document order. They are read one at a time.
+        :param section_mode: "two_pass" or "fused", see `Paper2CMap.generate_cmap`. Default: "two_pass".
+        :param max_workers: The number of sections processed concurrently, for the latency estimate. Default: 1.
+        :param overheads: The prompt tokens of the instructions and examples of the "preprocess", "generate" and "fuse" prompts. Default: None.
+        :param max_num_relationships: The maximum number of relationships of the concept map of a section. Default: 15.
+        :param merge_overhead: The prompt tokens of the instructions and examples of the merge prompt. Default: 420.
+        :return: For every section, {"index", "type", "tokens", "end", "prose", "gain", "calls", "prompt_tokens",
+                 "completion_tokens", "seconds", "selected", "reason"}, where "end" is the offset where the useful text
+                 of the section ends (before a trailing reference list), "gain" the weighted number of content words
+                 the section adds to the selection, and "reason" is "selected", "dropped_type", "boilerplate",
+                 "redundant" or "budget". If no section fits the budgets, the most informative one is still selected.
+        """
+        entries, vocabularies, numbers = [], [], []
+        for index, section in enumerate(sections):
+            end = trim_references(section)
+            text = section[:end]
+            tokens = estimate_tokens(text)
+            vocabulary, prose = content_words(text)
+            entries.append({"index": index, "type": classify_section(section), "tokens": tokens, "end": end,
+                            "prose": round(prose, 2), "gain": 0.0, "selected": False, "reason": "budget",
+                            **self.estimate(tokens, section_mode, overheads, max_num_relationships)})
+            vocabularies.append(vocabulary)
+            numbers.append(_split_title(section)[0])
+
+        for entry, section_type in zip(entries, _resolve_types([entry["type"] for entry in entries], numbers)):
+            entry["type"] = section_type
+            if self.type_weights.get(section_type, 1.0) <= 0:
+                entry["reason"] = "dropped_type"
+            elif entry["tokens"] < self.min_tokens:
+                entry["reason"] = "boilerplate"
+
+        # the final merge is paid whatever the selection
+        cmap_tokens = 12 * max_num_relationships * 2
+        used = {"prompt_tokens": merge_overhead, "completion_tokens": cmap_tokens, "seconds": 0.0,
+                "merge_seconds": self.call_latency + cmap_tokens * self.seconds_per_token}
+        covered: set = set()
+        candidates = [entry for entry in entries if entry["reason"] == "budget"]
+        while candidates:
+            # the gains shrink as words get covered, so they are computed again after every pick
+            for entry in candidates:
+                new_words = len(vocabularies[entry["index"]] - covered)
+                entry["gain"] = round(self.type_weights.get(entry["type"], 1.0) * entry["prose"] * new_words, 1)
+            redundant = [entry for entry in candidates if entry["gain"] < self.min_gain]
+            for entry in redundant:
+                entry["reason"] = "redundant"
+            candidates = [entry for entry in candidates if entry["gain"] >= self.min_gain and self._fits(used, entry, max_workers)]
+            if not candidates:
+                break
+            best = max(candidates, key=lambda entry: (entry["type"] in self.priority_types,
+                                                      entry["gain"] / (entry["prompt_tokens"] + entry["completion_tokens"])))
+            best["selected"], best["reason"] = True, "selected"
+            for key in ("prompt_tokens", "completion_tokens", "seconds"):
+                used[key] += best[key]
+            covered |= vocabularies[best["index"]]
+            candidates.remove(best)
+
+        selected = [entry for entry in entries if entry["selected"]]
+        eligible = [entry for entry in entries if entry["reason"] in ("budget", "redundant")]
+        if not selected and eligible:
+            # a concept map of the most informative section is still better than none
+            best = max(eligible, key=lambda entry: entry["gain"])
+            best["selected"], best["reason"] = True, "selected"
+            for key in ("prompt_tokens", "completion_tokens", "seconds"):
+                used[key] += best[key]
+            selected = [best]
+            logger.warning("[SectionPlanner] No section fits the budgets, keeping section %s only", best["index"])
+        logger.info(
+            "[SectionPlanner] Selected %s of %s sections, estimated %s calls, %s tokens",
+            len(selected), len(entries), sum(entry["calls"] for entry in selected) + 1,
+            int(used["prompt_tokens"] + used["completion_tokens"])
+        )
+        logger.debug("[SectionPlanner] Plan: %s", [(entry["index"], entry["type"], entry["reason"], entry["gain"]) for entry in entries])
+        return entries
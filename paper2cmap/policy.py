@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable
+
+from paper2cmap import logger, metrics
+
+# errors of a struggling backend rather than of a bad request, by class name so that both the 0.x and 1.x openai packages are covered
+THROTTLED_ERRORS = {"RateLimitError"}
+TRANSIENT_ERRORS = {
+    "Timeout", "APITimeoutError", "TimeoutError", "APIError", "APIConnectionError",
+    "ServiceUnavailableError", "InternalServerError", "TryAgain", "CircuitOpenError",
+}
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    Whether an error is worth retrying later or elsewhere, e.g. a throttled, overloaded or unreachable backend.
+
+    :param error: The error.
+    :return: Whether the error is transient.
+    """
+    return type(error).__name__ in THROTTLED_ERRORS | TRANSIENT_ERRORS
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class LatencyPolicy():
+    def __init__(self,
+                 hedge_percentile: float | None = 0.95,
+                 timeout_percentile: float | None = 0.99,
+                 timeout_multiplier: float = 3.0,
+                 min_timeout: float = 10.0,
+                 max_timeout: float = 120.0,
+                 max_attempts: int = 2,
+                 failure_threshold: int | None = 5,
+                 reset_timeout: float = 30.0,
+                 window_size: int = 200,
+                 min_samples: int = 10,
+                 max_concurrency: int = 64,
+                 ) -> None:
+        """
+        A tail-latency policy for LLM calls.
+        - Hedging: a call still running after the {hedge_percentile} of the observed latencies is duplicated,
+          and whichever copy returns first wins; the other one is cancelled.
+        - Adaptive timeout: a call is abandoned after {timeout_multiplier} times the {timeout_percentile} of the observed
+          latencies, within [{min_timeout}, {max_timeout}], and tried again up to {max_attempts} times in total.
+        - Circuit breaking: after {failure_threshold} consecutive failures, calls fail fast with CircuitOpenError
+          for {reset_timeout} seconds, then a single trial call decides whether to close the circuit again.
+
+        Latencies are only trusted once {min_samples} calls have succeeded; before that, calls are not hedged
+        and time out after {max_timeout}.
+
+        :param hedge_percentile: The latency percentile after which a call is hedged. If None, calls are not hedged. Default: 0.95.
+        :param timeout_percentile: The latency percentile the timeout is based on. If None, calls time out after {max_timeout}. Default: 0.99.
+        :param timeout_multiplier: The multiple of the percentile latency after which a call times out. Default: 3.0.
+        :param min_timeout: The minimum timeout in seconds. Default: 10.0.
+        :param max_timeout: The maximum timeout in seconds. Default: 120.0.
+        :param max_attempts: The maximum number of attempts of a call that timed out. Default: 2.
+        :param failure_threshold: The number of consecutive failures opening the circuit. If None, the circuit never opens. Default: 5.
+        :param reset_timeout: The number of seconds the circuit stays open. Default: 30.0.
+        :param window_size: The number of recent latencies the percentiles are computed on. Default: 200.
+        :param min_samples: The number of latencies needed before hedging and adapting the timeout. Default: 10.
+        :param max_concurrency: The maximum number of concurrent synchronous calls, including hedges. Default: 64.
+        """
+        self.hedge_percentile = hedge_percentile
+        self.timeout_percentile = timeout_percentile
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.max_attempts = max_attempts
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.min_samples = min_samples
+        self.max_concurrency = max_concurrency
+
+        self._latencies: deque = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+
+        self._consecutive_failures = 0
+        self._opened_at: float | None = None
+        self._probing = False
+
+        self._executor: ThreadPoolExecutor | None = None
+
+        self.num_hedges = 0
+        self.num_hedge_wins = 0
+        self.num_timeouts = 0
+
+    def _percentile(self, percentile: float) -> float | None:
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(percentile * len(latencies)))]
+
+    def hedge_delay(self) -> float | None:
+        """
+        :return: The number of seconds after which a running call is hedged, or None if it is not.
+        """
+        if self.hedge_percentile is None:
+            return None
+        return self._percentile(self.hedge_percentile)
+
+    def timeout(self) -> float:
+        """
+        :return: The number of seconds after which a call is abandoned.
+        """
+        latency = self._percentile(self.timeout_percentile) if self.timeout_percentile is not None else None
+        if latency is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, latency * self.timeout_multiplier))
+
+    def _before_call(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probing:
+                raise CircuitOpenError(f"The LLM backend failed {self._consecutive_failures} times in a row, retrying after {self.reset_timeout}s")
+            # half-open: let a single call through to probe the backend
+            self._probing = True
+
+    def _record_success(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+            if self._opened_at is not None:
+                logger.info("[LatencyPolicy] Circuit closed")
+            self._consecutive_failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def _record_failure(self, error: BaseException) -> None:
+        if not is_transient(error):
+            # a bad request says nothing about the health of the backend
+            with self._lock:
+                self._probing = False
+            return
+        with self._lock:
+            self._consecutive_failures += 1
+            reopen = self._probing
+            self._probing = False
+            if reopen or (self.failure_threshold is not None and self._consecutive_failures >= self.failure_threshold):
+                if self._opened_at is None or reopen:
+                    logger.warning("[LatencyPolicy] Circuit opened for %ss after %s failures", self.reset_timeout, self._consecutive_failures)
+                    metrics.increment("circuit_opened")
+                self._opened_at = time.monotonic()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="paper2cmap-policy")
+            return self._executor
+
+    def _run_once(self, call: Callable[[], Any], can_hedge: Callable[[], bool]) -> Any:
+        timeout = self.timeout()
+        hedge_delay = self.hedge_delay()
+        start = time.monotonic()
+
+        executor = self._get_executor()
+        # the calls run in the context of the caller, e.g. to count their retries in its metrics span
+        futures = [executor.submit(contextvars.copy_context().run, call)]
+        done, pending = wait(futures, timeout=min(timeout, hedge_delay) if hedge_delay is not None else timeout)
+        if not done and hedge_delay is not None and hedge_delay < timeout and can_hedge():
+            logger.debug("[LatencyPolicy] Hedging a call running for %.1fs", time.monotonic() - start)
+            self.num_hedges += 1
+            metrics.increment("llm_hedges")
+            futures.append(executor.submit(contextvars.copy_context().run, call))
+            pending.add(futures[-1])
+
+        try:
+            failed = []
+            while True:
+                for future in done:
+                    if future.exception() is None:
+                        if len(futures) > 1 and future is futures[-1]:
+                            self.num_hedge_wins += 1
+                        return future.result()
+                    failed.append(future)
+                if not pending:
+                    raise failed[0].exception()
+                done, pending = wait(
+                    pending, timeout=max(0.0, timeout - (time.monotonic() - start)), return_when=FIRST_COMPLETED
+                )
+                if not done:
+                    self.num_timeouts += 1
+                    metrics.increment("llm_timeouts")
+                    raise TimeoutError(f"The LLM call did not finish in {timeout:.1f}s")
+        finally:
+            # a running thread cannot be interrupted, it finishes in the background and its result is dropped
+            for future in futures:
+                future.cancel()
+
+    def run(self, call: Callable[[], Any], can_hedge: Callable[[], bool] = lambda: True) -> Any:
+        """
+        Run a blocking call under the policy.
+
+        :param call: The call.
+        :param can_hedge: Checked before hedging, e.g. whether the rate limit has room for another request. Default: always True.
+        :return: The result of the call.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            self._before_call()
+            start = time.monotonic()
+            try:
+                result = self._run_once(call, can_hedge)
+            except Exception as e:
+                self._record_failure(e)
+                if not isinstance(e, TimeoutError) or attempt == self.max_attempts:
+                    raise
+                logger.warning("[LatencyPolicy] Attempt %s timed out, retrying", attempt)
+                metrics.increment("llm_retries")
+                continue
+            self._record_success(time.monotonic() - start)
+            return result
+
+    async def _arun_once(self, call: Callable[[], Awaitable[Any]], can_hedge: Callable[[], bool]) -> Any:
+        timeout = self.timeout()
+        hedge_delay = self.hedge_delay()
+        start = time.monotonic()
+
+        tasks = [asyncio.ensure_future(call())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=min(timeout, hedge_delay) if hedge_delay is not None else timeout)
+            if not done and hedge_delay is not None and hedge_delay < timeout and can_hedge():
+                logger.debug("[LatencyPolicy] Hedging a call running for %.1fs", time.monotonic() - start)
+                self.num_hedges += 1
+                metrics.increment("llm_hedges")
+                tasks.append(asyncio.ensure_future(call()))
+
+            pending = [task for task in tasks if task not in done]
+            failed = []
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1 and task is tasks[-1]:
+                            self.num_hedge_wins += 1
+                        return task.result()
+                    failed.append(task)
+                if not pending:
+                    raise failed[0].exception()
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, timeout - (time.monotonic() - start)), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    self.num_timeouts += 1
+                    metrics.increment("llm_timeouts")
+                    raise TimeoutError(f"The LLM call did not finish in {timeout:.1f}s")
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def arun(self, call: Callable[[], Awaitable[Any]], can_hedge: Callable[[], bool] = lambda: True) -> Any:
+        """
+        Asynchronous version of `run`. Timed out and losing calls are cancelled.
+
+        :param call: Creates the awaitable of the call, once per attempt or hedge.
+        :param can_hedge: Checked before hedging, e.g. whether the rate limit has room for another request. Default: always True.
+        :return: The result of the call.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            self._before_call()
+            start = time.monotonic()
+            try:
+                result = await self._arun_once(call, can_hedge)
+            except asyncio.CancelledError:
+                with self._lock:
+                    self._probing = False
+                raise
+            except Exception as e:
+                self._record_failure(e)
+                if not isinstance(e, TimeoutError) or attempt == self.max_attempts:
+                    raise
+                logger.warning("[LatencyPolicy] Attempt %s timed out, retrying", attempt)
+                metrics.increment("llm_retries")
+                continue
+            self._record_success(time.monotonic() - start)
+            return result
+
+    def stats(self) -> dict:
+        """
+        :return: The number of hedged calls, hedges that won and timeouts, the current hedge delay and timeout, and whether the circuit is open.
+        """
+        return {
+            "hedges": self.num_hedges,
+            "hedge_wins": self.num_hedge_wins,
+            "timeouts": self.num_timeouts,
+            "hedge_delay": self.hedge_delay(),
+            "timeout": self.timeout(),
+            "circuit_open": self._opened_at is not None,
+        }
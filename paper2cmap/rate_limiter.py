@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from typing import Tuple
+
+
+class RateLimiter():
+    def __init__(self, requests_per_minute: int | None = None, tokens_per_minute: int | None = None) -> None:
+        """
+        A thread-safe token bucket limiting both the request rate and the token rate of LLM calls.
+
+        :param requests_per_minute: The maximum number of requests per minute. If None, requests are not limited.
+        :param tokens_per_minute: The maximum number of tokens per minute. If None, tokens are not limited.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+        self._request_allowance = float(requests_per_minute or 0)
+        self._token_allowance = float(tokens_per_minute or 0)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._request_allowance = min(
+                self.requests_per_minute,
+                self._request_allowance + elapsed * self.requests_per_minute / 60
+            )
+        if self.tokens_per_minute:
+            self._token_allowance = min(
+                self.tokens_per_minute,
+                self._token_allowance + elapsed * self.tokens_per_minute / 60
+            )
+
+    def try_acquire(self, tokens: int = 0) -> Tuple[bool, float]:
+        """
+        Try to take one request and {tokens} tokens from the bucket without waiting.
+
+        :param tokens: The estimated number of tokens of the request.
+        :return: Whether the acquisition succeeded, and how long to wait before retrying if not.
+        """
+        with self._lock:
+            self._refill()
+
+            wait = 0.0
+            if self.requests_per_minute and self._request_allowance < 1:
+                wait = max(wait, (1 - self._request_allowance) * 60 / self.requests_per_minute)
+            if self.tokens_per_minute:
+                # a single request larger than the whole budget would wait forever
+                tokens = min(tokens, self.tokens_per_minute)
+                if self._token_allowance < tokens:
+                    wait = max(wait, (tokens - self._token_allowance) * 60 / self.tokens_per_minute)
+            if wait > 0:
+                return False, wait
+
+            if self.requests_per_minute:
+                self._request_allowance -= 1
+            if self.tokens_per_minute:
+                self._token_allowance -= tokens
+            return True, 0.0
+
+    def acquire(self, tokens: int = 0) -> None:
+        """
+        Block until one request with {tokens} tokens fits into the budget.
+
+        :param tokens: The estimated number of tokens of the request.
+        """
+        while True:
+            acquired, wait = self.try_acquire(tokens)
+            if acquired:
+                return
+            time.sleep(wait)
+
+
+    async def aacquire(self, tokens: int = 0) -> None:
+        """
+        Wait without blocking the event loop until one request with {tokens} tokens fits into the budget.
+
+        :param tokens: The estimated number of tokens of the request.
+        """
+        while True:
+            acquired, wait = self.try_acquire(tokens)
+            if acquired:
+                return
+            await asyncio.sleep(wait)
@@ -0,0 +1,302 @@
+from __future__ import annotations
+
+import collections
+import itertools
+import threading
+import time
+from typing import Any, Dict, Iterator, List
+
+from paper2cmap import ChatClient, Paper2CMap, logger, metrics
+from paper2cmap.checkpoint import hash_file, hash_json
+from paper2cmap.llm import build_chat_client
+
+# Paper2CMap parameters of a job that do not depend on the model
+_PAPER_KEYS = ("checkpoint_dir", "catelogue_mode", "compact_prompts", "low_memory", "spill_dir")
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+class Job():
+    def __init__(self, job_id: int, key: str, pdf_path: str, credentials: Dict | None, model_kwargs: Dict,
+                 generate_kwargs: Dict) -> None:
+        """
+        A concept map generation submitted to a `CMapService`. Its events are kept so that any number of
+        readers can follow it with `CMapService.stream`, from the start, while it runs or after it is done.
+
+        :param job_id: The id of the job.
+        :param key: The hash of the PDF file, of the credentials and of the parameters, identical jobs share it.
+        :param pdf_path: The path of the PDF file.
+        :param credentials: The endpoint of the model, see `CMapService.submit`.
+        :param model_kwargs: The model keyword arguments of Paper2CMap.
+        :param generate_kwargs: The keyword arguments of Paper2CMap.generate_cmap_iter.
+        """
+        self.id = job_id
+        self.key = key
+        self.pdf_path = pdf_path
+        self.credentials = credentials
+        self.model_kwargs = model_kwargs
+        self.generate_kwargs = generate_kwargs
+
+        # "queued", "running", "done" or "error"
+        self.status = "queued"
+        self.result: List[Dict] | None = None
+        self.error: str | None = None
+        self.events: List[Dict] = []
+        self.submitted = time.time()
+        self.started: float | None = None
+        self.finished: float | None = None
+        self._cond = threading.Condition()
+
+    def _emit(self, event: Dict, status: str | None = None) -> None:
+        with self._cond:
+            self.events.append(event)
+            if status is not None:
+                self.status = status
+            self._cond.notify_all()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "error")
+
+    def wait(self, timeout: float | None = None) -> List[Dict] | None:
+        """
+        Wait for the job to finish.
+
+        :param timeout: The maximum number of seconds to wait. If None, wait forever. Default: None.
+        :return: The concept map, or None if the job failed or is still running after {timeout} seconds.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.done, timeout)
+        return self.result
+
+
+class CMapService():
+    def __init__(self,
+                 num_workers: int = 4,
+                 max_queue_size: int = 16,
+                 max_results: int = 256,
+                 max_clients: int = 64,
+                 paper2cmap_kwargs: Dict | None = None,
+                 ) -> None:
+        """
+        Serve concept map generations to concurrent users, e.g. behind a web app. Jobs wait in a bounded queue
+        and are run by a fixed pool of worker threads, so a burst of users cannot start more pipelines than the
+        workers, and submissions beyond the queue are refused with QueueFullError instead of piling up.
+
+        Every job carries its own credentials instead of reading the environment, and the chat clients (with their
+        connections, rate limiters and cache) are reused across the jobs of the same credentials. Jobs are keyed by
+        the content hash of the PDF file, the credentials and the parameters: a submission identical to a finished job
+        returns its result at once, and one identical to a queued or running job follows it instead of running again.
+        As the API key is part of the key, a result is only shared with the sessions holding the credential it was
+        generated with.
+
+        :param num_workers: The number of jobs running at a time. Default: 4.
+        :param max_queue_size: The maximum number of jobs waiting for a worker. Default: 16.
+        :param max_results: The number of finished jobs kept for reuse, the least recently used are dropped. Default: 256.
+        :param max_clients: The number of chat clients kept for reuse, the least recently used are dropped. Default: 64.
+        :param paper2cmap_kwargs: The keyword arguments of Paper2CMap shared by all jobs, e.g. cache_dir, requests_per_minute or catelogue_mode. If it holds a ChatClient as "chatbot", jobs without credentials use it. Default: None.
+        """
+        self.num_workers = num_workers
+        self.max_queue_size = max_queue_size
+        self.max_results = max_results
+        self.max_clients = max_clients
+        self.paper2cmap_kwargs = dict(paper2cmap_kwargs or {})
+        self._paper_kwargs = {key: self.paper2cmap_kwargs[key] for key in _PAPER_KEYS if key in self.paper2cmap_kwargs}
+
+        self._lock = threading.Condition()
+        self._queue: collections.deque = collections.deque()
+        # job key -> job, for the queued and running jobs, and for the finished ones in LRU order
+        self._inflight: Dict[str, Job] = {}
+        self._results: collections.OrderedDict = collections.OrderedDict()
+        # credentials hash -> chat client, in LRU order
+        self._clients: collections.OrderedDict = collections.OrderedDict()
+        self._clients_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._closed = False
+
+        self._workers = [
+            threading.Thread(target=self._work, name=f"paper2cmap-worker-{i}", daemon=True) for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def _job_key(self, pdf_path: str, credentials: Dict | None, model_kwargs: Dict, generate_kwargs: Dict) -> str:
+        # the API key is hashed with the rest, so that a session never gets a result its own credential was not checked for
+        generate_kwargs = {key: vars(value) if hasattr(value, "__dict__") else value for key, value in generate_kwargs.items()}
+        return hash_json([hash_file(pdf_path), credentials, model_kwargs, self._paper_kwargs, generate_kwargs])
+
+    def submit(self, pdf_path: str, credentials: Dict | None = None, model_kwargs: Dict | None = None,
+               **generate_kwargs) -> Job:
+        """
+        Submit a concept map generation.
+
+        :param pdf_path: The path of the PDF file. It must stay readable until the job has run.
+        :param credentials: The endpoint of the model, a dict with "api_type", "api_key", and optionally "api_base", "model_name", "deployment_name" and "deployment_version", see `LLMManager`. If None, the shared client of {paper2cmap_kwargs}, or the environment variables. Default: None.
+        :param model_kwargs: The model keyword arguments of Paper2CMap, e.g. temperature. Default: None.
+        :param generate_kwargs: The keyword arguments of Paper2CMap.generate_cmap_iter, e.g. max_num_concepts.
+        :return: The job, already done if an identical one was.
+        :raises QueueFullError: If {max_queue_size} jobs are already waiting.
+        """
+        model_kwargs = dict(model_kwargs or {})
+        key = self._job_key(pdf_path, credentials, model_kwargs, generate_kwargs)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The service is closed")
+            job = self._results.get(key)
+            if job is not None:
+                self._results.move_to_end(key)
+                metrics.increment("service_jobs", status="reused")
+                logger.info("[CMapService] Reusing the result of job %s", job.id)
+                return job
+            job = self._inflight.get(key)
+            if job is not None:
+                metrics.increment("service_jobs", status="joined")
+                logger.info("[CMapService] Joining job %s", job.id)
+                return job
+            if len(self._queue) >= self.max_queue_size:
+                metrics.increment("service_jobs", status="rejected")
+                raise QueueFullError(f"{len(self._queue)} jobs are already waiting, please retry later")
+
+            job = Job(next(self._ids), key, pdf_path, credentials, model_kwargs, generate_kwargs)
+            self._inflight[key] = job
+            self._queue.append(job)
+            self._lock.notify()
+        metrics.increment("service_jobs", status="queued")
+        logger.info("[CMapService] Queued job %s at position %s", job.id, self.position(job))
+        return job
+
+    def position(self, job: Job) -> int:
+        """
+        :param job: The job.
+        :return: The number of jobs ahead of {job} in the queue plus one, or 0 if it is not waiting anymore.
+        """
+        with self._lock:
+            for i, queued in enumerate(self._queue):
+                if queued is job:
+                    return i + 1
+        return 0
+
+    def stream(self, job: Job, poll_interval: float = 1.0) -> Iterator[Dict]:
+        """
+        Follow a job. While it waits, {"type": "queued", "position"} is yielded whenever its position changes. Then come
+        {"type": "loaded", "num_sections", "text"} once the paper is read, the section events of
+        `Paper2CMap.generate_cmap_iter`, and finally {"type": "final", "cmap"} or {"type": "error", "error"}.
+
+        :param job: The job.
+        :param poll_interval: The number of seconds between checks of the queue position. Default: 1.0.
+        :return: An iterator of events.
+        """
+        position, index = None, 0
+        while True:
+            with job._cond:
+                if index == len(job.events) and not job.done:
+                    job._cond.wait(poll_interval)
+                events = job.events[index:]
+                index += len(events)
+                done = job.done and index == len(job.events)
+            if job.status == "queued":
+                new_position = self.position(job)
+                if new_position and new_position != position:
+                    position = new_position
+                    yield {"type": "queued", "position": position}
+            yield from events
+            if done:
+                return
+
+    def _client(self, credentials: Dict | None, model_kwargs: Dict) -> ChatClient:
+        if credentials is None and isinstance(self.paper2cmap_kwargs.get("chatbot"), ChatClient):
+            return self.paper2cmap_kwargs["chatbot"]
+        client_key = hash_json([credentials, model_kwargs])
+        with self._clients_lock:
+            client = self._clients.get(client_key)
+            if client is not None:
+                self._clients.move_to_end(client_key)
+                return client
+        # the model, rate limit and cache parameters, the others are those of the paper
+        kwargs = {key: value for key, value in {**self.paper2cmap_kwargs, **model_kwargs}.items() if key not in _PAPER_KEYS}
+        if credentials is not None:
+            kwargs["endpoints"] = [credentials]
+            kwargs.pop("chatbot", None)
+        client = build_chat_client(**kwargs)
+        with self._clients_lock:
+            self._clients[client_key] = client
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+        return client
+
+    def _run(self, job: Job) -> None:
+        generate_kwargs = dict(job.generate_kwargs)
+        paper2cmap = Paper2CMap(chatbot=self._client(job.credentials, job.model_kwargs), **self._paper_kwargs)
+        paper2cmap.load(job.pdf_path)
+        sections = paper2cmap.paper_reader.sections
+        max_num_iterations = generate_kwargs.get("max_num_iterations", -1)
+        text = str(paper2cmap.paper_reader.full_text) if max_num_iterations == -1 else "\n\n".join(sections[:max_num_iterations])
+        job._emit({"type": "loaded", "num_sections": len(sections), "text": text})
+        for event in paper2cmap.generate_cmap_iter(**generate_kwargs):
+            if event["type"] == "final":
+                job.result = event["cmap"]
+            job._emit(event)
+
+    def _work(self) -> None:
+        while True:
+            with self._lock:
+                self._lock.wait_for(lambda: self._queue or self._closed)
+                if self._closed:
+                    return
+                job = self._queue.popleft()
+            job.started = time.time()
+            with job._cond:
+                job.status = "running"
+                job._cond.notify_all()
+            metrics.increment("service_queue_seconds", job.started - job.submitted)
+            logger.info("[CMapService] Running job %s after %.1fs in the queue", job.id, job.started - job.submitted)
+            try:
+                with metrics.span("service_job", job=job.id):
+                    self._run(job)
+                status = "done"
+            except Exception as e:
+                logger.error("[CMapService] Job %s failed: %r", job.id, e)
+                job.error = repr(e)
+                job._emit({"type": "error", "error": job.error})
+                status = "error"
+            job.finished = time.time()
+
+            with self._lock:
+                del self._inflight[job.key]
+                if status == "done":
+                    self._results[job.key] = job
+                    while len(self._results) > self.max_results:
+                        self._results.popitem(last=False)
+            with job._cond:
+                job.status = status
+                job._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        :return: The numbers of queued, running and finished jobs kept, and of cached chat clients.
+        """
+        with self._lock:
+            queued = len(self._queue)
+            return {
+                "queued": queued,
+                "running": len(self._inflight) - queued,
+                "results": len(self._results),
+                "clients": len(self._clients),
+            }
+
+    def close(self) -> None:
+        """
+        Stop the workers once their running jobs are done. Queued jobs fail.
+        """
+        with self._lock:
+            self._closed = True
+            dropped = list(self._queue)
+            self._queue.clear()
+            self._lock.notify_all()
+        for job in dropped:
+            job.error = "The service is closed"
+            job._emit({"type": "error", "error": job.error}, status="error")
+        for worker in self._workers:
+            worker.join()
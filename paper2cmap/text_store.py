@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import mmap
+import tempfile
+import threading
+from typing import Iterator, List, Sequence, Tuple
+
+# a fixed width encoding, so that the character offsets of the text are byte offsets in the file
+_ENCODING = "utf-32-le"
+_CHAR_SIZE = 4
+
+
+class TextStore():
+    def __init__(self, spill_dir: str | None = None) -> None:
+        """
+        An append-only text buffer spilled to a temporary file and read back through a memory map, so that the text of
+        a long document is paged in by the OS on demand instead of being held in memory. It supports `len`, slicing and
+        `rfind` like a string, and is deleted with `close` or when garbage collected.
+
+        :param spill_dir: The directory of the temporary file. If None, the default temporary directory. Default: None.
+        """
+        self._file = tempfile.TemporaryFile(dir=spill_dir)
+        self._length = 0
+        self._map: mmap.mmap | None = None
+        self._mapped_length = 0
+        self._lock = threading.Lock()
+
+    def append(self, text: str) -> Tuple[int, int]:
+        """
+        :param text: The text to append.
+        :return: The (start, end) offsets of the text in the buffer.
+        """
+        with self._lock:
+            self._file.seek(self._length * _CHAR_SIZE)
+            self._file.write(text.encode(_ENCODING))
+            start, self._length = self._length, self._length + len(text)
+        return start, self._length
+
+    def _view(self) -> mmap.mmap | None:
+        with self._lock:
+            if self._mapped_length != self._length:
+                self._file.flush()
+                if self._map is not None:
+                    self._map.close()
+                self._map = mmap.mmap(self._file.fileno(), self._length * _CHAR_SIZE, access=mmap.ACCESS_READ) if self._length else None
+                self._mapped_length = self._length
+            return self._map
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: int | slice) -> str:
+        if isinstance(index, int):
+            if index < 0:
+                index += self._length
+            if not 0 <= index < self._length:
+                raise IndexError("TextStore index out of range")
+            index = slice(index, index + 1)
+        start, end, step = index.indices(self._length)
+        if end <= start:
+            return ""
+        text = self._view()[start * _CHAR_SIZE:end * _CHAR_SIZE].decode(_ENCODING)
+        return text if step == 1 else text[::step]
+
+    def __str__(self) -> str:
+        return self[:]
+
+    def rfind(self, sub: str, start: int = 0, end: int | None = None, block_size: int = 4096) -> int:
+        """
+        Like `str.rfind`, reading the buffer backwards one block at a time.
+
+        :param sub: The substring.
+        :param start: The start offset of the search. Default: 0.
+        :param end: The end offset of the search. If None, the end of the buffer. Default: None.
+        :param block_size: The number of characters read at a time. Default: 4096.
+        :return: The highest offset of {sub} within [start, end), or -1.
+        """
+        end = self._length if end is None else min(end, self._length)
+        block_end = end
+        while block_end > start:
+            block_start = max(start, block_end - block_size)
+            # blocks overlap by the length of the substring, so matches across a block boundary are found
+            index = self[block_start:min(end, block_end + len(sub) - 1)].rfind(sub)
+            if index != -1:
+                return block_start + index
+            block_end = block_start
+        return -1
+
+    def iter_windows(self, size: int, overlap: int) -> Iterator[Tuple[int, str]]:
+        """
+        Read the buffer in overlapping windows, e.g. to search it with a regular expression without materializing it.
+
+        :param size: The number of characters of a window.
+        :param overlap: The number of characters shared by consecutive windows. Must be smaller than {size}.
+        :return: An iterator of (start offset, window text) pairs.
+        """
+        if overlap >= size:
+            raise ValueError(f"overlap must be smaller than size, but got {overlap} >= {size}")
+        start = 0
+        while True:
+            yield start, self[start:start + size]
+            if start + size >= self._length:
+                return
+            start += size - overlap
+
+    def close(self) -> None:
+        """
+        Delete the temporary file.
+        """
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._file.close()
+
+
+class TextRanges(Sequence[str]):
+    def __init__(self, store: TextStore, ranges: List[Tuple[int, int]], strip: bool = False) -> None:
+        """
+        A list of texts stored as (start, end) offset ranges of a TextStore. A text is only materialized when it is
+        indexed, and slicing returns another TextRanges, so it can stand in for a list of strings.
+
+        :param store: The buffer holding the texts.
+        :param ranges: The (start, end) offsets of the texts.
+        :param strip: Whether the texts are stripped of their surrounding whitespace when materialized. Default: False.
+        """
+        self.store = store
+        self.ranges = ranges
+        self.strip = strip
+
+    def __len__(self) -> int:
+        return len(self.ranges)
+
+    def __getitem__(self, index: int | slice) -> str | TextRanges:
+        if isinstance(index, slice):
+            return TextRanges(self.store, self.ranges[index], self.strip)
+        start, end = self.ranges[index]
+        text = self.store[start:end]
+        return text.strip() if self.strip else text
+
+    def __repr__(self) -> str:
+        return f"TextRanges({len(self.ranges)} texts, {sum(end - start for start, end in self.ranges)} characters)"
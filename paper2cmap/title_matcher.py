@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import re
+from typing import Dict, List, Tuple
+
+from paper2cmap.text_store import TextStore
+
+_SPACES = re.compile(r"\s+")
+_DASHES = "-‐‑–"
+_HYPHENS = re.compile(rf"\s*[{_DASHES}]\s*")
+
+
+def normalize_title(title: str) -> str:
+    """
+    Normalize a title so that differences in case, whitespace, line breaks and spacing around hyphens do not matter.
+
+    :param title: The title.
+    :return: The normalized title.
+    """
+    return _HYPHENS.sub("-", _SPACES.sub(" ", title.lower())).strip()
+
+
+class TitleMatcher():
+    def __init__(self, titles: List[str]) -> None:
+        """
+        Find many titles in a text in a single pass. The normalized titles are merged into a trie, compiled into one
+        regular expression whose branches share their common prefixes, so the text is scanned once whatever the number of titles.
+
+        :param titles: The titles, in document order.
+        """
+        self.titles = titles
+
+        # every trie node maps a character to its child, and "" to the indexes of the titles ending there
+        self._trie: Dict = {}
+        for title_index, title in enumerate(titles):
+            node = self._trie
+            for char in normalize_title(title):
+                node = node.setdefault(char, {})
+            node.setdefault("", []).append(title_index)
+
+        pattern = self._trie_pattern(self._trie)
+        self._pattern = re.compile(rf"(?<!\w)(?=({pattern}))", re.IGNORECASE) if pattern else None
+        # the longest text a title can plausibly match, with some slack for the whitespace and hyphens it may span
+        self._max_match_len = max((len(title) for title in titles), default=0) * 2 + 64
+
+    @classmethod
+    def _trie_pattern(cls, node: Dict) -> str:
+        branches = []
+        for char, child in node.items():
+            if char == "":
+                continue
+            token = r"\s+" if char == " " else rf"\s*[{_DASHES}]\s*" if char == "-" else re.escape(char)
+            branches.append(token + cls._trie_pattern(child))
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        # a title ending here may also be the prefix of a longer one
+        return f"(?:{pattern})?" if "" in node else pattern
+
+    def find_all(self, text: str | TextStore, window_size: int = 1 << 20) -> List[Tuple[int, int]]:
+        """
+        Find every occurrence of every title.
+
+        :param text: The text, or a TextStore scanned in windows of {window_size} characters.
+        :param window_size: The number of characters of a window of a TextStore. Default: 1 << 20.
+        :return: The (start offset, title index) of the occurrences, sorted by offset.
+        """
+        if self._pattern is None:
+            return []
+        if isinstance(text, str):
+            return self._find_all(text)
+
+        overlap = min(self._max_match_len + 1, window_size // 2)
+        occurrences = []
+        for window_start, window in text.iter_windows(window_size, overlap):
+            # an occurrence starting in the overlap is found again, whole, in the next window
+            is_last = window_start + len(window) >= len(text)
+            occurrences.extend(
+                (window_start + offset, title_index) for offset, title_index in self._find_all(window)
+                if is_last or offset < len(window) - overlap
+            )
+        return occurrences
+
+    def _find_all(self, text: str) -> List[Tuple[int, int]]:
+        occurrences = []
+        for match in self._pattern.finditer(text):
+            matched, end = normalize_title(match.group(1)), match.end(1)
+            # the match is the longest title at this offset, walk the trie again to also report the shorter ones
+            node = self._trie
+            for i, char in enumerate(matched):
+                node = node.get(char)
+                if node is None:
+                    break
+                if "" in node:
+                    next_char = matched[i + 1] if i + 1 < len(matched) else text[end:end + 1]
+                    if not (next_char.isalnum() and matched[i].isalnum()):
+                        occurrences.extend((match.start(), title_index) for title_index in node[""])
+        return occurrences
+
+    @staticmethod
+    def _at_line_start(text: str | TextStore, offset: int) -> bool:
+        line_start = text.rfind("\n", 0, offset) + 1
+        return not text[line_start:offset].strip()
+
+    def match(self, text: str | TextStore) -> List[Tuple[int, int]]:
+        """
+        Pick at most one occurrence per title, such that the titles appear in their given order. The largest number of
+        titles is matched, and among the equally large choices, the one with the most titles at the start of a line,
+        which are more likely headings than mentions in a sentence.
+
+        :param text: The text, or a TextStore.
+        :return: The (start offset, title index) of the picked occurrences, sorted by offset.
+        """
+        occurrences = self.find_all(text)
+        num_titles = len(self.titles)
+
+        # a heaviest increasing subsequence over the title indexes. A Fenwick tree keeps the best chain ending
+        # with a title index up to i; a matched title counts more than all the line start bonuses together.
+        # Ties go to the later occurrence, e.g. the body of a book rather than its table of contents.
+        tree: List[Tuple[int, int]] = [(0, -1)] * (num_titles + 1)
+        parents = [-1] * len(occurrences)
+
+        def _query(i: int) -> Tuple[int, int]:
+            best = (0, -1)
+            while i > 0:
+                best = max(best, tree[i])
+                i -= i & -i
+            return best
+
+        def _update(i: int, value: Tuple[int, int]) -> None:
+            i += 1
+            while i <= num_titles:
+                tree[i] = max(tree[i], value)
+                i += i & -i
+
+        best = (0, -1)
+        start = 0
+        while start < len(occurrences):
+            # occurrences at the same offset cannot chain with each other
+            end = start
+            while end < len(occurrences) and occurrences[end][0] == occurrences[start][0]:
+                end += 1
+            scores = []
+            for k in range(start, end):
+                offset, title_index = occurrences[k]
+                score, parents[k] = _query(title_index)
+                scores.append(score + (num_titles + 1) + self._at_line_start(text, offset))
+            for k, score in zip(range(start, end), scores):
+                _update(occurrences[k][1], (score, k))
+                best = max(best, (score, k))
+            start = end
+
+        picked = []
+        k = best[1]
+        while k != -1:
+            picked.append(occurrences[k])
+            k = parents[k]
+        return picked[::-1]
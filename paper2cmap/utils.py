@@ -0,0 +1,25 @@
+from __future__ import annotations
+
+from typing import List
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Roughly estimate the number of tokens of the given text without calling any tokenizer.
+    OpenAI models average about 4 characters per token on English text.
+
+    :param text: The text to estimate.
+    :return: The estimated number of tokens.
+    """
+    return len(text) // 4 + 1
+
+
+def estimate_messages_tokens(messages: List) -> int:
+    """
+    Roughly estimate the number of prompt tokens of a list of chat messages.
+
+    :param messages: The chat messages.
+    :return: The estimated number of tokens.
+    """
+    # every message carries a few tokens of role/separator overhead
+    return sum(estimate_tokens(message.content) + 4 for message in messages)
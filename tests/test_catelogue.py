@@ -0,0 +1,23 @@
+import sys
+sys.path.insert(0, './')
+
+from paper2cmap import logger
+from paper2cmap.catelogue import catelogue_from_outline, detect_catelogue
+from paper2cmap.pdf_parser import extract_outline, parse_pdf
+from paper2cmap.title_matcher import TitleMatcher
+
+logger.setLevel("DEBUG")
+
+if __name__ == "__main__":
+    for demo_pdf in ["./tests/examples/attentionisallyouneed.pdf", "./tests/examples/bert.pdf"]:
+        pages, cand_cate = parse_pdf(demo_pdf)
+        full_text = "".join(pages)
+
+        print(f"Catelogue from the outline of {demo_pdf}: {catelogue_from_outline(extract_outline(demo_pdf), full_text)}")
+
+        titles, confident, candidates = detect_catelogue(cand_cate)
+        print(f"Catelogue from the layout of {demo_pdf} (confident: {confident}): {titles}")
+        print(f"Candidates for the LLM: {len(candidates)} of {len(cand_cate)}")
+
+        matcher = TitleMatcher(titles)
+        print(f"Title occurrences: {len(matcher.find_all(full_text))}, section starts: {matcher.match(full_text)}")
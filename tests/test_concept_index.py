@@ -0,0 +1,34 @@
+import sys
+sys.path.insert(0, './')
+
+import os
+import tempfile
+import time
+
+from paper2cmap import ConceptIndex, Paper2CMap, logger
+
+logger.setLevel("INFO")
+
+if __name__ == "__main__":
+    index = ConceptIndex(os.path.join(tempfile.mkdtemp(), "index.sqlite3"))
+
+    paper2cmap = Paper2CMap()
+    paper2cmap.load("tests/examples/attentionisallyouneed.pdf")
+    cmap = paper2cmap.generate_cmap(max_workers=4)
+    paper_id = paper2cmap.index_cmap(index, cmap)
+
+    concept = index.relationships(paper_id)[0]["source"]
+    print(f"Mentions of {concept!r}: {index.locate(concept, paper_id)[:3]}")
+    print(f"Relationships: {index.relationships(paper_id)[:3]}")
+
+    question = "Why does the Transformer use multi-head attention instead of recurrence?"
+    start = time.perf_counter()
+    for _ in range(100):
+        passages, relationships = index.retrieve(question, paper_id=paper_id)
+    print(f"Retrieval: {(time.perf_counter() - start) * 10:.3f} ms per question")
+
+    result = paper2cmap.answer(question, index)
+    print(f"Answer: {result['answer']}")
+    for i, passage in enumerate(result["passages"]):
+        print(f"[{i + 1}] section {passage['section']}, {passage['start']}-{passage['end']}: {passage['text'][:100]!r}")
+    print(f"Token usage: {paper2cmap.chat_client.token_usage}")
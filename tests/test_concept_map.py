@@ -0,0 +1,43 @@
+import sys
+sys.path.insert(0, './')
+
+from paper2cmap import CMapGPT, ConceptMap, logger
+
+logger.setLevel("DEBUG")
+
+if __name__ == "__main__":
+    section_cmaps = [
+        [["Transformer", "is based on", "self-attention"], ["Transformer", "consists of", "encoder"], ["encoder", "feeds", "decoder"]],
+        [["The Transformer", "is based on", "Self-Attention"], ["self-attention", "relates", "positions"]],
+        [{"source": "decoder", "relationship": "generates", "target": "output sequence"}, ["transformer", "consists of", "decoder"]],
+        [["transformer model", "is based on", "self attention"], ["decoder", "generates", "output sequences"]],
+    ]
+
+    cmap = ConceptMap.union(section_cmaps)
+    print(f"Concepts: {cmap.concepts}")
+    print(f"Merged concept map: {cmap.to_triples()}")
+    print(f"Neighbors of Transformer: {cmap.neighbors('transformer')}")
+    print(f"Compact encoding:\n{cmap.to_compact()}")
+
+    cmap = cmap.cluster_concepts(threshold=0.65)
+    print(f"Clustered concepts: {cmap.concepts}")
+
+    # similar labels are not chained: "encoder" and "decoder" stay apart although both are close to "encoder layer"
+    layers = ConceptMap.from_triples([["encoder", "feeds", "decoder"], ["encoder layer", "feeds", "decoder layer"]])
+    print(f"Concept clusters: {layers.concept_clusters(threshold=0.65)}")
+
+    cmap = cmap.prune(max_num_concepts=4, max_num_relationships=3)
+    print(f"Pruned concept map: {cmap.to_triples()}")
+
+    # the compact merge prompt lists the relationships of a union from the most to the least frequent
+    weighted = ConceptMap.union([
+        [["encoder", "feeds", "decoder"]],
+        [["decoder", "generates", "output sequence"]],
+        [["Decoder", "generates", "output sequences"], ["the decoder", "generates", "output sequence"]],
+    ])
+    merge_messages = CMapGPT(chatbot=None, compact_prompts=True)._merge_and_prune_messages(
+        weighted, max_num_concepts=5, max_num_relationships=10
+    )
+    relationship_lines = merge_messages[-1].content.split("Relationships:\n")[1].split("\n")
+    print(f"Compact merge input: {relationship_lines}")
+    assert relationship_lines[0] == "2|generates|3", relationship_lines
@@ -0,0 +1,95 @@
+import sys
+sys.path.insert(0, './')
+
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain.schema import HumanMessage
+
+from paper2cmap import ChatClient, LLMManager, logger
+
+logger.setLevel("INFO")
+
+
+def start_stub_server(latency: float, num_throttled: int = 0) -> ThreadingHTTPServer:
+    """
+    A local OpenAI-compatible chat completion server. The first {num_throttled} requests are answered with 429.
+    """
+    state = {"requests": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def _reply(self, status: int, body: dict, headers: dict = {}) -> None:
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self) -> None:
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            with lock:
+                state["requests"] += 1
+                throttled = state["requests"] <= num_throttled
+            if throttled:
+                self._reply(429, {"error": {"message": "Rate limit reached", "type": "requests"}}, {"Retry-After": "1"})
+                return
+
+            time.sleep(latency)
+            self._reply(200, {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request["model"],
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": f"echo: {request['messages'][-1]['content']}"},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+            })
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    servers = [start_stub_server(0.2), start_stub_server(0.2, num_throttled=3), start_stub_server(0.6)]
+    endpoints = [
+        {"api_type": "openai", "api_key": "stub", "api_base": f"http://127.0.0.1:{server.server_port}/v1"}
+        for server in servers
+    ]
+    pool = LLMManager(model_name="gpt-3.5-turbo", endpoints=endpoints).LLM
+    chat_client = ChatClient(pool)
+
+    messages = [[HumanMessage(content=f"request {i}")] for i in range(30)]
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        responses = list(executor.map(chat_client.chat, messages))
+    print(f"Sync: {len(responses)} responses in {time.time() - start:.2f}s, e.g. {responses[0]!r}")
+    print(f"Endpoints: {pool.stats()}")
+
+    async def _run() -> list:
+        try:
+            return await asyncio.gather(*[chat_client.achat(message_list) for message_list in messages])
+        finally:
+            await pool.aclose()
+
+    start = time.time()
+    responses = asyncio.run(_run())
+    print(f"Async: {len(responses)} responses in {time.time() - start:.2f}s")
+    print(f"Endpoints: {pool.stats()}")
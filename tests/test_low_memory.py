@@ -0,0 +1,37 @@
+import sys
+sys.path.insert(0, './')
+
+import tracemalloc
+
+from paper2cmap import PaperReader, logger
+from paper2cmap.text_store import TextStore
+
+logger.setLevel("INFO")
+
+
+def load(low_memory: bool) -> PaperReader:
+    # the catelogue is found locally, so no LLM is needed
+    paper_reader = PaperReader(chatbot=None, catelogue_mode="local", low_memory=low_memory)
+    tracemalloc.start()
+    paper_reader.load("tests/examples/attentionisallyouneed.pdf")
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"low_memory={low_memory}: {len(paper_reader.sections)} sections, retained {current / 1e6:.1f} MB, peak {peak / 1e6:.1f} MB")
+    return paper_reader
+
+
+if __name__ == "__main__":
+    in_memory, spilled = load(low_memory=False), load(low_memory=True)
+    print(f"Sections: {spilled.sections}")
+    print(f"Same sections: {list(spilled.sections) == in_memory.sections}")
+    print(f"First section: {spilled.sections[0][:200]}")
+
+    # a 1,000 page document of about 3,000 characters per page
+    store = TextStore()
+    tracemalloc.start()
+    ranges = [store.append(f"Page {i}. " + "lorem ipsum dolor sit amet " * 110) for i in range(1000)]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{len(store)} characters spilled, retained {current / 1e6:.2f} MB, peak {peak / 1e6:.2f} MB")
+    print(f"Page 500: {store[ranges[500][0]:ranges[500][0] + 40]!r}")
+    store.close()
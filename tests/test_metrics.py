@@ -0,0 +1,29 @@
+import sys
+sys.path.insert(0, './')
+
+import time
+
+from paper2cmap import Metrics
+
+if __name__ == "__main__":
+    metrics = Metrics()
+    metrics.add_callback(lambda event: print(f"Event: {event}"))
+
+    with metrics.span("section", index=0):
+        with metrics.span("generate", index=0):
+            time.sleep(0.01)
+            metrics.increment("llm_calls", tag="generate")
+            metrics.increment("llm_prompt_tokens", 1200, tag="generate")
+            metrics.increment("llm_completion_tokens", 150, tag="generate")
+        metrics.increment("llm_cache_hits", tag="preprocess")
+
+    try:
+        with metrics.span("merge"):
+            raise RuntimeError("merge failed")
+    except RuntimeError:
+        pass
+
+    print(f"Prompt tokens: {metrics.counter('llm_prompt_tokens', tag='generate')}")
+    print(f"Cost: {metrics.cost(prompt_price=0.0015, completion_price=0.002):.4f}")
+    print(metrics.to_json())
+    print(metrics.to_prometheus())
@@ -0,0 +1,31 @@
+import sys
+sys.path.insert(0, './')
+
+from paper2cmap import logger
+from paper2cmap.output_parser import TripleParser, parse_fused, parse_titles, parse_triples
+
+logger.setLevel("DEBUG")
+
+if __name__ == "__main__":
+    outputs = [
+        '[["Transformer", "is based on", "self-attention"], ["encoder", "feeds", "decoder"]]',
+        'Here is the concept map:\n```json\n[["Transformer", "is based on", "self-attention"],\n ["encoder", "feeds", "decoder"],\n]\n```',
+        '[{"source": "Transformer", "target": "self-attention", "relationship": "is based on"}, ["encoder", "feeds", "decoder"]]',
+        '[["Transformer", "is based on", "self-attention"], ["encoder"], ["encoder", "feeds", "decoder"]]',
+        '[["Transformer", "is based on", "self-attention"], ["encoder", "feeds", "decoder"], ["decoder", "gene',
+    ]
+    for output in outputs:
+        cmap, complete = parse_triples(output)
+        print(f"Parsed (complete: {complete}): {cmap}")
+
+    # the relationships come out one by one as the completion is streamed
+    parser = TripleParser()
+    for i in range(0, len(outputs[1]), 8):
+        for triple in parser.feed(outputs[1][i:i + 8]):
+            print(f"Streamed: {triple}")
+    print(f"Stream complete: {parser.complete}")
+
+    fused = '{"summary": "The Transformer uses attention.", "cmap": [["Transformer", "uses", "attention"], ["enc'
+    print(f"Fused: {parse_fused(fused)}")
+    titles = '```json\n{"titles": ["1 Introduction", "2 Background",]}\n```'
+    print(f"Titles: {parse_titles(titles)}")
@@ -0,0 +1,56 @@
+import sys
+sys.path.insert(0, './')
+
+import time
+
+from paper2cmap import Paper2CMap, PaperReader, SectionPlanner, logger
+from paper2cmap.evaluation import compare_cmaps, concept_grounding
+from paper2cmap.planner import _resolve_types, classify_section
+
+logger.setLevel("INFO")
+
+if __name__ == "__main__":
+    demo_pdfs = [
+        "./tests/examples/attentionisallyouneed.pdf",
+        "./tests/examples/bert.pdf",
+        "./tests/examples/ashortsurvey.pdf",
+    ]
+
+    # the plan is computed locally, so no LLM is needed to inspect it
+    paper_reader = PaperReader(chatbot=None, catelogue_mode="local")
+    paper_reader.load(demo_pdfs[0])
+    for entry in SectionPlanner(max_tokens=8000).plan(paper_reader.sections):
+        title = paper_reader.sections[entry["index"]].split("\n")[0]
+        print(f"{entry['index']:>3} {title[:40]:<40} {entry['type']:<14} {entry['tokens']:>5} tokens  gain {entry['gain']:>6}  {entry['reason']}")
+
+    # the conclusion survives a tight budget, and subsections take the type of their section
+    for demo_pdf in demo_pdfs:
+        paper_reader = PaperReader(chatbot=None, catelogue_mode="local")
+        paper_reader.load(demo_pdf)
+        plan = SectionPlanner(max_tokens=8000).plan(paper_reader.sections)
+        conclusions = [entry for entry in plan if entry["type"] == "conclusion"]
+        print(f"{demo_pdf} conclusion: {[(entry['index'], entry['reason']) for entry in conclusions]}")
+        assert conclusions and all(entry["selected"] for entry in conclusions), plan
+
+    titles = ["1 Introduction", "3 BERT", "3.1 Pre-training BERT", "4 Why Self-Attention", "5 Ablation Studies",
+              "5.2 Effect of Model Size", "6 Conclusion"]
+    section_types = _resolve_types([classify_section(title) for title in titles], [title.split(" ")[0] for title in titles])
+    print(f"Section types: {dict(zip(titles, section_types))}")
+    assert section_types == ["introduction", "method", "method", "method", "results", "results", "conclusion"], section_types
+
+    # compare the concept maps of all the sections with those of the sections selected within a budget
+    for demo_pdf in demo_pdfs:
+        cmaps = {}
+        for name, planner in [("all", None), ("planned", SectionPlanner()), ("budget", SectionPlanner(max_tokens=8000))]:
+            paper2cmap = Paper2CMap()
+            paper2cmap.load(demo_pdf)
+
+            start = time.time()
+            cmaps[name] = paper2cmap.generate_cmap(max_workers=4, planner=planner)
+            full_text = "\n".join(paper2cmap.paper_reader.sections)
+            print(f"{demo_pdf} [{name}] {time.time() - start:.1f}s, {paper2cmap.chat_client.usage()}")
+            print(f"  Sections: {sum(entry['selected'] for entry in paper2cmap.section_plan) if planner else len(paper2cmap.paper_reader.sections)}")
+            print(f"  Grounding: {concept_grounding(cmaps[name], full_text):.2f}")
+
+        print(f"{demo_pdf} planned against all: {compare_cmaps(cmaps['all'], cmaps['planned'])}")
+        print(f"{demo_pdf} budget against all: {compare_cmaps(cmaps['all'], cmaps['budget'])}")
@@ -0,0 +1,38 @@
+import sys
+sys.path.insert(0, './')
+
+import time
+
+from paper2cmap import Paper2CMap, logger
+from paper2cmap.evaluation import compare_cmaps, concept_grounding
+
+logger.setLevel("INFO")
+
+if __name__ == "__main__":
+    # compare the two-pass and the fused section modes on the bundled papers
+    demo_pdfs = [
+        "./tests/examples/attentionisallyouneed.pdf",
+        "./tests/examples/bert.pdf",
+        "./tests/examples/ashortsurvey.pdf",
+    ]
+
+    for demo_pdf in demo_pdfs:
+        cmaps = {}
+        for section_mode in ["two_pass", "fused"]:
+            paper2cmap = Paper2CMap()
+            paper2cmap.load(demo_pdf)
+
+            start = time.time()
+            cmaps[section_mode] = paper2cmap.generate_cmap(
+                max_num_concepts=15,
+                max_num_relationships=30,
+                max_workers=4,
+                section_mode=section_mode,
+                fused_summary=True,
+            )
+            full_text = "\n".join(paper2cmap.paper_reader.sections)
+            print(f"{demo_pdf} [{section_mode}] {time.time() - start:.1f}s, {paper2cmap.chat_client.usage()}")
+            print(f"  Grounding: {concept_grounding(cmaps[section_mode], full_text):.2f}")
+            print(f"  Summary of section 0: {paper2cmap.section_summaries.get(0)}")
+
+        print(f"{demo_pdf} fused against two_pass: {compare_cmaps(cmaps['two_pass'], cmaps['fused'])}")
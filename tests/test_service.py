@@ -0,0 +1,45 @@
+import sys
+sys.path.insert(0, './')
+
+import os
+import time
+
+from paper2cmap import logger
+from paper2cmap.service import CMapService, QueueFullError
+
+logger.setLevel("INFO")
+
+if __name__ == "__main__":
+    demo_pdfs = [
+        "./tests/examples/attentionisallyouneed.pdf",
+        "./tests/examples/bert.pdf",
+        "./tests/examples/ashortsurvey.pdf",
+    ]
+    credentials = {
+        "api_type": os.environ.get("OPENAI_API_TYPE", "openai"),
+        "api_key": os.environ["OPENAI_API_KEY"],
+        "model_name": os.environ.get("OPENAI_MODEL_NAME", "gpt-3.5-turbo"),
+    }
+
+    service = CMapService(num_workers=1, max_queue_size=1)
+    jobs = [service.submit(demo_pdfs[0], credentials=credentials, max_workers=4)]
+    time.sleep(1)
+    jobs.append(service.submit(demo_pdfs[1], credentials=credentials, max_workers=4))
+    try:
+        service.submit(demo_pdfs[2], credentials=credentials, max_workers=4)
+    except QueueFullError as e:
+        print(f"Rejected: {e}")
+    print(f"Joined the running job: {service.submit(demo_pdfs[0], credentials=credentials, max_workers=4) is jobs[0]}")
+
+    for job in jobs:
+        start = time.time()
+        for event in service.stream(job):
+            if event["type"] != "section":
+                print(f"Job {job.id}: {event['type']} {event.get('position', '')}")
+        print(f"Job {job.id} {job.status} after {time.time() - start:.1f}s: {job.result}")
+
+    # an identical submission returns the finished result at once
+    start = time.time()
+    job = service.submit(demo_pdfs[0], credentials=credentials, max_workers=4)
+    print(f"Reused job {job.id} {job.status} in {time.time() - start:.3f}s, {service.stats()}")
+    service.close()
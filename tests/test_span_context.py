@@ -0,0 +1,29 @@
+import sys
+sys.path.insert(0, './')
+sys.path.insert(0, './benchmarks')
+
+from fake_chat_model import FakeChatModel
+
+from paper2cmap import Paper2CMap, logger, metrics
+
+logger.setLevel("INFO")
+
+if __name__ == "__main__":
+    demo_pdf = "./tests/examples/bert.pdf"
+
+    # sections generated in worker threads still report the paper span as their parent
+    spans = []
+    metrics.add_callback(lambda event: spans.append(event) if event["type"] == "span" else None)
+
+    paper2cmap = Paper2CMap(chatbot=FakeChatModel(), catelogue_mode="local")
+    paper2cmap.load(demo_pdf)
+    for name, generate in [
+        ("generate_cmap", lambda: paper2cmap.generate_cmap(max_workers=4, merge_mode="tree", merge_token_budget=500)),
+        ("generate_cmap_iter", lambda: list(paper2cmap.generate_cmap_iter(max_workers=4))),
+    ]:
+        spans.clear()
+        with metrics.span("paper", path=demo_pdf):
+            generate()
+        parents = {(span["name"], span["parent"]) for span in spans if span["name"] in ("section", "merge")}
+        print(f"{name}: {sorted(parents, key=str)}")
+        assert ("section", "paper") in parents and ("section", None) not in parents, parents
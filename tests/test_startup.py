@@ -0,0 +1,31 @@
+import sys
+sys.path.insert(0, './')
+
+import time
+
+start = time.perf_counter()
+import paper2cmap
+print(f"import paper2cmap: {time.perf_counter() - start:.3f}s, heavy modules loaded: "
+      f"{sorted(name for name in ('langchain', 'openai', 'pdfminer', 'yaml') if name in sys.modules)}")
+
+from paper2cmap import CMapGPT, ChatClient, Paper2CMap, logger
+
+logger.setLevel("INFO")
+
+if __name__ == "__main__":
+    chat_client = ChatClient(None)
+
+    start = time.perf_counter()
+    Paper2CMap(chatbot=chat_client)
+    print(f"First Paper2CMap: {(time.perf_counter() - start) * 1e6:.0f}us")
+
+    # the prompts are compiled on first use, once per process
+    start = time.perf_counter()
+    CMapGPT(chat_client).generate_prompt
+    print(f"Prompts compiled in {time.perf_counter() - start:.3f}s")
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        Paper2CMap(chatbot=chat_client).cmap_gpt.generate_prompt
+    print(f"Next Paper2CMap: {(time.perf_counter() - start) / 1000 * 1e6:.0f}us")
+    print(f"Shared prompts: {CMapGPT(chat_client).prompts is CMapGPT(chat_client).prompts}")
@@ -0,0 +1,31 @@
+import sys
+sys.path.insert(0, './')
+sys.path.insert(0, './benchmarks')
+
+from fake_chat_model import FakeChatModel
+
+from paper2cmap import Paper2CMap, logger, metrics
+
+logger.setLevel("INFO")
+
+if __name__ == "__main__":
+    demo_pdf = "./tests/examples/bert.pdf"
+
+    # the model answers one section with garbage, even when asked again: that section is skipped, not the paper
+    paper2cmap = Paper2CMap(chatbot=FakeChatModel(garbage_pattern="Effect of Model Size"), catelogue_mode="local")
+    paper2cmap.load(demo_pdf)
+    events = list(paper2cmap.generate_cmap_iter(section_mode="fused", max_workers=4))
+    skipped = [event["index"] for event in events if event["type"] == "section" and event["cmap"] is None]
+    print(f"Skipped sections: {skipped}, counted: {metrics.counter('skipped_sections')}")
+    print(f"Concept map: {events[-1]['cmap']}")
+    assert len(skipped) == 1 and events[-1]["type"] == "final" and events[-1]["cmap"], events[-1]
+
+    # the job only fails when every section does
+    paper2cmap = Paper2CMap(chatbot=FakeChatModel(garbage_pattern="concept map"), catelogue_mode="local")
+    paper2cmap.load(demo_pdf)
+    try:
+        paper2cmap.generate_cmap(max_workers=4)
+    except ValueError as e:
+        print(f"Failed: {e}")
+    else:
+        raise AssertionError("Expected a ValueError")